@@ -0,0 +1,71 @@
+# api_cache.py
+# Result cache for the dashboard JSON API (/api/<table>), shared by every
+# request thread. A page is stored as ready-to-send JSON bytes plus its ETag
+# and is reused until it is older than the TTL or the table's change counter
+# (database.table_generation) moves, so a poll that finds nothing new costs a
+# dict lookup and, with If-None-Match, an empty 304.
+import hashlib
+import json
+import os
+import threading
+import time
+import metrics
+from database import fetch_page, table_generation, PAGE_QUERIES
+
+# Seconds a cached page may be served (set `PCDT_API_CACHE_TTL`; DB config `API_CACHE_TTL` overrides at startup)
+TTL = float(os.environ.get("PCDT_API_CACHE_TTL", "2"))
+# Default and largest page size
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+# Cached pages kept before the oldest are dropped
+MAX_ENTRIES = 256
+
+TABLES = tuple(PAGE_QUERIES)
+
+_lock = threading.Lock()
+_entries = {}  # (table, before, limit) -> (expires, generation, body, etag)
+
+def set_ttl(seconds):
+    global TTL
+    TTL = max(0.0, float(seconds))
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+def _build(table, before, limit):
+    # one extra row tells us whether there is a next page
+    rows = fetch_page(table, before, limit + 1)
+    columns = PAGE_QUERIES[table][2]
+    more = len(rows) > limit
+    rows = rows[:limit]
+    payload = {
+        "table": table,
+        "items": [dict(zip(columns, r)) for r in rows],
+        "next_cursor": rows[-1][0] if more else None,
+    }
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    return body, hashlib.sha1(body).hexdigest()
+
+def get_page(table, before=None, limit=PAGE_SIZE):
+    """Return (json body bytes, unquoted etag) for one page of `table`, from the cache when fresh."""
+    key = (table, before, limit)
+    generation = table_generation(table)
+    now = time.monotonic()
+    with _lock:
+        entry = _entries.get(key)
+    if entry and entry[0] > now and entry[1] == generation:
+        metrics.inc("pcdt_api_cache_total", table=table, result="hit")
+        return entry[2], entry[3]
+    metrics.inc("pcdt_api_cache_total", table=table, result="miss")
+    body, etag = _build(table, before, limit)
+    with _lock:
+        if len(_entries) >= MAX_ENTRIES:
+            # drop expired pages, or the oldest quarter if none have expired
+            stale = [k for k, e in _entries.items() if e[0] <= now]
+            if not stale:
+                stale = sorted(_entries, key=lambda k: _entries[k][0])[:MAX_ENTRIES // 4]
+            for k in stale:
+                del _entries[k]
+        _entries[key] = (now + TTL, generation, body, etag)
+    return body, etag
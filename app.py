@@ -1,11 +1,18 @@
 # app.py
-from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory
-from database import init_db, insert_user, get_user_by_username, store_plaintext, delete_plaintext_for_user, fetch_pcfg_rows, fetch_jtr_rows, fetch_recent_alerts, fetch_recent_logs, insert_login_log, set_config, get_config
+from flask import Flask, render_template, request, redirect, url_for, flash, session, send_from_directory, jsonify, g, Response
+from database import init_db, insert_user, get_user_by_username, store_plaintext, delete_plaintext_for_user, fetch_pcfg_rows, fetch_jtr_rows, fetch_recent_alerts, fetch_recent_logs, insert_login_log, set_config, get_config, start_async_writer, ASYNC_WRITES, WRITE_BATCH_SIZE, WRITE_FLUSH_INTERVAL
 from utils import hash_password_sha512, verify_password_sha512, fingerprint_password
-from pcfg_utils import analyze_and_store, estimate_guesses
-from jtr_utils import run_full_audit_all_users
-from detection import run_detection_once
-from simulate_engine import simulate
+from pcfg_utils import analyze_and_store, estimate_guesses, load_pcfg_model, load_rank_filter
+from audit_jobs import fail_stale_jobs, submit_audit, cancel_audit, pause_audit, resume_audit, job_status, list_jobs
+from detection import run_detection_once, enable_streaming
+from simulate_engine import simulate, simulate_load
+from profiler import start_profiler_watcher, collapsed, is_running, sample_count
+from retention import start_retention_thread
+from leader import Lease, run_while_leader
+from user_cache import get_user, cache_stats
+from rate_limit import check_login
+import api_cache
+import metrics
 import threading, time, os, tempfile
 
 app = Flask(__name__)
@@ -14,7 +21,31 @@ app.secret_key = "replace_this_secret"
 # ensure DB
 init_db()
 
-# start detection background loop
+# "multi" when several worker processes share the database: one of them holds
+# the leader lease (leader.py) and runs detection and log retention for all
+WORKER_MODE = get_config("WORKER_MODE", os.environ.get("PCDT_WORKER_MODE", "single"))
+
+# jobs that were running when the app last stopped will never finish; a job
+# whose process still holds the audit lease (a sibling worker) is left alone
+fail_stale_jobs()
+
+# optional group-commit writer for login logs and alerts
+if get_config("ASYNC_WRITES", ASYNC_WRITES) == "1":
+    start_async_writer(int(get_config("WRITE_BATCH_SIZE", WRITE_BATCH_SIZE)),
+                       float(get_config("WRITE_FLUSH_INTERVAL", WRITE_FLUSH_INTERVAL)))
+
+# dashboard JSON API cache lifetime
+api_cache.set_ttl(get_config("API_CACHE_TTL", api_cache.TTL))
+
+# load the trained PCFG model once (estimate_guesses falls back to heuristics without one)
+load_pcfg_model()
+# wordlist rank lookup for the strength checker (built in the background on first run)
+load_rank_filter()
+
+# detection: "stream" (default) feeds every logged attempt straight into the
+# detector; "poll" keeps the old loop that rescans recent logs every 5 seconds
+DETECTION_MODE = get_config("DETECTION_MODE", os.environ.get("DETECTION_MODE", "stream"))
+
 def detection_loop():
     while True:
         try:
@@ -23,8 +54,21 @@ def detection_loop():
             print("detection error:", e)
         time.sleep(5)
 
-t = threading.Thread(target=detection_loop, daemon=True)
-t.start()
+if WORKER_MODE == "multi":
+    # each worker sees only its own requests, so the leader polls the shared log instead of streaming
+    leader_lease = Lease("leader").start()
+    run_while_leader(leader_lease, run_detection_once, 5, "detection")
+elif DETECTION_MODE == "poll":
+    t = threading.Thread(target=detection_loop, daemon=True)
+    t.start()
+else:
+    enable_streaming()
+
+# sampling profiler, switched on/off with the `PROFILER` config key
+start_profiler_watcher()
+
+# hourly archival of old login_logs rows (`LOG_RETENTION_DAYS`, 0 = off)
+start_retention_thread(leader_lease.is_held if WORKER_MODE == "multi" else None)
 
 # ensure admin exists: username 'admin' with password 'AdminPass123!' (SHA512)
 try:
@@ -33,6 +77,20 @@ try:
 except Exception:
     pass
 
+# ----- request metrics -----
+@app.before_request
+def _start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def _record_request(response):
+    start = g.get("request_start")
+    if start is not None:
+        endpoint = request.endpoint or "unknown"
+        metrics.observe("pcdt_http_request_seconds", time.perf_counter() - start, endpoint=endpoint)
+        metrics.inc("pcdt_http_requests_total", endpoint=endpoint, method=request.method, status=response.status_code)
+    return response
+
 # ----- ROUTES -----
 @app.route("/")
 def index():
@@ -72,7 +130,14 @@ def login():
         password = request.form.get("password","")
         ip = request.headers.get("X-Forwarded-For") or request.remote_addr
 
-        row = get_user_by_username(username)
+        # shed over-limit and blocked clients before any hashing or DB work
+        throttled = check_login(ip, username)
+        if throttled:
+            retry_after = max(1, int(min(throttled[1], 3600)) + 1)
+            return Response("too many login attempts\n", status=429, mimetype="text/plain",
+                            headers={"Retry-After": str(retry_after)})
+
+        row = get_user(username)
         fingerprint = fingerprint_password(password)
 
         if not row:
@@ -115,21 +180,72 @@ def admin_dashboard():
     logs = fetch_recent_logs(200)
     return render_template("admin_dashboard.html", pcfg=pcfg, jtr=jtr, alerts=alerts, logs=logs)
 
-# run full audit in a background thread
+# queue a full audit as a background job (one at a time, see audit_jobs.py)
 @app.route("/run_audit", methods=["POST"])
 def run_audit():
     if not session.get("is_admin"):
         flash("admin only", "error")
         return redirect(url_for("login"))
-    def worker():
-        try:
-            run_full_audit_all_users()
-        except Exception as e:
-            print("audit error:", e)
-    threading.Thread(target=worker, daemon=True).start()
-    flash("audit started (30s per user cap)", "info")
+    job_id, created = submit_audit()
+    if created:
+        flash(f"audit job {job_id} started", "info")
+    elif job_id is None:
+        flash("an audit is starting in another worker", "info")
+    else:
+        flash(f"audit job {job_id} is already running", "info")
     return redirect(url_for("admin_dashboard"))
 
+# audit job progress and control (JSON, polled by the dashboard)
+@app.route("/audit_jobs")
+def audit_jobs_list():
+    if not session.get("is_admin"):
+        return jsonify({"error": "admin only"}), 403
+    return jsonify(list_jobs(int(request.args.get("limit", 20))))
+
+@app.route("/audit_jobs/<int:job_id>")
+def audit_job_status(job_id):
+    if not session.get("is_admin"):
+        return jsonify({"error": "admin only"}), 403
+    job = job_status(job_id)
+    if not job:
+        return jsonify({"error": "no such job"}), 404
+    return jsonify(job)
+
+@app.route("/audit_jobs/<int:job_id>/<action>", methods=["POST"])
+def audit_job_action(job_id, action):
+    if not session.get("is_admin"):
+        return jsonify({"error": "admin only"}), 403
+    actions = {"cancel": cancel_audit, "pause": pause_audit, "resume": resume_audit}
+    if action not in actions:
+        return jsonify({"error": "unknown action"}), 404
+    ok = actions[action](job_id)
+    return jsonify({"ok": ok, "job": job_status(job_id)}), (200 if ok else 409)
+
+# paginated JSON over the dashboard tables: /api/<pcfg|jtr|alerts|logs>?limit=N&cursor=C,
+# where C is the next_cursor of the previous page. Pages are cached (api_cache.py) and
+# carry an ETag, so a poll with If-None-Match gets an empty 304 when nothing changed.
+@app.route("/api/<table>")
+def api_table(table):
+    if not session.get("is_admin"):
+        return jsonify({"error": "admin only"}), 403
+    if table not in api_cache.TABLES:
+        return jsonify({"error": "unknown table"}), 404
+    try:
+        limit = min(max(1, int(request.args.get("limit", api_cache.PAGE_SIZE))), api_cache.MAX_PAGE_SIZE)
+        cursor = request.args.get("cursor")
+        cursor = int(cursor) if cursor else None
+    except ValueError:
+        return jsonify({"error": "limit and cursor must be integers"}), 400
+    body, etag = api_cache.get_page(table, cursor, limit)
+    if etag in request.if_none_match:
+        metrics.inc("pcdt_api_cache_total", table=table, result="not_modified")
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
 # simulate page and file upload (wordlist)
 @app.route("/simulate", methods=["GET","POST"])
 def simulate_page():
@@ -142,6 +258,11 @@ def simulate_page():
         passwords = [p.strip() for p in request.form.get("passwords","").split(",") if p.strip()]
         ip = request.form.get("ip") or "1.2.3.4"
         count = int(request.form.get("count") or 3)
+        mode = request.form.get("mode") or "sequential"
+        concurrency = int(request.form.get("concurrency") or 0) or None
+        rps = float(request.form.get("rps") or 0)
+        ip_mode = request.form.get("ip_mode") or "fixed"
+        wsgi_app = app if request.form.get("backend") == "wsgi" else None
 
         # handle uploaded file
         wordlist_file = None
@@ -154,7 +275,12 @@ def simulate_page():
 
         def worker():
             try:
-                simulate(attack_type, usernames, passwords, ip, count, wordlist_file)
+                if mode == "load":
+                    report = simulate_load(attack_type, usernames, passwords, ip, count, wordlist_file,
+                                           concurrency, rps, ip_mode, wsgi_app=wsgi_app)
+                    print("simulation report:", report)
+                else:
+                    simulate(attack_type, usernames, passwords, ip, count, wordlist_file)
             except Exception as e:
                 print("simulate worker error:", e)
             finally:
@@ -178,6 +304,22 @@ def check_password():
         result = {"guesses": guesses, "pattern": pattern}
     return render_template("check_password.html", result=result)
 
+# Prometheus scrape target
+@app.route("/metrics")
+def metrics_endpoint():
+    metrics.set_gauge("pcdt_profiler_running", 1 if is_running() else 0)
+    for kind, n in cache_stats().items():
+        metrics.set_gauge("pcdt_user_cache_entries", n, kind=kind)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+# collapsed stacks from the sampling profiler (?reset=1 clears them)
+@app.route("/debug/profile")
+def debug_profile():
+    if not session.get("is_admin"):
+        return Response("admin only\n", status=403, mimetype="text/plain")
+    body = collapsed(reset=request.args.get("reset") == "1")
+    return Response(body, mimetype="text/plain", headers={"X-Profile-Samples": str(sample_count())})
+
 # static route for uploads if needed (not used)
 @app.route('/static/<path:filename>')
 def static_files(filename):
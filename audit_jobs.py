@@ -0,0 +1,232 @@
+# audit_jobs.py
+# Audit jobs: a single-flight scheduler in front of run_full_audit_all_users.
+# At most one job is queued or running; submitting while one is active returns
+# that job. Progress (users done, candidates hashed, hashes per second, wordlist
+# offset, ETA) is kept in memory for polling and written to the audit_jobs
+# table about once a second. Cancel and pause both stop the scan at its next
+# progress check; a paused job can be resumed and continues from the per-user
+# audit checkpoints. A queued or running job holds the "audit" lease (see
+# leader.py), so with several app processes or an import_hashes.py --audit
+# next to the server still only one audit runs at a time.
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from database import (create_audit_job, update_audit_job, get_audit_job, fetch_audit_jobs, get_active_audit_job,
+                      fail_stale_audit_jobs)
+from jtr_utils import run_full_audit_all_users, set_audit_progress
+from john_session import cancel_active_session
+from leader import Lease
+
+# Seconds between progress writes to the audit_jobs table
+PROGRESS_INTERVAL = 1.0
+# Lease held by the process whose job is queued or running
+LEASE_NAME = "audit"
+
+# One scheduler thread; the scan itself fans out over `JTR_WORKERS` processes
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="audit")
+_lock = threading.Lock()
+_current = None  # JobProgress of the queued or running job
+
+class JobProgress:
+    """Live counters for one job; jtr_utils reports into it while the job runs."""
+
+    def __init__(self, job_id, full, candidates=0):
+        self.job_id = job_id
+        self.full = full
+        self.status = "queued"
+        self.users_total = 0
+        self.users_done = 0
+        self.candidates = candidates
+        self.offset = 0
+        self.size = None
+        self.hps = 0.0
+        self.eta_seconds = None
+        self.stop = None  # "cancelled" or "paused" once requested
+        self.lease = None  # the audit Lease while queued or running
+        self._scan_start = None  # (time, offset) when the current wordlist scan began
+        self._last = (time.time(), candidates)  # (time, candidates) at the last write
+
+    # --- called from jtr_utils ---
+    def begin(self, users_pending):
+        # a resumed job counts only what is still pending: users finished before
+        # the pause are skipped by their checkpoints, the rest are scanned again
+        self.users_total = users_pending
+        self.users_done = 0
+        self._write()
+
+    def begin_scan(self, size, offset):
+        self.size = size
+        self.offset = offset
+        self._scan_start = (time.time(), offset)
+
+    def tick(self, candidates, offset=None):
+        self.candidates += candidates
+        if offset is not None:
+            self.offset = offset
+        if time.time() - self._last[0] >= PROGRESS_INTERVAL:
+            self._write()
+        return self.stop is not None
+
+    def finished_users(self, n):
+        self.users_done += n
+        self._write()
+
+    def stop_requested(self):
+        return self.stop is not None
+
+    # --- scheduler side ---
+    def _update_rates(self):
+        now = time.time()
+        last_time, last_candidates = self._last
+        if now > last_time:
+            self.hps = (self.candidates - last_candidates) / (now - last_time)
+        self._last = (now, self.candidates)
+        self.eta_seconds = None
+        if self.size and self._scan_start:
+            began, first_offset = self._scan_start
+            done = self.offset - first_offset
+            if done > 0:
+                self.eta_seconds = round((self.size - self.offset) * (now - began) / done, 1)
+
+    def _write(self):
+        self._update_rates()
+        try:
+            update_audit_job(self.job_id, users_total=self.users_total, users_done=self.users_done,
+                             candidates=self.candidates, hps=round(self.hps, 1),
+                             wordlist_offset=self.offset, eta_seconds=self.eta_seconds)
+        except Exception as e:
+            print("audit progress write error:", e)
+
+    def snapshot(self):
+        return {
+            "id": self.job_id,
+            "status": self.status,
+            "full": 1 if self.full else 0,
+            "users_total": self.users_total,
+            "users_done": self.users_done,
+            "candidates": self.candidates,
+            "hps": round(self.hps, 1),
+            "wordlist_offset": self.offset,
+            "wordlist_size": self.size,
+            "eta_seconds": self.eta_seconds,
+            "stop_requested": self.stop,
+        }
+
+def _run(progress):
+    global _current
+    status = "done"
+    error = None
+    try:
+        if progress.stop:
+            status = progress.stop
+            return
+        progress.status = "running"
+        update_audit_job(progress.job_id, status="running", started_at=datetime.utcnow().isoformat())
+        set_audit_progress(progress)
+        run_full_audit_all_users(progress.full)
+        if progress.stop:
+            status = progress.stop
+    except Exception as e:
+        print("audit error:", e)
+        status = "failed"
+        error = str(e)
+    finally:
+        set_audit_progress(None)
+        progress.status = status
+        progress._write()
+        try:
+            update_audit_job(progress.job_id, status=status, error=error, finished_at=datetime.utcnow().isoformat())
+        finally:
+            # after the final status, so whoever takes the lease next never sees this job as active
+            progress.lease.release()
+            with _lock:
+                if _current is progress:
+                    _current = None
+
+def _take_lease():
+    """The audit lease, heartbeated in the background, or None if another process holds it."""
+    lease = Lease(LEASE_NAME)
+    if not lease.heartbeat():
+        return None
+    # nobody else can be running a job now, so any still marked active is left over
+    fail_stale_audit_jobs()
+    return lease.start()
+
+def _start(progress, lease):
+    global _current
+    progress.lease = lease
+    _current = progress
+    _executor.submit(_run, progress)
+
+def fail_stale_jobs():
+    """Mark jobs as interrupted if they are active but nobody holds the audit lease (call at startup)."""
+    fail_stale_audit_jobs(LEASE_NAME)
+
+def submit_audit(full=False):
+    """Queue an audit unless one is already active. Returns (job id, True if newly queued).
+
+    The job id is None if another process holds the lease but has not
+    recorded its job yet.
+    """
+    with _lock:
+        if _current is not None:
+            return _current.job_id, False
+        lease = _take_lease()
+        if lease is None:
+            return get_active_audit_job(), False
+        job_id = create_audit_job(full)
+        _start(JobProgress(job_id, full), lease)
+        return job_id, True
+
+def resume_audit(job_id):
+    """Re-queue a paused job; it continues from the audit checkpoints. Returns True if queued."""
+    with _lock:
+        if _current is not None:
+            return False
+        job = get_audit_job(job_id)
+        if not job or job["status"] != "paused":
+            return False
+        lease = _take_lease()
+        if lease is None:
+            return False
+        update_audit_job(job_id, status="queued", finished_at=None)
+        # never re-clear results on resume, even for a full audit
+        _start(JobProgress(job_id, False, job["candidates"] or 0), lease)
+        return True
+
+def _request_stop(job_id, reason):
+    with _lock:
+        progress = _current
+    if progress is None or progress.job_id != job_id:
+        return False
+    progress.stop = reason
+    cancel_active_session()
+    return True
+
+def cancel_audit(job_id):
+    """Stop the active job for good (its checkpoints are still kept)."""
+    return _request_stop(job_id, "cancelled")
+
+def pause_audit(job_id):
+    """Stop the active job so that resume_audit can continue it later."""
+    return _request_stop(job_id, "paused")
+
+def job_status(job_id):
+    """Job row as a dict, with live counters if it is the active job."""
+    with _lock:
+        progress = _current
+    job = get_audit_job(job_id)
+    if job and progress is not None and progress.job_id == job_id:
+        job.update(progress.snapshot())
+    return job
+
+def list_jobs(limit=20):
+    """Recent jobs, the active one with live counters."""
+    with _lock:
+        progress = _current
+    jobs = fetch_audit_jobs(limit)
+    for job in jobs:
+        if progress is not None and job["id"] == progress.job_id:
+            job.update(progress.snapshot())
+    return jobs
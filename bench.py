@@ -0,0 +1,241 @@
+# bench.py
+# Benchmarks for the hot paths, run on synthetic data in a throwaway database.
+#
+#   python3 bench.py                       # everything, results in bench_results.json
+#   python3 bench.py --quick               # small sizes, for a fast before/after check
+#   python3 bench.py --only audit,detection --out before.json
+#
+# Each benchmark adds one section to the JSON output, so two runs can be diffed.
+import argparse
+import hashlib
+import json
+import os
+import platform
+import random
+import shutil
+import string
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import database
+import rank_filter
+import wordlist_index
+
+BENCHMARKS = ["jtr_hash", "audit", "login", "detection", "estimate"]
+
+# ----- synthetic data -----
+_WORD_CHARS = string.ascii_lowercase
+
+def gen_passwords(n, seed=0):
+    """Password-shaped strings: a word, sometimes capitalised, with digit/symbol suffixes."""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        word = "".join(rng.choice(_WORD_CHARS) for _ in range(rng.randint(4, 9)))
+        r = rng.random()
+        if r < 0.3:
+            word = word.capitalize()
+        if r < 0.6:
+            word += str(rng.randint(0, 9999))
+        if r < 0.15:
+            word += rng.choice("!@#$.")
+        out.append(word)
+    return out
+
+def gen_wordlist(path, n, seed=0):
+    """Write `n` synthetic passwords, one per line, to `path`."""
+    with open(path, "w") as f:
+        for i in range(0, n, 100000):
+            f.write("\n".join(gen_passwords(min(100000, n - i), seed + i)) + "\n")
+    return path
+
+def gen_users(n, wordlist=None, hit_rate=0.3, seed=0):
+    """Replace the users table with `n` users; about `hit_rate` of them use a wordlist password."""
+    rng = random.Random(seed)
+    words = []
+    if wordlist:
+        with open(wordlist) as f:
+            words = [l.strip() for l in f if l.strip()]
+    rows = []
+    for i, pw in enumerate(gen_passwords(n, seed + 1)):
+        if words and rng.random() < hit_rate:
+            pw = rng.choice(words)
+        else:
+            pw += "#nope"  # never in the wordlist
+        rows.append((f"bench{i}", hashlib.sha512(pw.encode()).hexdigest()))
+    with database._cursor() as c:
+        c.execute("DELETE FROM users")
+        c.executemany("INSERT INTO users (username, password_hash) VALUES (?, ?)", rows)
+    return n
+
+def gen_login_logs(n, span_seconds=86400, seed=0):
+    """Append `n` login attempts spread over the last `span_seconds`; ~80% are failures."""
+    rng = random.Random(seed)
+    now_ms = database.to_ms(datetime.utcnow())
+    statuses = ["fail_wrong_password"] * 6 + ["fail_no_user"] * 2 + ["success"] * 2
+    done = 0
+    while done < n:
+        batch = []
+        for _ in range(min(50000, n - done)):
+            ts = now_ms - rng.randint(0, span_seconds * 1000)
+            ip = f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+            iso = datetime.utcfromtimestamp(ts / 1000).isoformat()
+            batch.append((f"user{rng.randint(0, 5000)}", ip, rng.choice(statuses), "", iso, ts))
+        with database._cursor() as c:
+            c.executemany("INSERT INTO login_logs (username, ip, status, fingerprint, timestamp, ts) VALUES (?, ?, ?, ?, ?, ?)", batch)
+        done += len(batch)
+    return n
+
+# ----- benchmarks -----
+def bench_jtr_hash(args, wordlist):
+    """Hashes per second of run_jtr_on_hash scanning the whole wordlist for a miss."""
+    import jtr_utils
+    target = hashlib.sha512(b"not in the wordlist #nope").hexdigest()
+    t0 = time.perf_counter()
+    guesses, cracked, _, _ = jtr_utils.run_jtr_on_hash(0, target)
+    elapsed = time.perf_counter() - t0
+    return {"wordlist_lines": args.wordlist_lines, "workers": args.workers, "guesses": guesses,
+            "seconds": round(elapsed, 3), "hashes_per_second": round(guesses / elapsed, 1)}
+
+def bench_audit(args, wordlist):
+    """run_full_audit_all_users(full=True) wall time as the user count grows."""
+    import jtr_utils
+    out = []
+    for n in args.user_counts:
+        gen_users(n, wordlist, seed=n)
+        t0 = time.perf_counter()
+        results = jtr_utils.run_full_audit_all_users(full=True)
+        elapsed = time.perf_counter() - t0
+        out.append({"users": n, "seconds": round(elapsed, 3),
+                    "cracked": sum(1 for r in results if r[2]),
+                    "users_per_second": round(n / elapsed, 1)})
+    return out
+
+def bench_login(args, wordlist):
+    """/login latency percentiles, driven in-process through the WSGI app."""
+    from simulate_engine import simulate_load
+    from app import app
+    passwords = gen_passwords(args.login_attempts, seed=7)
+    report = simulate_load("bruteforce", ["admin"], passwords, "1.2.3.4", 1,
+                           concurrency=args.login_concurrency, rps=0, ip_mode="random", wsgi_app=app, seed=7)
+    report["concurrency"] = args.login_concurrency
+    return report
+
+def bench_detection(args, wordlist):
+    """run_detection_once time (median of 3) as login_logs grows."""
+    from detection import run_detection_once
+    with database._cursor() as c:
+        c.execute("DELETE FROM login_logs")
+    out = []
+    rows = 0
+    for size in args.log_sizes:
+        t0 = time.perf_counter()
+        gen_login_logs(size - rows, seed=size)
+        fill = time.perf_counter() - t0
+        rows = size
+        times = []
+        for _ in range(3):
+            t0 = time.perf_counter()
+            run_detection_once()
+            times.append(time.perf_counter() - t0)
+        out.append({"rows": size, "seconds": round(sorted(times)[1], 4), "fill_seconds": round(fill, 1)})
+    return out
+
+def bench_estimate(args, wordlist):
+    """estimate_guesses calls per second over synthetic passwords."""
+    import pcfg_utils
+    pcfg_utils.load_pcfg_model()
+    pcfg_utils.load_rank_filter(wordlist, background=False)
+    passwords = gen_passwords(args.estimate_calls, seed=11)
+    t0 = time.perf_counter()
+    for pw in passwords:
+        pcfg_utils.estimate_guesses(pw)
+    elapsed = time.perf_counter() - t0
+    return {"calls": len(passwords), "seconds": round(elapsed, 3),
+            "calls_per_second": round(len(passwords) / elapsed, 1),
+            "model": pcfg_utils.get_pcfg_model() is not None}
+
+def _setup(workdir, args):
+    """Point the app at a fresh database, wordlist and index directory inside `workdir`."""
+    database.DB = os.path.join(workdir, "bench.db")
+    wordlist_index.INDEX_DIR = workdir
+    rank_filter.INDEX_DIR = workdir
+    database.init_db()
+    wordlist = gen_wordlist(os.path.join(workdir, "wordlist.txt"), args.wordlist_lines)
+    for key, value in (("JTR_WORDLIST", wordlist), ("JTR_WORDLIST_INDEX", "1" if args.index else "0"),
+                       ("JTR_RULES", args.rules), ("JTR_WORKERS", str(args.workers)),
+                       ("JTR_MAX_SECONDS_PER_USER", "3600"),
+                       # measure the login path itself, not the 429 fast path
+                       ("RATE_LIMIT", "0")):
+        database.set_config(key, value)
+    # built up front so a background build in app.py does not skew the login numbers
+    rank_filter.get_rank_filter(wordlist)
+    return wordlist
+
+def _sizes(text):
+    return [int(float(x)) for x in text.split(",") if x]
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Benchmark the hot paths on synthetic data.")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--only", default=",".join(BENCHMARKS), help="comma-separated subset of " + ",".join(BENCHMARKS))
+    ap.add_argument("--quick", action="store_true", help="small sizes for a fast check")
+    ap.add_argument("--wordlist-lines", type=int, default=1000000)
+    ap.add_argument("--user-counts", type=_sizes, default=[10, 100, 1000, 10000])
+    ap.add_argument("--log-sizes", type=_sizes, default=[1000, 10000, 100000, 1000000, 10000000])
+    ap.add_argument("--login-attempts", type=int, default=5000)
+    ap.add_argument("--login-concurrency", type=int, default=1)
+    ap.add_argument("--estimate-calls", type=int, default=100000)
+    ap.add_argument("--workers", type=int, default=1, help="JTR_WORKERS for the scans")
+    ap.add_argument("--rules", default="none", help="JTR_RULES for the scans")
+    ap.add_argument("--index", action="store_true", help="let audits use the wordlist index")
+    ap.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    args = ap.parse_args(argv)
+    if args.quick:
+        args.wordlist_lines = min(args.wordlist_lines, 100000)
+        args.user_counts = [n for n in args.user_counts if n <= 100]
+        args.log_sizes = [n for n in args.log_sizes if n <= 100000]
+        args.login_attempts = min(args.login_attempts, 1000)
+        args.estimate_calls = min(args.estimate_calls, 10000)
+
+    selected = [b for b in args.only.split(",") if b]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        ap.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    workdir = tempfile.mkdtemp(prefix="pcdt_bench_")
+    results = {
+        "meta": {
+            "started_at": datetime.utcnow().isoformat(),
+            "python": sys.version.split()[0],
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("out", "keep")},
+        },
+    }
+    try:
+        wordlist = _setup(workdir, args)
+        for name in selected:
+            print(f"running {name} ...")
+            t0 = time.perf_counter()
+            try:
+                results[name] = globals()["bench_" + name](args, wordlist)
+            except Exception as e:
+                print(f"{name} failed:", e)
+                results[name] = {"error": str(e)}
+            print(f"  {name}: {json.dumps(results[name])} ({time.perf_counter() - t0:.1f}s)")
+    finally:
+        database.flush_writes()
+        if args.keep:
+            print("scratch directory:", workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print("wrote", args.out)
+    return results
+
+if __name__ == "__main__":
+    main()
@@ -1,221 +1,765 @@
 # database.py
+import atexit
+import os
+import queue
 import sqlite3
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
+import metrics
 
 DB = "pcdt.db"
+# SQLite page cache per connection in KiB (set `PCDT_SQLITE_CACHE_KB`)
+CACHE_KB = int(os.environ.get("PCDT_SQLITE_CACHE_KB", "16384"))
+# synchronous pragma; NORMAL is durable across app crashes in WAL mode (set `PCDT_SQLITE_SYNCHRONOUS`)
+SYNCHRONOUS = os.environ.get("PCDT_SQLITE_SYNCHRONOUS", "NORMAL")
+# seconds to wait on a locked database before raising (set `PCDT_SQLITE_BUSY_TIMEOUT`)
+BUSY_TIMEOUT = float(os.environ.get("PCDT_SQLITE_BUSY_TIMEOUT", "30"))
+
+# Group-commit writer for login_logs/alerts (see start_async_writer)
+ASYNC_WRITES = os.environ.get("PCDT_ASYNC_WRITES", "0")
+# rows per transaction (set `PCDT_WRITE_BATCH_SIZE`)
+WRITE_BATCH_SIZE = int(os.environ.get("PCDT_WRITE_BATCH_SIZE", "500"))
+# max seconds a queued row waits before its batch is committed (set `PCDT_WRITE_FLUSH_INTERVAL`)
+WRITE_FLUSH_INTERVAL = float(os.environ.get("PCDT_WRITE_FLUSH_INTERVAL", "0.05"))
+# queued rows before writers block (set `PCDT_WRITE_QUEUE_SIZE`)
+WRITE_QUEUE_SIZE = int(os.environ.get("PCDT_WRITE_QUEUE_SIZE", "10000"))
+
+_local = threading.local()
+
+class PooledConnection(sqlite3.Connection):
+    """Per-thread connection that outlives close() so helpers can reuse it.
+
+    close() only ends a transaction left open; the connection (and its
+    prepared-statement cache) stays with the thread until the thread exits.
+    """
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def really_close(self):
+        sqlite3.Connection.close(self)
+
+def _connect():
+    conn = sqlite3.connect(DB, timeout=BUSY_TIMEOUT, check_same_thread=False,
+                           factory=PooledConnection, cached_statements=256)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={SYNCHRONOUS}")
+    conn.execute(f"PRAGMA cache_size=-{CACHE_KB}")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    metrics.inc("pcdt_sqlite_connections_opened_total")
+    return conn
 
 def get_conn():
-    conn = sqlite3.connect(DB, check_same_thread=False)
+    """Return this thread's persistent connection, opening it on first use."""
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.db != DB:
+        if conn is not None:
+            conn.really_close()
+        conn = _connect()
+        _local.conn = conn
+        _local.db = DB
     return conn
 
-def init_db():
+@contextmanager
+def _cursor():
+    """Cursor on the thread's connection; commits on success, rolls back on error."""
     conn = get_conn()
-    c = conn.cursor()
-
-    # Users (store sha512 hex)
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT UNIQUE NOT NULL,
-        password_hash TEXT NOT NULL
-    )""")
-
-    # temporary plaintext storage (for PCFG analysis only)
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS plaintext_temp (
-        user_id INTEGER,
-        password TEXT,
-        created_at TEXT
-    )""")
-
-    # PCFG analysis
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS pcfg_analysis (
-        user_id INTEGER,
-        guesses INTEGER,
-        pattern TEXT,
-        created_at TEXT
-    )""")
-
-    # JTR results (store audit_time in milliseconds)
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS jtr_results (
-        user_id INTEGER,
-        guesses INTEGER,
-        cracked INTEGER,
-        cracked_password TEXT,
-        audit_time INTEGER
-    )""")
-
-    # login attempts logs
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS login_logs (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        username TEXT,
-        ip TEXT,
-        status TEXT,
-        fingerprint TEXT,
-        timestamp TEXT
-    )""")
-
-    # detection alerts
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS alerts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        alert_type TEXT,
-        details TEXT,
-        timestamp TEXT
-    )""")
-    # config table for runtime settings
-    c.execute("""
-    CREATE TABLE IF NOT EXISTS config (
-        key TEXT PRIMARY KEY,
-        value TEXT
-    )""")
-
-    conn.commit()
-    conn.close()
+    try:
+        yield conn.cursor()
+        if conn.in_transaction:
+            conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+def init_db():
+    with _cursor() as c:
+        # Users (store sha512 hex)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL
+        )""")
+
+        # temporary plaintext storage (for PCFG analysis only)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS plaintext_temp (
+            user_id INTEGER,
+            password TEXT,
+            created_at TEXT
+        )""")
+
+        # PCFG analysis
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS pcfg_analysis (
+            user_id INTEGER,
+            guesses INTEGER,
+            pattern TEXT,
+            created_at TEXT
+        )""")
+
+        # JTR results (store audit_time in milliseconds)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS jtr_results (
+            user_id INTEGER,
+            guesses INTEGER,
+            cracked INTEGER,
+            cracked_password TEXT,
+            audit_time INTEGER
+        )""")
+
+        # per-user audit checkpoints so re-runs only audit new/changed/unfinished users
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS audit_state (
+            user_id INTEGER PRIMARY KEY,
+            password_hash TEXT,
+            wordlist_id TEXT,
+            offset INTEGER,
+            guesses INTEGER,
+            finished INTEGER,
+            updated_at TEXT
+        )""")
+
+        # audit jobs run by audit_jobs.py, with their last reported progress
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS audit_jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            status TEXT,
+            full INTEGER,
+            users_total INTEGER DEFAULT 0,
+            users_done INTEGER DEFAULT 0,
+            candidates INTEGER DEFAULT 0,
+            hps REAL DEFAULT 0,
+            wordlist_offset INTEGER DEFAULT 0,
+            eta_seconds REAL,
+            error TEXT,
+            created_at TEXT,
+            started_at TEXT,
+            finished_at TEXT
+        )""")
+
+        # login attempts logs
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS login_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT,
+            ip TEXT,
+            status TEXT,
+            fingerprint TEXT,
+            timestamp TEXT
+        )""")
+
+        # per-minute login counts for events retention.py moved out of login_logs
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS login_rollups (
+            minute INTEGER,
+            ip TEXT,
+            username TEXT,
+            status TEXT,
+            attempts INTEGER,
+            PRIMARY KEY (minute, ip, username, status)
+        ) WITHOUT ROWID""")
+
+        # detection alerts
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS alerts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            alert_type TEXT,
+            details TEXT,
+            timestamp TEXT
+        )""")
+        # last alert time per (alert_type, key), shared by all processes
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS alert_cooldowns (
+            alert_type TEXT,
+            key TEXT,
+            last_ts INTEGER,
+            PRIMARY KEY (alert_type, key)
+        ) WITHOUT ROWID""")
+
+        # named leases for work only one process should do (see leader.py)
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS leases (
+            name TEXT PRIMARY KEY,
+            holder TEXT,
+            expires_at INTEGER
+        )""")
+
+        # config table for runtime settings
+        c.execute("""
+        CREATE TABLE IF NOT EXISTS config (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )""")
+
+        _migrate(c)
+
+# ----- versioned schema migrations (tracked in PRAGMA user_version) -----
+_ISO_TO_MS = "CAST(ROUND((julianday({col}) - 2440587.5) * 86400000) AS INTEGER)"
+
+def _migration_1(c):
+    """Integer (ms since epoch, UTC) timestamps and indexes for time-range queries."""
+    for table, col in (("login_logs", "timestamp"), ("alerts", "timestamp"), ("pcfg_analysis", "created_at")):
+        c.execute(f"ALTER TABLE {table} ADD COLUMN ts INTEGER")
+        c.execute(f"UPDATE {table} SET ts = {_ISO_TO_MS.format(col=col)}")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_login_logs_ts ON login_logs(ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_login_logs_ip_ts ON login_logs(ip, ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_alerts_ts ON alerts(ts)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_alerts_key ON alerts(alert_type, details)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_pcfg_created_at ON pcfg_analysis(created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jtr_audit_time ON jtr_results(audit_time)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_jtr_user ON jtr_results(user_id)")
+
+def _migration_2(c):
+    """Audit checkpoints record which phase (0 = wordlist, 1 = mangling rules) the offset belongs to."""
+    c.execute("ALTER TABLE audit_state ADD COLUMN phase INTEGER DEFAULT 0")
+
+MIGRATIONS = [_migration_1, _migration_2]
+
+def _migrate(c):
+    if c.execute("PRAGMA user_version").fetchone()[0] >= len(MIGRATIONS):
+        return
+    # take the write lock before re-reading the version, so processes starting
+    # together run each migration once instead of racing on ALTER TABLE
+    if c.connection.in_transaction:
+        c.connection.commit()
+    c.execute("BEGIN IMMEDIATE")
+    try:
+        version = c.execute("PRAGMA user_version").fetchone()[0]
+        for n, migration in enumerate(MIGRATIONS[version:], start=version + 1):
+            migration(c)
+            c.execute(f"PRAGMA user_version = {n}")
+        c.connection.commit()
+    except Exception:
+        c.connection.rollback()
+        raise
+
+_EPOCH = datetime(1970, 1, 1)
+
+def to_ms(dt):
+    """Naive UTC datetime -> integer milliseconds since the epoch (the `ts` columns)."""
+    return int(round((dt - _EPOCH).total_seconds() * 1000))
+
 
 # user helpers
+# callables told about changed users: fn(username), or fn(None) when many changed at once
+_user_listeners = []
+
+def add_user_listener(fn):
+    """Register `fn` to be called after users are created or their passwords change."""
+    if fn not in _user_listeners:
+        _user_listeners.append(fn)
+
+def _users_changed(username):
+    for fn in _user_listeners:
+        try:
+            fn(username)
+        except Exception as e:
+            print("user listener error:", e)
+
 def insert_user(username, password_hash):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash))
-    conn.commit()
-    uid = c.lastrowid
-    conn.close()
+    with _cursor() as c:
+        c.execute("INSERT INTO users (username, password_hash) VALUES (?, ?)", (username, password_hash))
+        uid = c.lastrowid
+    _users_changed(username)
     return uid
 
+def bulk_insert_users(rows, update=False):
+    """Insert (username, password_hash) rows in one transaction, skipping existing usernames.
+
+    With `update`, existing users whose hash differs get the new one instead.
+    Returns (inserted, updated).
+    """
+    with _cursor() as c:
+        conn = c.connection
+        before = conn.total_changes
+        c.executemany("INSERT INTO users (username, password_hash) VALUES (?, ?) ON CONFLICT (username) DO NOTHING", rows)
+        inserted = conn.total_changes - before
+        updated = 0
+        if update and inserted < len(rows):
+            before = conn.total_changes
+            c.executemany("UPDATE users SET password_hash=? WHERE username=? AND password_hash != ?",
+                          [(h, u, h) for u, h in rows])
+            updated = conn.total_changes - before
+    if inserted or updated:
+        # listeners of this process only; other processes notice new users by polling get_max_user_id
+        _users_changed(None)
+    return inserted, updated
+
 def get_user_by_username(username):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT id, username, password_hash FROM users WHERE username=?", (username,))
-    row = c.fetchone()
-    conn.close()
+    with _cursor() as c:
+        c.execute("SELECT id, username, password_hash FROM users WHERE username=?", (username,))
+        row = c.fetchone()
     return row
 
+def get_max_user_id():
+    """Highest users.id (0 if empty); grows whenever any process adds a user."""
+    with _cursor() as c:
+        c.execute("SELECT MAX(id) FROM users")
+        row = c.fetchone()
+    return row[0] or 0
+
 def list_users():
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT id, username FROM users")
-    rows = c.fetchall()
-    conn.close()
+    with _cursor() as c:
+        c.execute("SELECT id, username FROM users")
+        rows = c.fetchall()
     return rows
 
 # plaintext temp
 def store_plaintext(user_id, password):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO plaintext_temp (user_id, password, created_at) VALUES (?, ?, ?)",
-              (user_id, password, datetime.utcnow().isoformat()))
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        c.execute("INSERT INTO plaintext_temp (user_id, password, created_at) VALUES (?, ?, ?)",
+                  (user_id, password, datetime.utcnow().isoformat()))
 
 def delete_plaintext_for_user(user_id):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("DELETE FROM plaintext_temp WHERE user_id=?", (user_id,))
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        c.execute("DELETE FROM plaintext_temp WHERE user_id=?", (user_id,))
+
+# change counters for the dashboard API cache (api_cache.py). Bumped after
+# every committed write to alerts, jtr_results and pcfg_analysis; login_logs
+# change on every attempt, so cached log pages only expire by TTL. Counters
+# are per process: writes from other processes are picked up by the TTL.
+_generations = {"pcfg": 0, "jtr": 0, "alerts": 0, "logs": 0}
+_generations_lock = threading.Lock()
+
+def _changed(table):
+    with _generations_lock:
+        _generations[table] += 1
+
+def table_generation(table):
+    return _generations[table]
+
+# keyset pagination for the JSON API: newest first, `before` is the key of
+# the last row of the previous page, so every page is one index range scan
+PAGE_QUERIES = {
+    "pcfg": ("SELECT p.rowid, u.username, p.guesses, p.pattern, p.created_at FROM pcfg_analysis p JOIN users u ON p.user_id = u.id",
+             "p.rowid", ("id", "username", "guesses", "pattern", "created_at")),
+    "jtr": ("SELECT j.rowid, u.username, j.guesses, j.cracked, j.cracked_password, j.audit_time FROM jtr_results j JOIN users u ON j.user_id = u.id",
+            "j.rowid", ("id", "username", "guesses", "cracked", "cracked_password", "audit_time")),
+    "alerts": ("SELECT id, alert_type, details, timestamp FROM alerts",
+               "id", ("id", "alert_type", "details", "timestamp")),
+    "logs": ("SELECT id, username, ip, status, timestamp FROM login_logs",
+             "id", ("id", "username", "ip", "status", "timestamp")),
+}
+
+def fetch_page(table, before=None, limit=50):
+    """Up to `limit` rows of `table` (a PAGE_QUERIES key) with key < `before`, newest first.
+
+    Rows are tuples in the order of PAGE_QUERIES[table][2]; the first item is the key.
+    """
+    sql, key, _ = PAGE_QUERIES[table]
+    params = []
+    if before is not None:
+        sql += f" WHERE {key} < ?"
+        params.append(before)
+    sql += f" ORDER BY {key} DESC LIMIT ?"
+    params.append(limit)
+    with _cursor() as c:
+        c.execute(sql, params)
+        rows = c.fetchall()
+    return rows
 
 # pcfg
 def insert_pcfg(user_id, guesses, pattern):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO pcfg_analysis (user_id, guesses, pattern, created_at) VALUES (?, ?, ?, ?)",
-              (user_id, guesses, pattern, datetime.utcnow().isoformat()))
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        now = datetime.utcnow()
+        c.execute("INSERT INTO pcfg_analysis (user_id, guesses, pattern, created_at, ts) VALUES (?, ?, ?, ?, ?)",
+                  (user_id, guesses, pattern, now.isoformat(), to_ms(now)))
+    _changed("pcfg")
 
 def fetch_pcfg_rows(limit=100):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT u.username, p.guesses, p.pattern, p.created_at FROM pcfg_analysis p JOIN users u ON p.user_id = u.id ORDER BY p.created_at DESC LIMIT ?",
-              (limit,))
-    rows = c.fetchall()
-    conn.close()
+    with _cursor() as c:
+        c.execute("SELECT u.username, p.guesses, p.pattern, p.created_at FROM pcfg_analysis p JOIN users u ON p.user_id = u.id ORDER BY p.created_at DESC LIMIT ?",
+                  (limit,))
+        rows = c.fetchall()
     return rows
 
+def fetch_pattern_counts():
+    """Return {pattern: number of analysed passwords with that structure}."""
+    with _cursor() as c:
+        c.execute("SELECT pattern, COUNT(*) FROM pcfg_analysis WHERE pattern IS NOT NULL AND pattern != '' GROUP BY pattern")
+        rows = c.fetchall()
+    return dict(rows)
+
 # jtr
 def insert_jtr_result(user_id, guesses, cracked, cracked_password, audit_time):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO jtr_results (user_id, guesses, cracked, cracked_password, audit_time) VALUES (?, ?, ?, ?, ?)",
-              (user_id, guesses, cracked, cracked_password, audit_time))
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        c.execute("INSERT INTO jtr_results (user_id, guesses, cracked, cracked_password, audit_time) VALUES (?, ?, ?, ?, ?)",
+                  (user_id, guesses, cracked, cracked_password, audit_time))
+    _changed("jtr")
 
 def fetch_jtr_rows(limit=100):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT u.username, j.guesses, j.cracked, j.cracked_password, j.audit_time FROM jtr_results j JOIN users u ON j.user_id = u.id ORDER BY j.audit_time DESC LIMIT ?",
-              (limit,))
-    rows = c.fetchall()
-    conn.close()
+    with _cursor() as c:
+        c.execute("SELECT u.username, j.guesses, j.cracked, j.cracked_password, j.audit_time FROM jtr_results j JOIN users u ON j.user_id = u.id ORDER BY j.audit_time DESC LIMIT ?",
+                  (limit,))
+        rows = c.fetchall()
     return rows
 
 def clear_jtr_results():
     """Delete all rows from jtr_results table."""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("DELETE FROM jtr_results")
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        c.execute("DELETE FROM jtr_results")
+    _changed("jtr")
+
+def delete_jtr_results_for_users(user_ids):
+    """Delete jtr_results rows for the given users (before they are re-audited)."""
+    with _cursor() as c:
+        c.executemany("DELETE FROM jtr_results WHERE user_id=?", [(uid,) for uid in user_ids])
+    _changed("jtr")
+
+# audit checkpoints
+def get_audit_states():
+    """Return {user_id: (password_hash, wordlist_id, phase, offset, guesses, finished)}."""
+    with _cursor() as c:
+        c.execute("SELECT user_id, password_hash, wordlist_id, phase, offset, guesses, finished FROM audit_state")
+        rows = c.fetchall()
+    return {r[0]: r[1:] for r in rows}
+
+def save_audit_states(states):
+    """Upsert checkpoints given as (user_id, password_hash, wordlist_id, phase, offset, guesses, finished) tuples."""
+    now = datetime.utcnow().isoformat()
+    with _cursor() as c:
+        c.executemany("REPLACE INTO audit_state (user_id, password_hash, wordlist_id, phase, offset, guesses, finished, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                      [tuple(s) + (now,) for s in states])
+
+def clear_audit_state():
+    """Forget all audit checkpoints so the next audit starts from scratch."""
+    with _cursor() as c:
+        c.execute("DELETE FROM audit_state")
+
+# audit jobs
+AUDIT_JOB_COLUMNS = ("id", "status", "full", "users_total", "users_done", "candidates", "hps",
+                     "wordlist_offset", "eta_seconds", "error", "created_at", "started_at", "finished_at")
+
+def create_audit_job(full):
+    """Insert a queued job and return its id."""
+    with _cursor() as c:
+        c.execute("INSERT INTO audit_jobs (status, full, created_at) VALUES ('queued', ?, ?)",
+                  (1 if full else 0, datetime.utcnow().isoformat()))
+        return c.lastrowid
+
+def update_audit_job(job_id, **fields):
+    """Set the given audit_jobs columns for one job."""
+    cols = [k for k in fields if k in AUDIT_JOB_COLUMNS and k != "id"]
+    if not cols:
+        return
+    with _cursor() as c:
+        c.execute(f"UPDATE audit_jobs SET {', '.join(k + ' = ?' for k in cols)} WHERE id = ?",
+                  [fields[k] for k in cols] + [job_id])
+
+def get_audit_job(job_id):
+    """Return one job as a dict, or None."""
+    with _cursor() as c:
+        c.execute(f"SELECT {', '.join(AUDIT_JOB_COLUMNS)} FROM audit_jobs WHERE id = ?", (job_id,))
+        row = c.fetchone()
+    return dict(zip(AUDIT_JOB_COLUMNS, row)) if row else None
+
+def fetch_audit_jobs(limit=20):
+    """Most recent jobs first, as dicts."""
+    with _cursor() as c:
+        c.execute(f"SELECT {', '.join(AUDIT_JOB_COLUMNS)} FROM audit_jobs ORDER BY id DESC LIMIT ?", (limit,))
+        rows = c.fetchall()
+    return [dict(zip(AUDIT_JOB_COLUMNS, r)) for r in rows]
+
+def get_active_audit_job():
+    """Id of the newest queued or running job, or None."""
+    with _cursor() as c:
+        c.execute("SELECT id FROM audit_jobs WHERE status IN ('queued', 'running') ORDER BY id DESC LIMIT 1")
+        row = c.fetchone()
+    return row[0] if row else None
+
+def fail_stale_audit_jobs(lease=None):
+    """Mark jobs left queued/running by a process that is gone as interrupted.
+
+    With `lease`, nothing is marked while that lease is held by anyone (the
+    holder may be running the job); the check and the update are one statement.
+    """
+    now = datetime.utcnow()
+    with _cursor() as c:
+        if lease is None:
+            c.execute("UPDATE audit_jobs SET status = 'interrupted', finished_at = ? WHERE status IN ('queued', 'running')",
+                      (now.isoformat(),))
+        else:
+            c.execute("UPDATE audit_jobs SET status = 'interrupted', finished_at = ? WHERE status IN ('queued', 'running') "
+                      "AND NOT EXISTS (SELECT 1 FROM leases WHERE name = ? AND expires_at >= ?)",
+                      (now.isoformat(), lease, to_ms(now)))
+
+# asynchronous group-commit writes
+class BatchWriter:
+    """Background thread that commits queued INSERTs in batches.
+
+    put() blocks while the queue is full, so a flood slows producers down
+    instead of growing memory. Each batch is written with executemany inside
+    one transaction, so a whole batch costs a single fsync.
+    """
+    _STOP = object()
+
+    def __init__(self, batch_size=WRITE_BATCH_SIZE, flush_interval=WRITE_FLUSH_INTERVAL, queue_size=WRITE_QUEUE_SIZE):
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = threading.Thread(target=self._run, name="db-batch-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, sql, params, table=None):
+        self.queue.put((sql, params, table))
+
+    def flush(self):
+        """Block until everything queued so far is committed."""
+        self.queue.join()
+
+    def stop(self):
+        self.queue.put(self._STOP)
+        self.thread.join()
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            item = self.queue.get()
+            if item is self._STOP:
+                self.queue.task_done()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    self.queue.task_done()
+                    stopping = True
+                    break
+                batch.append(item)
+            self._write(batch)
+            for _ in batch:
+                self.queue.task_done()
+
+    def _write(self, batch):
+        grouped = {}
+        for sql, params, _ in batch:
+            grouped.setdefault(sql, []).append(params)
+        try:
+            with _cursor() as c:
+                for sql, rows in grouped.items():
+                    c.executemany(sql, rows)
+        except Exception as e:
+            print("batch writer error, retrying rows one by one:", e)
+            for sql, params, _ in batch:
+                try:
+                    with _cursor() as c:
+                        c.execute(sql, params)
+                except Exception as e:
+                    print("batch writer dropped row:", e)
+        for table in {t for _, _, t in batch if t}:
+            _changed(table)
+
+_writer = None
+
+def start_async_writer(batch_size=None, flush_interval=None, queue_size=None):
+    """Route insert_login_log/insert_alert through a BatchWriter; returns it."""
+    global _writer
+    if _writer is None:
+        _writer = BatchWriter(batch_size or WRITE_BATCH_SIZE,
+                              WRITE_FLUSH_INTERVAL if flush_interval is None else flush_interval,
+                              queue_size or WRITE_QUEUE_SIZE)
+    return _writer
+
+def stop_async_writer():
+    """Flush outstanding rows and go back to synchronous writes."""
+    global _writer
+    writer, _writer = _writer, None
+    if writer is not None:
+        writer.stop()
+
+def flush_writes():
+    """Wait for queued log/alert rows to be committed (no-op when writes are synchronous)."""
+    if _writer is not None:
+        _writer.flush()
+
+atexit.register(stop_async_writer)
+
+def _write(sql, params, table=None):
+    """INSERT now, or queue it on the async writer. `table` is bumped with _changed once committed."""
+    if _writer is not None:
+        _writer.put(sql, params, table)
+    else:
+        with _cursor() as c:
+            c.execute(sql, params)
+        if table:
+            _changed(table)
 
 # logs & alerts
+# callables fed every login event as it is logged: fn(username, ip, status, fingerprint, when)
+_login_listeners = []
+
+def add_login_listener(fn):
+    """Register `fn` to be called synchronously for every insert_login_log."""
+    if fn not in _login_listeners:
+        _login_listeners.append(fn)
+
 def insert_login_log(username, ip, status, fingerprint):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO login_logs (username, ip, status, fingerprint, timestamp) VALUES (?, ?, ?, ?, ?)",
-              (username, ip, status, fingerprint, datetime.utcnow().isoformat()))
-    conn.commit()
-    conn.close()
+    now = datetime.utcnow()
+    _write("INSERT INTO login_logs (username, ip, status, fingerprint, timestamp, ts) VALUES (?, ?, ?, ?, ?, ?)",
+           (username, ip, status, fingerprint, now.isoformat(), to_ms(now)))
+    for fn in _login_listeners:
+        try:
+            fn(username, ip, status, fingerprint, now)
+        except Exception as e:
+            print("login listener error:", e)
 
 def fetch_recent_logs(limit=200):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT username, ip, status, timestamp FROM login_logs ORDER BY id DESC LIMIT ?", (limit,))
-    rows = c.fetchall()
-    conn.close()
+    with _cursor() as c:
+        c.execute("SELECT username, ip, status, timestamp FROM login_logs ORDER BY id DESC LIMIT ?", (limit,))
+        rows = c.fetchall()
+    return rows
+
+def fetch_failed_logins_since(since_ms):
+    """Failed login attempts with ts >= since_ms: (username, ip, status, fingerprint, ts), oldest first."""
+    with _cursor() as c:
+        c.execute("SELECT username, ip, status, fingerprint, ts FROM login_logs WHERE ts >= ? AND status LIKE 'fail%' ORDER BY ts",
+                  (since_ms,))
+        rows = c.fetchall()
+    return rows
+
+def fetch_logs_between(since_ms, until_ms, ip=None, username=None, status=None):
+    """Login attempts with since_ms <= ts < until_ms: (id, username, ip, status, fingerprint, ts), oldest first."""
+    sql = "SELECT id, username, ip, status, fingerprint, ts FROM login_logs WHERE ts >= ? AND ts < ?"
+    params = [since_ms, until_ms]
+    for col, value in (("ip", ip), ("username", username), ("status", status)):
+        if value is not None:
+            sql += f" AND {col} = ?"
+            params.append(value)
+    with _cursor() as c:
+        c.execute(sql + " ORDER BY ts", params)
+        rows = c.fetchall()
+    return rows
+
+# retention (see retention.py)
+def fetch_logs_older_than(cutoff_ms, limit):
+    """Oldest `limit` login_logs rows with ts < cutoff_ms: (id, username, ip, status, fingerprint, timestamp, ts)."""
+    with _cursor() as c:
+        c.execute("SELECT id, username, ip, status, fingerprint, timestamp, ts FROM login_logs WHERE ts < ? ORDER BY ts, id LIMIT ?",
+                  (cutoff_ms, limit))
+        rows = c.fetchall()
+    return rows
+
+def compact_login_logs(ids, rollups):
+    """In one transaction, add (minute, ip, username, status, attempts) rollups and delete login_logs `ids`."""
+    with _cursor() as c:
+        c.executemany("INSERT INTO login_rollups (minute, ip, username, status, attempts) VALUES (?, ?, ?, ?, ?) "
+                      "ON CONFLICT (minute, ip, username, status) DO UPDATE SET attempts = attempts + excluded.attempts",
+                      rollups)
+        c.executemany("DELETE FROM login_logs WHERE id=?", [(i,) for i in ids])
+
+def fetch_login_rollups(since_ms, until_ms, ip=None, username=None, status=None):
+    """Rolled-up counts with since_ms <= minute < until_ms: (minute, ip, username, status, attempts)."""
+    sql = "SELECT minute, ip, username, status, attempts FROM login_rollups WHERE minute >= ? AND minute < ?"
+    params = [since_ms, until_ms]
+    for col, value in (("ip", ip), ("username", username), ("status", status)):
+        if value is not None:
+            sql += f" AND {col} = ?"
+            params.append(value)
+    with _cursor() as c:
+        c.execute(sql + " ORDER BY minute", params)
+        rows = c.fetchall()
+    return rows
+
+def fetch_failed_logins_after(after_id, since_ms):
+    """Failed login attempts with id > after_id and ts >= since_ms: (id, username, ip, status, fingerprint, ts), by id."""
+    with _cursor() as c:
+        c.execute("SELECT id, username, ip, status, fingerprint, ts FROM login_logs WHERE id > ? AND ts >= ? AND status LIKE 'fail%' ORDER BY id",
+                  (after_id, since_ms))
+        rows = c.fetchall()
     return rows
 
 def insert_alert(alert_type, details):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("INSERT INTO alerts (alert_type, details, timestamp) VALUES (?, ?, ?)",
-              (alert_type, details, datetime.utcnow().isoformat()))
-    conn.commit()
-    conn.close()
+    now = datetime.utcnow()
+    _write("INSERT INTO alerts (alert_type, details, timestamp, ts) VALUES (?, ?, ?, ?)",
+           (alert_type, details, now.isoformat(), to_ms(now)), "alerts")
 
 def fetch_recent_alerts(limit=50):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT alert_type, details, timestamp FROM alerts ORDER BY id DESC LIMIT ?", (limit,))
-    rows = c.fetchall()
-    conn.close()
+    with _cursor() as c:
+        c.execute("SELECT alert_type, details, timestamp FROM alerts ORDER BY id DESC LIMIT ?", (limit,))
+        rows = c.fetchall()
     return rows
 
 def get_last_alert_time(alert_type, details):
     """Return the timestamp string of the most recent alert with same type and details, or None."""
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT timestamp FROM alerts WHERE alert_type=? AND details=? ORDER BY id DESC LIMIT 1", (alert_type, details))
-    row = c.fetchone()
-    conn.close()
+    with _cursor() as c:
+        c.execute("SELECT timestamp FROM alerts WHERE alert_type=? AND details=? ORDER BY id DESC LIMIT 1", (alert_type, details))
+        row = c.fetchone()
     return row[0] if row else None
 
+def claim_alert_cooldown(alert_type, key, now_ms, cooldown_ms):
+    """Atomically start the cooldown for (alert_type, key) unless one is running.
+
+    Returns (True, now_ms) if this caller should alert, else (False, ts of the last alert).
+    """
+    with _cursor() as c:
+        c.execute("INSERT INTO alert_cooldowns (alert_type, key, last_ts) VALUES (?, ?, ?) "
+                  "ON CONFLICT (alert_type, key) DO UPDATE SET last_ts = excluded.last_ts WHERE alert_cooldowns.last_ts <= ?",
+                  (alert_type, key, now_ms, now_ms - cooldown_ms))
+        if c.rowcount == 1:
+            return True, now_ms
+        c.execute("SELECT last_ts FROM alert_cooldowns WHERE alert_type=? AND key=?", (alert_type, key))
+        row = c.fetchone()
+    return False, row[0] if row else now_ms
+
+def fetch_alert_cooldowns_since(alert_types, since_ms):
+    """(alert_type, key, last_ts) of alerts of the given types raised at or after since_ms."""
+    marks = ",".join("?" * len(alert_types))
+    with _cursor() as c:
+        c.execute(f"SELECT alert_type, key, last_ts FROM alert_cooldowns WHERE alert_type IN ({marks}) AND last_ts >= ?",
+                  (*alert_types, since_ms))
+        rows = c.fetchall()
+    return rows
+
+def prune_alert_cooldowns(before_ms):
+    """Drop cooldown rows whose last alert is older than before_ms."""
+    with _cursor() as c:
+        c.execute("DELETE FROM alert_cooldowns WHERE last_ts < ?", (before_ms,))
+
+# leases
+def acquire_lease(name, holder, ttl_ms):
+    """Take or renew lease `name` for `holder` unless someone else holds an unexpired one. Returns True if held."""
+    now = to_ms(datetime.utcnow())
+    with _cursor() as c:
+        c.execute("INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?) "
+                  "ON CONFLICT (name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at "
+                  "WHERE leases.holder = excluded.holder OR leases.expires_at < ?",
+                  (name, holder, now + ttl_ms, now))
+        held = c.rowcount == 1
+    return held
+
+def release_lease(name, holder):
+    with _cursor() as c:
+        c.execute("DELETE FROM leases WHERE name=? AND holder=?", (name, holder))
+
 def set_config(key, value):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("REPLACE INTO config (key, value) VALUES (?, ?)", (key, value))
-    conn.commit()
-    conn.close()
+    with _cursor() as c:
+        c.execute("REPLACE INTO config (key, value) VALUES (?, ?)", (key, value))
 
 
 def get_config(key, default=None):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT value FROM config WHERE key=?", (key,))
-    row = c.fetchone()
-    conn.close()
+    with _cursor() as c:
+        c.execute("SELECT value FROM config WHERE key=?", (key,))
+        row = c.fetchone()
     return row[0] if row else default
+
+# time every helper for /metrics (see metrics.py)
+for _name in ("insert_user", "bulk_insert_users", "get_user_by_username", "get_max_user_id", "list_users", "store_plaintext", "delete_plaintext_for_user",
+              "insert_pcfg", "fetch_pcfg_rows", "fetch_pattern_counts", "insert_jtr_result", "fetch_jtr_rows",
+              "clear_jtr_results", "delete_jtr_results_for_users", "get_audit_states", "save_audit_states",
+              "clear_audit_state", "fetch_page", "create_audit_job", "update_audit_job", "get_audit_job", "fetch_audit_jobs",
+              "get_active_audit_job", "fail_stale_audit_jobs",
+              "insert_login_log", "fetch_recent_logs", "fetch_failed_logins_since", "fetch_failed_logins_after",
+              "fetch_logs_between", "fetch_logs_older_than", "compact_login_logs", "fetch_login_rollups",
+              "insert_alert", "fetch_recent_alerts", "get_last_alert_time",
+              "claim_alert_cooldown", "fetch_alert_cooldowns_since", "prune_alert_cooldowns", "acquire_lease", "release_lease",
+              "set_config", "get_config"):
+    globals()[_name] = metrics.timed("pcdt_db_call_seconds", helper=_name)(globals()[_name])
@@ -1,82 +1,255 @@
 # detection.py
+import heapq
+import threading
+from collections import deque
 from datetime import datetime, timedelta
-from database import fetch_recent_logs, insert_alert, get_last_alert_time
+import metrics
+from sketches import HyperLogLog, CountMinSketch
+from database import fetch_failed_logins_since, fetch_failed_logins_after, insert_alert, claim_alert_cooldown, add_login_listener, to_ms
 
 BRUTE_WINDOW = 120
 BRUTE_THRESHOLD = 5
 STUFF_WINDOW = 120
 STUFF_THRESHOLD = 2
+# password spray: one password (by fingerprint) failing against many accounts
+SPRAY_WINDOW = 600
+SPRAY_USER_THRESHOLD = 10  # distinct usernames in the window
+SPRAY_IP_THRESHOLD = 1     # distinct source IPs in the window
+SPRAY_BUCKETS = 6          # the window slides in steps of SPRAY_WINDOW / SPRAY_BUCKETS
+SPRAY_TRACK_AFTER = 3      # failures before a fingerprint gets distinct-count sketches
+SPRAY_MAX_TRACKED = 512    # fingerprints with sketches, per bucket
+SPRAY_SKETCH_WIDTH = 65536  # count-min columns (x4 rows x 4 bytes per bucket)
 COOLDOWN = 300  # seconds
 
-# in-memory cooldown dictionaries - track per alert key to prevent duplicates
+# in-memory cooldown dictionaries - track per alert key to prevent duplicates.
+# The alert_cooldowns table is the source of truth shared by all processes;
+# this dict only saves the round-trip while a key is known to be cooling down.
 _last_alerts = {}  # (alert_type, key) -> datetime
+_alert_lock = threading.Lock()
 
+def _maybe_alert(alert_type, key, details, now):
+    """Insert an alert unless one with the same key/details fired within COOLDOWN."""
+    with _alert_lock:
+        return _maybe_alert_locked(alert_type, key, details, now)
+
+def _maybe_alert_locked(alert_type, key, details, now):
+    alert_key = (alert_type, key)
+    last = _last_alerts.get(alert_key)
+    if last and (now - last).total_seconds() <= COOLDOWN:
+        return False
+    claimed, last_ms = claim_alert_cooldown(alert_type, str(key), to_ms(now), COOLDOWN * 1000)
+    if not claimed:
+        # another process alerted first
+        _last_alerts[alert_key] = _EPOCH + timedelta(milliseconds=last_ms)
+        return False
+    insert_alert(alert_type, details)
+    _last_alerts[alert_key] = now
+    return True
+
+# Use generic messages (without counts) so DB dedup works across different count values
+def _brute_details(ip):
+    return f"Brute force attack detected from IP {ip}"
+
+def _stuff_details(ip):
+    return f"Credential stuffing attack detected from IP {ip}"
+
+def _spray_details(fingerprint):
+    return f"Password spray detected: one password (fingerprint {fingerprint[:12]}) failing across many accounts"
+
+class SprayTracker:
+    """Distinct usernames and IPs per password fingerprint over a sliding window.
+
+    The window is cut into SPRAY_BUCKETS buckets that expire whole. Each bucket
+    counts failures per fingerprint in a count-min sketch; only fingerprints
+    that reach SPRAY_TRACK_AFTER failures get a pair of HyperLogLogs, and at
+    most SPRAY_MAX_TRACKED of them per bucket, so memory is bounded however
+    many different passwords are tried. When a bucket is full, the tracked
+    fingerprint with the fewest failures is evicted; a lazy min-heap of
+    (count, fingerprint) finds it in O(log n). Counts start at the
+    SPRAY_TRACK_AFTER-th failure, so they may miss the first few.
+    """
+
+    def __init__(self, window=None, buckets=None, max_tracked=None):
+        self.window = window or SPRAY_WINDOW
+        self.span = self.window / (buckets or SPRAY_BUCKETS)
+        self.max_tracked = max_tracked or SPRAY_MAX_TRACKED
+        # (start, CountMinSketch, {fingerprint: [count, users HLL, ips HLL]}, heap of (count, fingerprint))
+        self.buckets = deque()
+        self.lock = threading.Lock()
+
+    def _bucket(self, t):
+        start = t - t % self.span
+        while self.buckets and self.buckets[0][0] <= t - self.window - self.span:
+            self.buckets.popleft()
+        if not self.buckets or self.buckets[-1][0] < start:
+            self.buckets.append((start, CountMinSketch(SPRAY_SKETCH_WIDTH, 4), {}, []))
+        return self.buckets[-1]
+
+    def _make_room(self, tracked, heap, count):
+        """Evict the least frequent tracked fingerprint if it is rarer than `count`. Returns True if there is room."""
+        while heap:
+            low, fp = heap[0]
+            entry = tracked.get(fp)
+            if entry is None or entry[0] != low:
+                heapq.heappop(heap)  # stale: evicted or counted again since
+                continue
+            if low >= count:
+                return False
+            heapq.heappop(heap)
+            del tracked[fp]
+            return True
+        return True
+
+    def add(self, fingerprint, username, ip, t):
+        """Record one failure at time t (seconds); returns (users, ips) estimates if they may have grown, else None."""
+        with self.lock:
+            _, cms, tracked, heap = self._bucket(t)
+            cols = cms.columns(fingerprint)
+            count = cms.add(fingerprint, columns=cols)
+            entry = tracked.get(fingerprint)
+            if entry is None:
+                if sum(b[1].estimate(fingerprint, cols) for b in self.buckets) < SPRAY_TRACK_AFTER:
+                    return None
+                if len(tracked) >= self.max_tracked and not self._make_room(tracked, heap, count):
+                    return None
+                entry = tracked[fingerprint] = [count, HyperLogLog(), HyperLogLog()]
+            entry[0] = count
+            heapq.heappush(heap, (count, fingerprint))
+            if len(heap) > 4 * self.max_tracked:
+                # drop the stale entries
+                heap[:] = [(e[0], fp) for fp, e in tracked.items()]
+                heapq.heapify(heap)
+            changed = entry[1].add(username or "")
+            changed = entry[2].add(ip or "") or changed
+            if not changed:
+                return None
+            return self._distinct(fingerprint)
+
+    def _distinct(self, fingerprint):
+        entries = [b[2][fingerprint] for b in self.buckets if fingerprint in b[2]]
+        return (HyperLogLog.union_count(e[1] for e in entries),
+                HyperLogLog.union_count(e[2] for e in entries))
+
+    def distinct(self, fingerprint):
+        """(distinct usernames, distinct IPs) for `fingerprint` in the window."""
+        with self.lock:
+            return self._distinct(fingerprint)
+
+def _is_spray(estimate):
+    return estimate is not None and estimate[0] >= SPRAY_USER_THRESHOLD and estimate[1] >= SPRAY_IP_THRESHOLD
+
+# poll mode keeps one spray tracker and feeds it only the rows logged since the
+# previous pass, instead of re-reading the whole SPRAY_WINDOW every 5 seconds
+_poll_spray = None
+_poll_last_id = 0
+
+def _poll_sprays(now_ms):
+    """Feed new failures into the poll-mode spray tracker; returns fingerprints over the thresholds."""
+    global _poll_spray, _poll_last_id
+    if _poll_spray is None:
+        _poll_spray = SprayTracker()
+    sprays = set()
+    for row_id, username, ip, status, fingerprint, ts in fetch_failed_logins_after(_poll_last_id, now_ms - SPRAY_WINDOW * 1000):
+        _poll_last_id = row_id
+        if fingerprint and _is_spray(_poll_spray.add(fingerprint, username, ip, ts / 1000.0)):
+            sprays.add(fingerprint)
+    return sprays
+
+@metrics.timed("pcdt_detection_pass_seconds")
 def run_detection_once():
     now = datetime.utcnow()
-    logs = fetch_recent_logs(1000)
+    now_ms = to_ms(now)
+    # read exactly the detection window via the ts index instead of a fixed LIMIT
+    logs = fetch_failed_logins_since(now_ms - max(BRUTE_WINDOW, STUFF_WINDOW) * 1000)
 
     # BRUTE FORCE: count failed attempts per IP in window
+    # CREDENTIAL STUFFING: multiple failed logins to different users from same IP
     ip_counts = {}
-    for row in logs:
-        username, ip, status, ts = row
-        try:
-            t = datetime.fromisoformat(ts)
-        except Exception:
-            continue
-        if (now - t).total_seconds() <= BRUTE_WINDOW and status.startswith("fail"):
+    ip_users = {}
+    for username, ip, status, fingerprint, ts in logs:
+        age = (now_ms - ts) / 1000.0
+        if age <= BRUTE_WINDOW:
             ip_counts[ip] = ip_counts.get(ip, 0) + 1
+        if age <= STUFF_WINDOW:
+            ip_users.setdefault(ip, set()).add(username)
+
+    # PASSWORD SPRAY: one password fingerprint failing for many users
+    sprays = _poll_sprays(now_ms)
 
     for ip, count in ip_counts.items():
         if count >= BRUTE_THRESHOLD:
-            alert_key = ("BRUTE_FORCE", ip)
-            last = _last_alerts.get(alert_key)
-            # Use generic message (without count) so DB dedup works across different count values
-            details = f"Brute force attack detected from IP {ip}"
-            db_last_ts = get_last_alert_time("BRUTE_FORCE", details)
-            db_ok = True
-            if db_last_ts:
-                try:
-                    db_last = datetime.fromisoformat(db_last_ts)
-                    if (now - db_last).total_seconds() <= COOLDOWN:
-                        db_ok = False
-                except Exception:
-                    pass
-            if (not last or (now - last).total_seconds() > COOLDOWN) and db_ok:
-                insert_alert("BRUTE_FORCE", details)
-                _last_alerts[alert_key] = now
-
-    # CREDENTIAL STUFFING: count usernames that failed with attempts from same IP
-    # Multiple users targeted from same IP suggests credential stuffing
-    failed_logs = []
-    for row in logs:
-        username, ip, status, ts = row
-        try:
-            t = datetime.fromisoformat(ts)
-        except Exception:
-            continue
-        if (now - t).total_seconds() <= STUFF_WINDOW and status.startswith("fail"):
-            failed_logs.append((username, ip))
-    
-    # Group by IP: multiple failed logins to different users from same IP suggests stuffing
-    ip_users = {}
-    for username, ip in failed_logs:
-        ip_users.setdefault(ip, set()).add(username)
-    
+            _maybe_alert("BRUTE_FORCE", ip, _brute_details(ip), now)
+
     for ip, users in ip_users.items():
         if len(users) >= STUFF_THRESHOLD:
-            alert_key = ("CREDENTIAL_STUFFING", ip)
-            last = _last_alerts.get(alert_key)
-            # Use generic message (without count) so DB dedup works across different user counts
-            details = f"Credential stuffing attack detected from IP {ip}"
-            db_last_ts = get_last_alert_time("CREDENTIAL_STUFFING", details)
-            db_ok = True
-            if db_last_ts:
-                try:
-                    db_last = datetime.fromisoformat(db_last_ts)
-                    if (now - db_last).total_seconds() <= COOLDOWN:
-                        db_ok = False
-                except Exception:
-                    pass
-            if (not last or (now - last).total_seconds() > COOLDOWN) and db_ok:
-                insert_alert("CREDENTIAL_STUFFING", details)
-                _last_alerts[alert_key] = now
+            _maybe_alert("CREDENTIAL_STUFFING", ip, _stuff_details(ip), now)
+
+    for fingerprint in sprays:
+        _maybe_alert("PASSWORD_SPRAY", fingerprint, _spray_details(fingerprint), now)
+
+# ----- streaming detection -----
+# Fed by database.insert_login_log. Each IP keeps a deque of recent failure
+# times and a deque + refcount map of recently targeted usernames, so every
+# event costs O(1) amortized and alerts fire on the event that crosses a threshold.
+_EPOCH = datetime(1970, 1, 1)
+_SWEEP_EVERY = 10000  # events between sweeps that drop idle IPs
+
+_stream_lock = threading.Lock()
+_ip_fails = {}  # ip -> deque[event seconds]
+_ip_users = {}  # ip -> (deque[(event seconds, username)], {username: count in window})
+_events_since_sweep = 0
+_spray = SprayTracker()
+
+def _evict(ip, t):
+    fails = _ip_fails.get(ip)
+    while fails and t - fails[0] > BRUTE_WINDOW:
+        fails.popleft()
+    entry = _ip_users.get(ip)
+    if entry:
+        seen, counts = entry
+        while seen and t - seen[0][0] > STUFF_WINDOW:
+            _, old_user = seen.popleft()
+            counts[old_user] -= 1
+            if not counts[old_user]:
+                del counts[old_user]
+
+def _sweep(t):
+    for ip in list(_ip_fails):
+        _evict(ip, t)
+        if not _ip_fails[ip] and not _ip_users.get(ip, (None,))[0]:
+            _ip_fails.pop(ip, None)
+            _ip_users.pop(ip, None)
+
+def record_login_event(username, ip, status, fingerprint, when):
+    """Update the sliding windows with one login event and alert on thresholds."""
+    global _events_since_sweep
+    if not status or not status.startswith("fail"):
+        return
+    t = (when - _EPOCH).total_seconds()
+    with _stream_lock:
+        _events_since_sweep += 1
+        if _events_since_sweep >= _SWEEP_EVERY:
+            _sweep(t)
+            _events_since_sweep = 0
+
+        fails = _ip_fails.setdefault(ip, deque())
+        seen, counts = _ip_users.setdefault(ip, (deque(), {}))
+        fails.append(t)
+        seen.append((t, username))
+        counts[username] = counts.get(username, 0) + 1
+        _evict(ip, t)
+        brute = len(fails) >= BRUTE_THRESHOLD
+        stuffing = len(counts) >= STUFF_THRESHOLD
+    # the spray tracker has its own lock, so logins for other IPs are not held up by it
+    spray = bool(fingerprint) and _is_spray(_spray.add(fingerprint, username, ip, t))
+
+    if brute:
+        _maybe_alert("BRUTE_FORCE", ip, _brute_details(ip), when)
+    if stuffing:
+        _maybe_alert("CREDENTIAL_STUFFING", ip, _stuff_details(ip), when)
+    if spray:
+        _maybe_alert("PASSWORD_SPRAY", fingerprint, _spray_details(fingerprint), when)
+
+def enable_streaming():
+    """Feed every logged login attempt straight into the streaming detector."""
+    add_login_listener(record_login_event)
@@ -0,0 +1,132 @@
+# import_hashes.py
+# Bulk-load accounts from a hash dump with one `username:sha512hex` per line,
+# then optionally audit them.
+#
+#   python3 import_hashes.py export.txt
+#   python3 import_hashes.py export.txt --update --audit
+#   cat export.txt | python3 import_hashes.py -
+#
+# The file is streamed in chunks of --chunk-size lines; each chunk is one
+# executemany inside one transaction. Usernames already in the database are
+# skipped by the UNIQUE index (or get the new hash with --update), blank and
+# `#` lines are ignored, and malformed lines are counted and reported.
+#
+# The cache in front of the login path (user_cache.py) is only invalidated in
+# this process; a running server sees newly imported usernames at its next
+# MAX(users.id) poll (PCDT_USER_POLL, default 1 second) and changed hashes
+# after PCDT_USER_CACHE_TTL.
+import argparse
+import string
+import sys
+import time
+from database import init_db, bulk_insert_users
+
+CHUNK_SIZE = 50000
+# Malformed lines kept for the report; the rest are only counted
+MAX_ERRORS = 20
+_HEX = frozenset(string.hexdigits)
+
+def parse_line(line):
+    """(username, lowercase sha512 hex) for a dump line, None for blank/comment lines.
+
+    Raises ValueError for anything else. The username may itself contain ':'.
+    """
+    line = line.strip()
+    if not line or line.startswith("#"):
+        return None
+    username, sep, digest = line.rpartition(":")
+    username = username.strip()
+    digest = digest.strip()
+    if not sep or not username:
+        raise ValueError("expected username:hash")
+    if len(digest) != 128 or not _HEX.issuperset(digest):
+        raise ValueError("hash is not 128 hex characters")
+    return username, digest.lower()
+
+def iter_chunks(lines, chunk_size, stats):
+    """Yield lists of parsed rows; malformed lines are counted in stats["malformed"]
+    and the first MAX_ERRORS are appended to stats["errors"] as (line number, reason)."""
+    chunk = []
+    for n, line in enumerate(lines, 1):
+        try:
+            row = parse_line(line)
+        except ValueError as e:
+            stats["malformed"] += 1
+            if len(stats["errors"]) < MAX_ERRORS:
+                stats["errors"].append((n, str(e)))
+            continue
+        if row is None:
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def import_file(f, chunk_size=CHUNK_SIZE, update=False, quiet=False):
+    """Import from an open text file. Returns a stats dict."""
+    stats = {"rows": 0, "inserted": 0, "updated": 0, "skipped": 0, "malformed": 0, "errors": []}
+    start = time.perf_counter()
+    for chunk in iter_chunks(f, chunk_size, stats):
+        inserted, updated = bulk_insert_users(chunk, update)
+        stats["rows"] += len(chunk)
+        stats["inserted"] += inserted
+        stats["updated"] += updated
+        stats["skipped"] += len(chunk) - inserted - updated
+        if not quiet:
+            elapsed = time.perf_counter() - start
+            print(f"{stats['rows']} rows, {stats['inserted']} new, {stats['updated']} updated, "
+                  f"{stats['skipped']} skipped, {stats['malformed']} malformed ({stats['rows'] / elapsed:.0f} rows/s)",
+                  flush=True)
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    return stats
+
+def run_audit(full=False, poll=2.0):
+    """Run an audit job in this process, printing its progress until it ends."""
+    from audit_jobs import submit_audit, job_status
+    job_id, created = submit_audit(full)
+    if job_id is None:
+        print("another process is starting an audit")
+        return {}
+    if not created:
+        print(f"audit job {job_id} is already active")
+    while True:
+        time.sleep(poll)
+        job = job_status(job_id) or {}
+        eta = job.get("eta_seconds")
+        print(f"audit {job_id} {job.get('status')}: {job.get('users_done')}/{job.get('users_total')} users, "
+              f"{job.get('candidates')} candidates, {job.get('hps')} h/s" + (f", eta {eta}s" if eta else ""),
+              flush=True)
+        if job.get("status") not in ("queued", "running"):
+            return job
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Import username:sha512hex lines and optionally audit them.")
+    ap.add_argument("file", help="dump file, or - for stdin")
+    ap.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="lines per transaction")
+    ap.add_argument("--update", action="store_true", help="replace the hash of existing users instead of skipping them")
+    ap.add_argument("--audit", action="store_true", help="audit new and changed users after the import")
+    ap.add_argument("--full-audit", action="store_true", help="with --audit, re-audit every user from scratch")
+    ap.add_argument("--quiet", action="store_true", help="no per-chunk progress")
+    args = ap.parse_args(argv)
+
+    init_db()
+    if args.file == "-":
+        stats = import_file(sys.stdin, args.chunk_size, args.update, args.quiet)
+    else:
+        with open(args.file, "r", encoding="utf-8", errors="replace") as f:
+            stats = import_file(f, args.chunk_size, args.update, args.quiet)
+    for n, reason in stats["errors"]:
+        print(f"line {n}: {reason}")
+    if stats["malformed"] > len(stats["errors"]):
+        print(f"... and {stats['malformed'] - len(stats['errors'])} more malformed lines")
+    print(f"imported {stats['inserted']} new and {stats['updated']} updated users from {stats['rows']} rows "
+          f"in {stats['seconds']}s ({stats['skipped']} skipped, {stats['malformed']} malformed)")
+    if args.audit:
+        job = run_audit(args.full_audit)
+        return 0 if job.get("status") == "done" else 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,181 @@
+# john_session.py
+# Runs one John the Ripper session for many hashes instead of one process per
+# user. Every pending hash goes into a single input file, john writes cracks to
+# a dedicated pot file, and the pot file is tailed while john runs so each
+# crack is reported as soon as it happens. A session stopped by the time
+# budget or by cancel() leaves john's .rec file behind and is resumed with
+# `john --restore` when the next audit submits the same hashes.
+import hashlib
+import os
+import subprocess
+import threading
+import time
+
+# Where hash, pot and restore files are kept (set `JTR_SESSION_DIR`)
+SESSION_DIR = os.environ.get("JTR_SESSION_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "wordlists", "john"))
+# Total seconds a session may run before it is stopped, 0 = no limit (set `JTR_JOHN_BUDGET`)
+BUDGET = int(os.environ.get("JTR_JOHN_BUDGET", "600"))
+# Number of john processes, via john's own --fork (set `JTR_JOHN_FORKS`)
+FORKS = int(os.environ.get("JTR_JOHN_FORKS", "1"))
+# Seconds between pot file polls
+POLL_INTERVAL = 0.5
+
+def _pot_password(raw):
+    """Plaintext bytes of a pot line's password field; john writes passwords
+    containing ':' or non-printable bytes as $HEX[hex]."""
+    if raw.startswith(b"$HEX[") and raw.endswith(b"]"):
+        try:
+            return bytes.fromhex(raw[5:-1].decode("ascii"))
+        except ValueError:
+            pass
+    return raw
+
+_active = None  # the running JohnSession, so another thread can cancel it
+_active_lock = threading.Lock()
+
+class JohnSession:
+    """One john process (or --fork group) over a fixed set of (user_id, sha512 hex) rows.
+
+    `on_crack(user_id, password, elapsed_ms)` is called from the polling loop
+    for every cracked user, including hashes already in the pot file.
+    """
+
+    def __init__(self, rows, on_crack, name="pcdt", session_dir=None, forks=None, mode_args=None):
+        self.dir = session_dir or SESSION_DIR
+        self.base = os.path.join(self.dir, name)
+        self.hash_file = self.base + ".hashes"
+        self.pot_file = self.base + ".pot"
+        self.rec_file = self.base + ".rec"
+        self.forks = FORKS if forks is None else forks
+        self.mode_args = mode_args or ["--incremental=All"]
+        self.on_crack = on_crack
+        self.targets = {}  # hex digest -> [user ids]
+        for user_id, stored_hexdigest in rows:
+            if stored_hexdigest:
+                self.targets.setdefault(stored_hexdigest.lower(), []).append(user_id)
+        self.cracked = {}  # hex digest -> password
+        self.resumed = False
+        self._pot_pos = 0
+        self._cancel = threading.Event()
+        self._start = None
+        self.proc = None
+
+    def _write_hashes(self):
+        """Write the input file; returns True if an interrupted session over the same hashes can be restored."""
+        os.makedirs(self.dir, exist_ok=True)
+        content = "".join(f"{h}\n" for h in sorted(self.targets)).encode()
+        try:
+            with open(self.hash_file, "rb") as f:
+                same = f.read() == content
+        except OSError:
+            same = False
+        if same and os.path.exists(self.rec_file):
+            return True
+        for path in (self.rec_file, self.base + ".log"):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        tmp = self.hash_file + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(content)
+        os.replace(tmp, self.hash_file)
+        return False
+
+    def _command(self):
+        if self.resumed:
+            return ["john", f"--restore={self.base}"]
+        cmd = ["john", "--format=Raw-SHA512", f"--session={self.base}", f"--pot={self.pot_file}"] + self.mode_args
+        if self.forks > 1:
+            cmd.append(f"--fork={self.forks}")
+        return cmd + [self.hash_file]
+
+    def poll_pot(self):
+        """Read pot lines appended since the last call and report new cracks."""
+        try:
+            with open(self.pot_file, "rb") as f:
+                f.seek(self._pot_pos)
+                data = f.read()
+        except OSError:
+            return 0
+        # only consume complete lines; john may be mid-write
+        data = data[:data.rfind(b"\n") + 1]
+        self._pot_pos += len(data)
+        new = 0
+        elapsed_ms = int((time.time() - (self._start or time.time())) * 1000)
+        for line in data.splitlines():
+            _, sep, password = line.partition(b":")
+            if not sep:
+                continue
+            password = _pot_password(password)
+            # pot hashes may be tagged or truncated; re-hashing the plaintext is exact
+            digest = hashlib.sha512(password).hexdigest()
+            if digest in self.targets and digest not in self.cracked:
+                text = password.decode("utf-8", "replace")
+                self.cracked[digest] = text
+                new += 1
+                for user_id in self.targets[digest]:
+                    self.on_crack(user_id, text, elapsed_ms)
+        return new
+
+    def cancel(self):
+        self._cancel.set()
+
+    def _stop(self):
+        if self.proc is None or self.proc.poll() is not None:
+            return
+        # SIGTERM lets john write its .rec file so the session can be restored
+        self.proc.terminate()
+        try:
+            self.proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.proc.kill()
+            self.proc.wait()
+
+    def run(self, budget=None):
+        """Run until every hash is cracked, john exits, the budget runs out or cancel() is called.
+
+        Returns "done", "budget", "cancelled" or "john_missing".
+        """
+        global _active
+        budget = BUDGET if budget is None else budget
+        self._start = time.time()
+        self.poll_pot()
+        if len(self.cracked) == len(self.targets):
+            return "done"
+        self.resumed = self._write_hashes()
+        try:
+            self.proc = subprocess.Popen(self._command(), cwd=self.dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except Exception:
+            return "john_missing"
+        with _active_lock:
+            _active = self
+        status = "done"
+        try:
+            while self.proc.poll() is None:
+                self.poll_pot()
+                if len(self.cracked) == len(self.targets):
+                    break
+                if self._cancel.is_set():
+                    status = "cancelled"
+                    break
+                if budget and time.time() - self._start >= budget:
+                    status = "budget"
+                    break
+                self._cancel.wait(POLL_INTERVAL)
+        finally:
+            self._stop()
+            with _active_lock:
+                if _active is self:
+                    _active = None
+        self.poll_pot()
+        return status
+
+def cancel_active_session():
+    """Stop the running session, if any; it can be resumed by the next audit."""
+    with _active_lock:
+        session = _active
+    if session is None:
+        return False
+    session.cancel()
+    return True
@@ -2,8 +2,17 @@
 import subprocess
 import time
 import hashlib
+import multiprocessing
 import os
-from database import insert_jtr_result, get_conn, get_config, clear_jtr_results
+import re
+import metrics
+from database import (insert_jtr_result, get_conn, get_config, clear_jtr_results, delete_jtr_results_for_users,
+                      get_audit_states, save_audit_states, clear_audit_state, fetch_pattern_counts)
+from wordlist_index import get_index
+from mangling import load_rules, mangle, DedupCache, RuleError
+from masks import build_generator
+from pcfg_utils import get_pcfg_model
+from john_session import JohnSession, BUDGET as JOHN_BUDGET, FORKS as JOHN_FORKS
 
 # Configuration via environment variables
 # Path to a preferred wordlist (set `JTR_WORDLIST`), default to common rockyou path
@@ -12,22 +21,331 @@ WORDLIST_PATH = os.environ.get("JTR_WORDLIST", "/usr/share/wordlists/rockyou.txt
 MAX_SECONDS_PER_USER = int(os.environ.get("JTR_MAX_SECONDS_PER_USER", "30"))
 # Maximum guesses to consider for non-wordlist fast-path (set `JTR_MAX_GUESSES`)
 MAX_GUESSES = int(os.environ.get("JTR_MAX_GUESSES", "200000"))
+# Use a precomputed digest index instead of rescanning the wordlist (set `JTR_WORDLIST_INDEX`)
+USE_WORDLIST_INDEX = os.environ.get("JTR_WORDLIST_INDEX", "1")
+# Number of processes for the sharded wordlist scan, 1 = scan in-process (set `JTR_WORKERS`)
+WORKERS = int(os.environ.get("JTR_WORKERS", "1"))
+# Mangling rules for a second dictionary pass: 'default', 'none', a rules file or rule text (set `JTR_RULES`)
+RULES = os.environ.get("JTR_RULES", "default")
+# What to run when there is no usable wordlist: 'mask' (probability-ordered masks) or 'john' (set `JTR_FALLBACK`)
+FALLBACK = os.environ.get("JTR_FALLBACK", "mask")
 
+# Common passwords to try first (fast path)
+COMMON_PASSWORDS = [
+    'password', '123456', '12345678', 'qwerty', 'abc123', 'monkey', '1234567',
+    'letmein', 'trustno1', 'dragon', 'baseball', 'iloveyou', 'master', 'sunshine',
+    'ashley', 'bailey', 'passw0rd', 'shadow', '123123', '654321'
+]
+
+def resolve_wordlist():
+    """Return the path of the wordlist to audit with, or None if none is usable."""
+    # Determine wordlist preference order:
+    # 1) DB-configured path (`JTR_WORDLIST`)
+    # 2) Project-local `wordlists/rockyou.txt`
+    # 3) Environment default `WORDLIST_PATH`
+    # 4) common system fallback paths
+    wordlist = None
+    db_wordlist = get_config('JTR_WORDLIST')
+    project_wordlist = os.path.join(os.path.dirname(__file__), 'wordlists', 'rockyou.txt')
+    if db_wordlist and os.path.exists(db_wordlist):
+        wordlist = db_wordlist
+    elif os.path.exists(project_wordlist):
+        wordlist = project_wordlist
+    elif WORDLIST_PATH and os.path.exists(WORDLIST_PATH):
+        wordlist = WORDLIST_PATH
+    else:
+        preferred_wordlists = [
+            '/usr/share/wordlists/rockyou.txt',
+            '/usr/share/seclists/Passwords/Leaked-Databases/rockyou.txt',
+            '/usr/share/wordlists/fasttrack.txt'
+        ]
+        for p in preferred_wordlists:
+            if os.path.exists(p):
+                wordlist = p
+                break
+    return wordlist
+
+def _get_timeout():
+    """Per-user time budget in seconds (DB config overrides environment/default)."""
+    db_timeout = get_config('JTR_MAX_SECONDS_PER_USER')
+    try:
+        return int(db_timeout) if db_timeout is not None else MAX_SECONDS_PER_USER
+    except Exception:
+        return MAX_SECONDS_PER_USER
+
+def _get_workers():
+    """Wordlist scan worker count (DB config `JTR_WORKERS` overrides environment/default)."""
+    db_workers = get_config('JTR_WORKERS')
+    try:
+        workers = int(db_workers) if db_workers is not None else WORKERS
+    except Exception:
+        workers = WORKERS
+    return max(1, workers)
+
+_rules_cache = {}  # JTR_RULES value -> (compiled rules, rules id)
+
+def _get_rules():
+    """Compiled mangling rules and their id (DB config `JTR_RULES`), or (None, 'none') if disabled."""
+    spec = get_config('JTR_RULES', RULES)
+    if str(spec).strip().lower() in ('0', 'none', 'off', 'false', ''):
+        return None, 'none'
+    if spec not in _rules_cache:
+        try:
+            _rules_cache[spec] = load_rules(spec)
+        except (OSError, RuleError) as e:
+            print("invalid JTR_RULES:", e)
+            return None, 'none'
+    return _rules_cache[spec]
+
+def _get_fallback():
+    return str(get_config('JTR_FALLBACK', FALLBACK)).strip().lower()
+
+def _run_john_session(rows, on_crack):
+    """Audit `rows` in one john session (john_session.py); returns its exit status."""
+    try:
+        budget = int(get_config('JTR_JOHN_BUDGET', JOHN_BUDGET))
+        forks = int(get_config('JTR_JOHN_FORKS', JOHN_FORKS))
+    except (TypeError, ValueError):
+        budget, forks = JOHN_BUDGET, JOHN_FORKS
+    return JohnSession(rows, on_crack, forks=forks).run(budget)
+
+def _get_index(wordlist):
+    """Return the digest index for `wordlist` if enabled (DB config `JTR_WORDLIST_INDEX`), else None."""
+    enabled = get_config('JTR_WORDLIST_INDEX', USE_WORDLIST_INDEX)
+    if str(enabled).strip().lower() in ('0', 'false', 'no', 'off', ''):
+        return None
+    try:
+        return get_index(wordlist)
+    except Exception as e:
+        print("wordlist index unavailable:", e)
+        return None
+
+# --- progress reporting ---
+# audit_jobs installs a progress object while a job runs (see set_audit_progress)
+_progress = None
+_shard_counter = None  # in pool workers: shared candidate counter read by the parent
+
+def set_audit_progress(progress):
+    """Install (or clear with None) the object told about audit progress.
+
+    It must provide begin(users_total), begin_scan(size, offset),
+    tick(candidates, offset) -> True to stop, finished_users(n) and stop_requested().
+    """
+    global _progress
+    _progress = progress
+
+def _tick(candidates, offset=None):
+    """Report newly hashed candidates; True if the running job asked to stop."""
+    if _shard_counter is not None:
+        with _shard_counter.get_lock():
+            _shard_counter.value += candidates
+        return False
+    metrics.inc("pcdt_audit_candidates_total", candidates)
+    if _progress is not None:
+        return _progress.tick(candidates, offset)
+    return False
+
+def _stop_requested():
+    return _progress is not None and _progress.stop_requested()
+
+def _lookup_targets(idx, targets, start, guesses=0):
+    """Index-backed equivalent of `_scan_targets`: the whole wordlist is covered."""
+    _tick(idx.count, idx.size)
+    found = {}
+    for digest in targets:
+        hit = idx.lookup(digest)
+        if hit:
+            found[digest] = (hit[0].decode('utf-8', 'replace'), guesses + hit[1], int((time.time() - start) * 1000))
+    return found, guesses + idx.count, idx.size
+
+def _target_map(rows):
+    """Map binary SHA-512 digest -> list of user ids sharing that hash."""
+    targets = {}
+    for user_id, stored_hexdigest in rows:
+        try:
+            digest = bytes.fromhex(stored_hexdigest)
+        except (TypeError, ValueError):
+            continue
+        targets.setdefault(digest, []).append(user_id)
+    return targets
+
+def _scan_targets(wf, targets, start, timeout, guesses=0, offset=0, end=None, rules=None, stop_event=None):
+    """Stream a binary wordlist, hashing each candidate once against all targets.
+
+    Returns (found, guesses, offset) where found maps digest -> (password, guess
+    number, elapsed ms at crack), guesses is the running candidate count and
+    offset is the byte position reached (everything before it was tried).
+    Scanning stops at byte `end` if given. With `rules`, each line is expanded
+    into its de-duplicated mangled candidates, which are hashed as one batch.
+    `stop_event` is polled and set to coordinate sharded workers.
+    """
+    found = {}
+    sha512 = hashlib.sha512
+    seen = DedupCache() if rules else None
+    next_check = guesses + 1024
+    reported = guesses
+    for line in wf:
+        if end is not None and offset >= end:
+            break
+        offset += len(line)
+        word = line.rstrip(b'\n').rstrip(b'\r')
+        if not word:
+            continue
+        candidates = mangle(word, rules, seen) if rules else (word,)
+        digests = [sha512(c).digest() for c in candidates]
+        for i, digest in enumerate(digests):
+            if digest in targets and digest not in found:
+                found[digest] = (candidates[i].decode('utf-8', 'replace'), guesses + i + 1, int((time.time() - start) * 1000))
+        guesses += len(candidates)
+        if len(found) == len(targets):
+            if stop_event is not None:
+                stop_event.set()
+            break
+        # checking the clock on every candidate costs more than the hash itself
+        if guesses >= next_check:
+            next_check = guesses + 1024
+            stop = _tick(guesses - reported, offset)
+            reported = guesses
+            elapsed = time.time() - start
+            # not in forked pool workers: metrics._lock may have been copied held,
+            # and the gauge there would never reach /metrics anyway
+            if _shard_counter is None:
+                metrics.set_gauge("pcdt_audit_budget_remaining_seconds", max(0.0, timeout - elapsed))
+            if stop or elapsed > timeout or (stop_event is not None and stop_event.is_set()):
+                break
+    _tick(guesses - reported, offset)
+    return found, guesses, offset
+
+def _mask_search(targets, start, timeout, guesses=0):
+    """Hash mask candidates (see masks.py) in probability order until every
+    target is found or the time budget runs out. Returns (found, guesses) with
+    exact guess numbers, like `_scan_targets`.
+    """
+    try:
+        gen = build_generator(fetch_pattern_counts(), get_pcfg_model())
+    except Exception as e:
+        print("mask generator unavailable:", e)
+        return {}, guesses
+    found, guesses, _ = _scan_targets(iter(gen), targets, start, timeout, guesses)
+    return found, guesses
+
+# --- sharded parallel scan ---
+_stop_event = None  # set in each pool worker; any worker sets it to cancel the others
+
+def _init_shard_worker(stop_event, counter):
+    global _stop_event, _shard_counter
+    _stop_event = stop_event
+    _shard_counter = counter
+
+def _shard_bounds(wordlist, shards, begin=0):
+    """Split bytes [begin, EOF) into `shards` ranges that start and end on line boundaries."""
+    size = os.path.getsize(wordlist)
+    bounds = [begin]
+    with open(wordlist, 'rb') as wf:
+        for i in range(1, shards):
+            wf.seek(begin + (size - begin) * i // shards)
+            wf.readline()
+            pos = min(wf.tell(), size)
+            if pos > bounds[-1]:
+                bounds.append(pos)
+    if size > bounds[-1]:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+_EMPTY_LINE = re.compile(rb'^\r*\n', re.M)
+
+def _shard_bases(wordlist, shards):
+    """Non-empty lines (candidates of the literal scan) before each shard, counted from the first shard."""
+    bases = [0]
+    count = 0
+    with open(wordlist, 'rb') as wf:
+        wf.seek(shards[0][0])
+        for begin, end in shards[:-1]:
+            left = end - begin
+            while left > 0:
+                block = wf.read(min(left, 1 << 20))
+                if not block:
+                    break
+                if len(block) < left and not block.endswith(b'\n'):
+                    block += wf.readline()
+                left -= len(block)
+                count += block.count(b'\n') + (not block.endswith(b'\n'))
+                # empty lines are skipped by the scanner; most wordlists have none
+                if b'\n\n' in block or b'\n\r' in block or block[:1] in (b'\n', b'\r'):
+                    count -= len(_EMPTY_LINE.findall(block))
+            bases.append(count)
+    return bases
+
+def _scan_shard(args):
+    """Pool task: scan bytes [begin, end) of the wordlist. Returns (found, guesses, position reached)."""
+    wordlist, begin, end, targets, start, timeout, rules = args
+    with open(wordlist, 'rb') as wf:
+        wf.seek(begin)
+        return _scan_targets(wf, targets, start, timeout, 0, begin, end, rules, _stop_event)
+
+def _scan_wordlist(wordlist, targets, start, timeout, guesses=0, offset=0, rules=None):
+    """Scan `wordlist` from byte `offset` for `targets`, in-process or sharded
+    across `JTR_WORKERS` processes, optionally through mangling `rules`.
+
+    Same contract as `_scan_targets`. In the sharded scan the guess count of a
+    crack is its position within its shard plus the candidates before the
+    shard, counted up front from the lines before it, so it matches a
+    sequential scan whatever `JTR_WORKERS` is and however far a cancelled
+    earlier shard got. Through `rules` every earlier line counts as one
+    candidate per rule, an upper bound on the de-duplicated sequential count.
+    The returned total is the candidates hashed by all workers, and the
+    returned offset is the end of the contiguous prefix every shard finished.
+    """
+    if _progress is not None:
+        _progress.begin_scan(os.path.getsize(wordlist), offset)
+    workers = _get_workers()
+    if workers <= 1:
+        with open(wordlist, 'rb') as wf:
+            wf.seek(offset)
+            return _scan_targets(wf, targets, start, timeout, guesses, offset, rules=rules)
+
+    shards = _shard_bounds(wordlist, workers, offset)
+    if not shards:
+        return {}, guesses, offset
+    per_line = len(rules) if rules else 1
+    bases = [guesses + base * per_line for base in _shard_bases(wordlist, shards)]
+    stop_event = multiprocessing.Event()
+    tasks = [(wordlist, b, e, set(targets), start, timeout, rules) for b, e in shards]
+    counter = multiprocessing.Value('q', 0)
+    with multiprocessing.Pool(len(tasks) or 1, initializer=_init_shard_worker, initargs=(stop_event, counter)) as pool:
+        pending = pool.map_async(_scan_shard, tasks)
+        # relay the workers' candidate count to the job and pass a stop request back
+        reported = 0
+        while not pending.ready():
+            pending.wait(0.5)
+            total = counter.value
+            if _tick(total - reported):
+                stop_event.set()
+            reported = total
+        results = pending.get()
+
+    found = {}
+    contiguous = True
+    for (begin, end), base, (shard_found, shard_guesses, pos) in zip(shards, bases, results):
+        for digest, (password, local_guess, cracked_ms) in shard_found.items():
+            if digest not in found:
+                found[digest] = (password, base + local_guess, cracked_ms)
+        guesses += shard_guesses
+        if contiguous:
+            offset = pos
+            contiguous = pos >= end
+    _tick(counter.value - reported, offset)
+    return found, guesses, offset
+
+@metrics.timed("pcdt_jtr_hash_seconds")
 def run_jtr_on_hash(user_id, stored_hexdigest):
     start = time.time()
     guesses = 0
     cracked = False
     cracked_password = None
 
-    # Common passwords to try first (fast path)
-    common_passwords = [
-        'password', '123456', '12345678', 'qwerty', 'abc123', 'monkey', '1234567',
-        'letmein', 'trustno1', 'dragon', 'baseball', 'iloveyou', 'master', 'sunshine',
-        'ashley', 'bailey', 'passw0rd', 'shadow', '123123', '654321'
-    ]
-    
     # Try common passwords first
-    for guess in common_passwords:
+    for guess in COMMON_PASSWORDS:
         guesses += 1
         ghex = hashlib.sha512(guess.encode()).hexdigest()
         if ghex == stored_hexdigest:
@@ -42,62 +360,30 @@ def run_jtr_on_hash(user_id, stored_hexdigest):
             return guesses, False, None, str(audit_time_ms)
 
 
-    # Create a temporary file with the hash for John to consume
     import tempfile
     tf = None
     try:
-        fd, tf = tempfile.mkstemp(prefix=f"jtrhash_{user_id}_", text=True)
-        with os.fdopen(fd, 'w') as f:
-            # John accepts raw hex hashes in the format user:hash
-            f.write(f"user{user_id}:{stored_hexdigest}\n")
-
-        # Determine wordlist preference order:
-        # 1) DB-configured path (`JTR_WORDLIST`)
-        # 2) Project-local `wordlists/rockyou.txt`
-        # 3) Environment default `WORDLIST_PATH`
-        # 4) common system fallback paths
-        wordlist = None
-        db_wordlist = get_config('JTR_WORDLIST')
-        project_wordlist = os.path.join(os.path.dirname(__file__), 'wordlists', 'rockyou.txt')
-        if db_wordlist and os.path.exists(db_wordlist):
-            wordlist = db_wordlist
-        elif os.path.exists(project_wordlist):
-            wordlist = project_wordlist
-        elif WORDLIST_PATH and os.path.exists(WORDLIST_PATH):
-            wordlist = WORDLIST_PATH
-        else:
-            preferred_wordlists = [
-                '/usr/share/wordlists/rockyou.txt',
-                '/usr/share/seclists/Passwords/Leaked-Databases/rockyou.txt',
-                '/usr/share/wordlists/fasttrack.txt'
-            ]
-            for p in preferred_wordlists:
-                if os.path.exists(p):
-                    wordlist = p
-                    break
+        wordlist = resolve_wordlist()
 
         # If we have a wordlist file available, do a fast Python-based dictionary attack
         # (the system's `john` may be an older build without Raw-SHA512 support).
         if wordlist:
-            db_timeout = get_config('JTR_MAX_SECONDS_PER_USER')
-            try:
-                timeout = int(db_timeout) if db_timeout is not None else MAX_SECONDS_PER_USER
-            except Exception:
-                timeout = MAX_SECONDS_PER_USER
+            timeout = _get_timeout()
 
+            targets = _target_map([(user_id, stored_hexdigest)])
+            idx = _get_index(wordlist)
             try:
-                with open(wordlist, 'r', errors='ignore') as wf:
-                    for line in wf:
-                        guess = line.rstrip('\n').rstrip('\r')
-                        if not guess:
-                            continue
-                        guesses += 1
-                        if hashlib.sha512(guess.encode()).hexdigest() == stored_hexdigest:
-                            cracked = True
-                            cracked_password = guess
-                            break
-                        if (time.time() - start) > timeout:
-                            break
+                if idx:
+                    found, guesses, _ = _lookup_targets(idx, targets, start, guesses)
+                else:
+                    found, guesses, _ = _scan_wordlist(wordlist, targets, start, timeout, guesses)
+                # second pass: mangled candidates, with whatever time is left
+                rules, _ = _get_rules()
+                if not found and rules and (time.time() - start) < timeout:
+                    found, guesses, _ = _scan_wordlist(wordlist, targets, start, timeout, guesses, rules=rules)
+                if found:
+                    cracked = True
+                    cracked_password, guesses, _ = next(iter(found.values()))
             except Exception:
                 # If reading the wordlist fails, fall back to trying john if available
                 wordlist = None
@@ -107,7 +393,23 @@ def run_jtr_on_hash(user_id, stored_hexdigest):
                 insert_jtr_result(user_id, guesses, 1 if cracked else 0, cracked_password, audit_time_ms)
                 return guesses, cracked, cracked_password, str(audit_time_ms)
 
-        # Fallback: try invoking john (incremental) if no usable wordlist or Python path failed
+        # No usable wordlist: probability-ordered mask attack, guided by our stored patterns
+        if _get_fallback() != 'john':
+            found, guesses = _mask_search(_target_map([(user_id, stored_hexdigest)]), start, _get_timeout(), guesses)
+            if found:
+                cracked = True
+                cracked_password, guesses, _ = next(iter(found.values()))
+            audit_time_ms = int((time.time() - start) * 1000)
+            insert_jtr_result(user_id, guesses, 1 if cracked else 0, cracked_password, audit_time_ms)
+            return guesses, cracked, cracked_password, str(audit_time_ms)
+
+        # Create a temporary file with the hash for John to consume
+        fd, tf = tempfile.mkstemp(prefix=f"jtrhash_{user_id}_", text=True)
+        with os.fdopen(fd, 'w') as f:
+            # John accepts raw hex hashes in the format user:hash
+            f.write(f"user{user_id}:{stored_hexdigest}\n")
+
+        # Fallback: try invoking john (incremental) if configured
         john_cmd = ["john", "--format=Raw-SHA512", "--incremental=All", tf]
         try:
             proc = subprocess.Popen(john_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
@@ -116,11 +418,7 @@ def run_jtr_on_hash(user_id, stored_hexdigest):
             return guesses, False, None, "john_missing"
 
         # Determine timeout (DB config overrides environment/default)
-        db_timeout = get_config('JTR_MAX_SECONDS_PER_USER')
-        try:
-            timeout = int(db_timeout) if db_timeout is not None else MAX_SECONDS_PER_USER
-        except Exception:
-            timeout = MAX_SECONDS_PER_USER
+        timeout = _get_timeout()
 
         try:
             proc.wait(timeout=timeout)
@@ -153,20 +451,172 @@ def run_jtr_on_hash(user_id, stored_hexdigest):
                 os.remove(tf)
         except Exception:
             pass
-def run_full_audit_all_users():
-    # Clear previous audit results so table reflects only the latest run
-    try:
-        clear_jtr_results()
-    except Exception:
-        pass
+
+def _wordlist_id(wordlist, rules_id):
+    """Identity of a wordlist for checkpoints: path, size, mtime and the rule set."""
+    st = os.stat(wordlist)
+    return f"{os.path.abspath(wordlist)}:{st.st_size}:{st.st_mtime_ns}:{rules_id}"
+
+def run_multi_target_audit(rows, offset=0, prior_guesses=None, phase=0):
+    """Audit many users with a single pass over the wordlist.
+
+    Every candidate is hashed once and looked up in the set of outstanding
+    digests, so the cost no longer grows with the number of users. One
+    jtr_results row is still written per user; its guess count is the
+    position of the cracking candidate (or the candidates tried if uncracked).
+
+    The audit has two phases: 0 tries the wordlist as-is, 1 tries it again
+    through the `JTR_RULES` mangling rules once phase 0 has reached the end.
+    `phase` and `offset` resume a previous scan from that byte position (the
+    common passwords are skipped), and `prior_guesses` maps user_id ->
+    candidates already tried for that user. A checkpoint is saved for every user.
+    """
+    start = time.time()
+    prior_guesses = prior_guesses or {}
+    targets = _target_map(rows)
+    timeout = _get_timeout()
+    rules, rules_id = _get_rules()
+    last_phase = 1 if rules else 0
+    found = {}
+    guesses = 0
+
+    # common passwords first, same order as the per-user fast path
+    common = [(g.encode() + b'\n') for g in COMMON_PASSWORDS]
+    if targets and not offset and not phase:
+        found, guesses, _ = _scan_targets(common, targets, start, timeout)
+
+    wordlist = resolve_wordlist()
+    wordlist_id = None
+    size = None
+    end = offset
+    indexed = False
+    if wordlist and len(found) < len(targets):
+        remaining = {d: u for d, u in targets.items() if d not in found}
+        idx = _get_index(wordlist) if phase == 0 else None
+        try:
+            wordlist_id = _wordlist_id(wordlist, rules_id)
+            size = os.path.getsize(wordlist)
+            if phase == 0:
+                if idx:
+                    more, guesses, end = _lookup_targets(idx, remaining, start, len(COMMON_PASSWORDS))
+                    indexed = True
+                else:
+                    more, guesses, end = _scan_wordlist(wordlist, remaining, start, timeout, guesses, offset)
+                found.update(more)
+                remaining = {d: u for d, u in remaining.items() if d not in found}
+                if rules and remaining and end >= size and (time.time() - start) < timeout and not _stop_requested():
+                    phase, offset = 1, 0
+            if phase == 1 and remaining:
+                more, guesses, end = _scan_wordlist(wordlist, remaining, start, timeout, guesses, offset, rules)
+                found.update(more)
+        except Exception:
+            wordlist = None
+    elif wordlist:
+        wordlist_id = _wordlist_id(wordlist, rules_id)
+
+    # no usable wordlist: one mask search or one john session shared by every remaining hash
+    fallback = None if wordlist else _get_fallback()
+    john_cracked = {}  # user_id -> (password, elapsed ms), already stored
+    john_status = None
+    if fallback and len(found) < len(targets) and not _stop_requested():
+        remaining = {d: u for d, u in targets.items() if d not in found}
+        if fallback == 'john':
+            def on_crack(user_id, password, elapsed_ms):
+                # john does not say how many candidates it tried before a crack
+                insert_jtr_result(user_id, None, 1, password, elapsed_ms)
+                john_cracked[user_id] = (password, elapsed_ms)
+            john_status = _run_john_session([(u, d.hex()) for d, uids in remaining.items() for u in uids], on_crack)
+        else:
+            more, guesses = _mask_search(remaining, start, timeout, guesses)
+            found.update(more)
+
+    finished = size is not None and phase == last_phase and end >= size
+    audit_time_ms = int((time.time() - start) * 1000)
+    results = []
+    states = []
+    for user_id, stored_hash in rows:
+        prior = 0 if indexed else prior_guesses.get(user_id, 0)
+        try:
+            hit = found.get(bytes.fromhex(stored_hash))
+        except (TypeError, ValueError):
+            hit = None
+        if hit:
+            cracked_password, user_guesses, cracked_ms = hit
+            user_guesses += prior
+            insert_jtr_result(user_id, user_guesses, 1, cracked_password, cracked_ms)
+            results.append((user_id, user_guesses, True, cracked_password, str(cracked_ms)))
+            if wordlist_id:
+                states.append((user_id, stored_hash, wordlist_id, phase, end, user_guesses, 1))
+        elif wordlist:
+            insert_jtr_result(user_id, prior + guesses, 0, None, audit_time_ms)
+            results.append((user_id, prior + guesses, False, None, str(audit_time_ms)))
+            states.append((user_id, stored_hash, wordlist_id, phase, end, prior + guesses, 1 if finished else 0))
+        elif user_id in john_cracked:
+            cracked_password, cracked_ms = john_cracked[user_id]
+            results.append((user_id, None, True, cracked_password, str(cracked_ms)))
+        else:
+            # mask searches and john sessions are not checkpointed here; john resumes from its own .rec file
+            audit_time = "john_missing" if john_status == "john_missing" else audit_time_ms
+            insert_jtr_result(user_id, guesses, 0, None, audit_time)
+            results.append((user_id, guesses, False, None, str(audit_time)))
+    if states:
+        save_audit_states(states)
+    if _progress is not None:
+        # a stopped scan finished only the users it cracked; the rest are pending again on resume
+        done = len(rows) if not _stop_requested() else sum(1 for r in results if r[2])
+        _progress.finished_users(done)
+    return results
+
+def run_full_audit_all_users(full=False):
+    """Audit every user, reusing checkpoints from earlier runs.
+
+    Users whose hash, wordlist and rules are unchanged since an audit that
+    cracked them or finished every phase are skipped (their jtr_results row
+    is kept). Audits that timed out continue from their saved byte offset, and
+    new or changed accounts start from the beginning. `full=True` discards all
+    results and checkpoints first, like the original full rescan.
+    """
+    if full:
+        try:
+            clear_jtr_results()
+            clear_audit_state()
+        except Exception:
+            pass
 
     conn = get_conn()
     c = conn.cursor()
     c.execute("SELECT id, password_hash FROM users")
     rows = c.fetchall()
     conn.close()
-    results = []
+
+    states = get_audit_states()
+    wordlist = resolve_wordlist()
+    try:
+        wordlist_id = _wordlist_id(wordlist, _get_rules()[1]) if wordlist else None
+    except OSError:
+        wordlist_id = None
+
+    # group pending users by resume point so each group is one pass
+    pending = {}
+    prior_guesses = {}
     for user_id, stored_hash in rows:
-        r = run_jtr_on_hash(user_id, stored_hash)
-        results.append((user_id,) + r)
+        state = states.get(user_id)
+        if state and wordlist_id and state[0] == stored_hash and state[1] == wordlist_id:
+            _, _, phase, offset, guesses, finished = state
+            if finished:
+                continue
+            pending.setdefault((phase, offset), []).append((user_id, stored_hash))
+            prior_guesses[user_id] = guesses
+        else:
+            pending.setdefault((0, 0), []).append((user_id, stored_hash))
+
+    if _progress is not None:
+        _progress.begin(sum(len(g) for g in pending.values()))
+    results = []
+    for phase, offset in sorted(pending):
+        if _stop_requested():
+            break
+        group = pending[(phase, offset)]
+        delete_jtr_results_for_users([user_id for user_id, _ in group])
+        results.extend(run_multi_target_audit(group, offset, prior_guesses, phase))
     return results
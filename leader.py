@@ -0,0 +1,86 @@
+# leader.py
+# Leader election for running several app processes (gunicorn/uwsgi workers)
+# against one database. Every process heartbeats a named lease in the `leases`
+# table; whoever holds it runs the singleton work (detection passes, log
+# retention) and the others stand by. A leader that dies stops renewing, and
+# another process takes over once the lease expires (LEASE_TTL seconds); one
+# that exits cleanly releases the lease so the handover is immediate.
+import atexit
+import os
+import socket
+import threading
+import time
+import uuid
+import metrics
+from database import acquire_lease, release_lease
+
+# Seconds a lease stays valid without a heartbeat (set `PCDT_LEASE_TTL`)
+LEASE_TTL = float(os.environ.get("PCDT_LEASE_TTL", "15"))
+# Identifies this process in the leases table
+HOLDER = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class Lease:
+    """A heartbeated lease; is_held() is True while this process is the leader."""
+
+    def __init__(self, name="leader", ttl=None, holder=None):
+        self.name = name
+        self.ttl = ttl or LEASE_TTL
+        self.holder = holder or HOLDER
+        self._valid_until = 0.0  # monotonic time our last successful renewal runs out
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def is_held(self):
+        return time.monotonic() < self._valid_until
+
+    def heartbeat(self):
+        """Try to take or renew the lease once; returns True if held."""
+        start = time.monotonic()
+        was_held = self.is_held()
+        try:
+            held = acquire_lease(self.name, self.holder, int(self.ttl * 1000))
+        except Exception as e:
+            print("lease heartbeat error:", e)
+            held = False
+        # count validity from before the write, so we never outlive the row's expiry
+        self._valid_until = start + self.ttl if held else 0.0
+        if held != was_held:
+            print(f"lease {self.name}: {'acquired' if held else 'lost'} by {self.holder}")
+        metrics.set_gauge("pcdt_leader", 1 if held else 0, lease=self.name)
+        return held
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self.heartbeat()
+            self._stopped.wait(self.ttl / 3)
+
+    def start(self):
+        """Heartbeat every ttl/3 seconds in a daemon thread (idempotent)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=f"lease-{self.name}", daemon=True)
+            self._thread.start()
+            atexit.register(self.release)
+        return self
+
+    def release(self):
+        self._stopped.set()
+        if self.is_held():
+            self._valid_until = 0.0
+            try:
+                release_lease(self.name, self.holder)
+            except Exception as e:
+                print("lease release error:", e)
+
+def run_while_leader(lease, fn, interval, name=None):
+    """Call fn() every `interval` seconds, but only while `lease` is held."""
+    def loop():
+        while True:
+            if lease.is_held():
+                try:
+                    fn()
+                except Exception as e:
+                    print(f"{name or fn.__name__} error:", e)
+            time.sleep(interval)
+    t = threading.Thread(target=loop, name=name or fn.__name__, daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,199 @@
+# mangling.py
+# Word-mangling rules for dictionary audits, a subset of John the Ripper's
+# rule syntax. Rules are compiled once and applied lazily per wordlist line.
+#
+# Supported commands:
+#   :       no-op                      l   lowercase        u   uppercase
+#   c       capitalize                 C   lowercase first, uppercase rest
+#   t       toggle case                r   reverse          d   duplicate
+#   $X      append X                   ^X  prepend X        sXY replace X with Y
+# Preprocessor: [..] expands to one rule per character, with ranges (0-9, a-z)
+# and backslash escapes, e.g. `c$[0-9]$[!@#]` is 30 rules.
+import hashlib
+import os
+
+# Ordered roughly by how often each transformation cracks real passwords
+DEFAULT_RULES = r"""
+:
+c
+l
+u
+$[0-9]
+c$[0-9]
+$[0-9]$[0-9]
+c$[0-9]$[0-9]
+$1$2$3
+c$1$2$3
+$[!@#$%*?.]
+c$[!@#$%*?.]
+c$[0-9]$[!@#$%*?.]
+$1$9$[0-9]$[0-9]
+$2$0$[0-2]$[0-9]
+c$1$9$[0-9]$[0-9]
+c$2$0$[0-2]$[0-9]
+c$2$0$[0-2]$[0-9]$[!@#]
+c$1$9$[0-9]$[0-9]$[!@#]
+sa@
+so0
+se3
+si1
+ss$
+sa@so0se3si1
+csa@so0se3si1
+csa@so0se3si1$[0-9]
+^[!@#$*]
+t
+r
+d
+"""
+
+# candidates remembered for de-duplication (two generations of this size)
+DEDUP_CACHE_SIZE = 200000
+
+class RuleError(ValueError):
+    pass
+
+def _expand_class(body):
+    chars = []
+    i = 0
+    while i < len(body):
+        ch = body[i]
+        if ch == "\\" and i + 1 < len(body):
+            chars.append(body[i + 1])
+            i += 2
+            continue
+        if i + 2 < len(body) and body[i + 1] == "-":
+            lo, hi = ord(ch), ord(body[i + 2])
+            chars.extend(chr(c) for c in range(lo, hi + 1))
+            i += 3
+            continue
+        chars.append(ch)
+        i += 1
+    return chars
+
+def expand_rule(rule):
+    """Preprocess one rule line: expand every [..] class into separate rules."""
+    start = None
+    i = 0
+    while i < len(rule):
+        if rule[i] == "\\":
+            i += 2
+            continue
+        if rule[i] == "[":
+            start = i
+            break
+        i += 1
+    if start is None:
+        return [rule]
+    j = start + 1
+    while j < len(rule) and not (rule[j] == "]" and rule[j - 1] != "\\"):
+        j += 1
+    if j >= len(rule):
+        raise RuleError(f"unterminated [ in rule {rule!r}")
+    out = []
+    for ch in _expand_class(rule[start + 1:j]):
+        out.extend(expand_rule(rule[:start] + ch + rule[j + 1:]))
+    return out
+
+def compile_rule(rule):
+    """Parse a preprocessed rule into a list of (command, args) steps over bytes."""
+    steps = []
+    i = 0
+    while i < len(rule):
+        ch = rule[i]
+        if ch in " :":
+            i += 1
+        elif ch in "lucCtrd":
+            steps.append((ch, None))
+            i += 1
+        elif ch in "$^":
+            if i + 1 >= len(rule):
+                raise RuleError(f"{ch} needs an argument in {rule!r}")
+            steps.append((ch, rule[i + 1].encode()))
+            i += 2
+        elif ch == "s":
+            if i + 2 >= len(rule):
+                raise RuleError(f"s needs two arguments in {rule!r}")
+            steps.append((ch, (rule[i + 1].encode(), rule[i + 2].encode())))
+            i += 3
+        else:
+            raise RuleError(f"unsupported rule command {ch!r} in {rule!r}")
+    return steps
+
+def apply_rule(steps, word):
+    for cmd, arg in steps:
+        if cmd == "l":
+            word = word.lower()
+        elif cmd == "u":
+            word = word.upper()
+        elif cmd == "c":
+            word = word.capitalize()
+        elif cmd == "C":
+            word = word[:1].lower() + word[1:].upper()
+        elif cmd == "t":
+            word = word.swapcase()
+        elif cmd == "r":
+            word = word[::-1]
+        elif cmd == "d":
+            word = word + word
+        elif cmd == "$":
+            word = word + arg
+        elif cmd == "^":
+            word = arg + word
+        elif cmd == "s":
+            word = word.replace(arg[0], arg[1])
+    return word
+
+def load_rules(spec):
+    """Compile a rule set: 'default', a path to a rules file, or rule text.
+
+    Returns (compiled rules, short id that changes whenever the rules do).
+    """
+    if spec in (None, "", "default", "1"):
+        text = DEFAULT_RULES
+    elif "\n" not in spec and os.path.isfile(spec):
+        with open(spec, "r", encoding="utf-8", errors="ignore") as f:
+            text = f.read()
+    else:
+        text = spec
+    rules = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        rules.extend(compile_rule(r) for r in expand_rule(line))
+    # a rule with no steps (`:`) only repeats the word, which the literal pass already tried
+    rules = [steps for steps in rules if steps]
+    tag = hashlib.sha1(text.encode()).hexdigest()[:12]
+    return rules, tag
+
+class DedupCache:
+    """Bounded "seen recently" set: two generations, the older one is dropped when full."""
+
+    def __init__(self, size=DEDUP_CACHE_SIZE):
+        self.size = size
+        self.current = set()
+        self.previous = set()
+
+    def add(self, item):
+        """Add `item`; returns False if it was already seen."""
+        if item in self.current or item in self.previous:
+            return False
+        self.current.add(item)
+        if len(self.current) >= self.size:
+            self.previous = self.current
+            self.current = set()
+        return True
+
+def mangle(word, rules, seen):
+    """All distinct candidates the rules make from `word`, in rule order.
+
+    `word` itself is left out (e.g. `l` on a lowercase word): the literal
+    wordlist pass has already hashed it.
+    """
+    out = []
+    for steps in rules:
+        cand = apply_rule(steps, word)
+        if cand and cand != word and seen.add(cand):
+            out.append(cand)
+    return out
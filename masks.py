@@ -0,0 +1,155 @@
+# masks.py
+# Probability-ordered mask attack, used when no wordlist is available.
+#
+# A base structure such as `U1L5D2` (the patterns pcfg_analysis stores) is
+# refined into masks by giving every position a character tier, e.g. the six
+# most common lowercase letters, the next ten, or the rest. A mask's
+# probability is P(structure) times the tier masses, and masks are popped from
+# a heap in decreasing order of probability per candidate, so the likeliest
+# candidates are hashed first. Each mask is expanded lazily with
+# itertools.product, so memory stays proportional to the number of masks.
+import heapq
+import itertools
+import math
+import os
+from pcfg_utils import CHARSETS, _groups_from_pattern
+
+# Longest structure the generator will expand (set `JTR_MASK_MAX_LENGTH`)
+MAX_LENGTH = int(os.environ.get("JTR_MASK_MAX_LENGTH", "12"))
+
+# Characters of each class, most common first (approximate frequencies in leaked passwords)
+CHAR_ORDER = {
+    'L': "aeionrlstmcdyhbukgpjvfwzxq",
+    'U': "SMJCABDLKTRPGHNEFWVIOYZUXQ",
+    'D': "1203984567",
+    'S': "!.@#_-*$ &?+/%,=')(;:\"[]^~`{}|<>\\",
+}
+# Tier sizes per class; the last tier takes whatever is left
+TIER_SIZES = {'L': (6, 10), 'U': (6, 10), 'D': (4,), 'S': (4, 6)}
+
+# Used when pcfg_analysis has no rows yet and no PCFG model is loaded
+DEFAULT_PATTERNS = {
+    'L6': 8, 'L8': 7, 'L7': 7, 'L6D2': 5, 'L5D2': 4, 'L8D2': 4, 'L7D1': 4, 'L6D1': 4,
+    'D6': 4, 'D8': 3, 'L9': 3, 'L10': 2, 'U1L6D2': 2, 'U1L7D1': 2, 'U1L5D2S1': 1,
+    'U1L7D2S1': 1, 'L6D4': 1, 'U1L7D4': 1, 'L8S1': 1, 'D10': 1,
+}
+# Weight of the model/default structures next to the observed pattern counts
+PRIOR_WEIGHT = 0.5
+
+def _zipf(chars):
+    weights = [1.0 / (r + 1) for r in range(len(chars))]
+    total = sum(weights)
+    return {ch: w / total for ch, w in zip(chars, weights)}
+
+def char_priors(model=None):
+    """Per-class {char: probability}, learned from a PCFG model's terminals if given."""
+    priors = {}
+    for cls, chars in CHARSETS.items():
+        freq = dict.fromkeys(chars, 0.0)
+        if model is not None:
+            for group, g in model.terminals.items():
+                if group[0] != cls:
+                    continue
+                for terminal, p in g["probs"].items():
+                    for ch in terminal:
+                        if ch in freq:
+                            freq[ch] += p
+        total = sum(freq.values())
+        if total > 0:
+            # unseen characters keep a small share so every candidate stays reachable
+            floor = total * 1e-4
+            total += floor * len(freq)
+            priors[cls] = {ch: (f + floor) / total for ch, f in freq.items()}
+        else:
+            order = CHAR_ORDER[cls] + ''.join(ch for ch in chars if ch not in CHAR_ORDER[cls])
+            priors[cls] = _zipf(order)
+    return priors
+
+def _tiers(priors):
+    """cls -> [(chars most likely first, probability mass), ...]."""
+    tiers = {}
+    for cls, probs in priors.items():
+        order = sorted(probs, key=lambda ch: -probs[ch])
+        out = []
+        pos = 0
+        for size in TIER_SIZES.get(cls, ()):
+            if pos + size >= len(order):
+                break
+            out.append(order[pos:pos + size])
+            pos += size
+        out.append(order[pos:])
+        tiers[cls] = [(''.join(t), sum(probs[ch] for ch in t)) for t in out]
+    return tiers
+
+def structure_priors(pattern_counts, model=None):
+    """Blend observed pattern counts with the model's (or default) structure probabilities."""
+    prior = model.structures if model is not None and model.structures else DEFAULT_PATTERNS
+    prior_total = float(sum(prior.values())) or 1.0
+    counts_total = float(sum(pattern_counts.values()))
+    scale = PRIOR_WEIGHT * (counts_total or 1.0) / prior_total
+    blended = {p: c + prior.get(p, 0.0) * scale for p, c in pattern_counts.items()}
+    for p, w in prior.items():
+        if p not in blended:
+            blended[p] = w * scale
+    total = sum(blended.values())
+    return {p: w / total for p, w in blended.items() if w > 0}
+
+class MaskGenerator:
+    """Streams candidates mask by mask, in decreasing probability per candidate."""
+
+    def __init__(self, structures, priors=None, max_length=MAX_LENGTH):
+        self.tiers = _tiers(priors or char_priors())
+        self.structures = []
+        for pattern, p in structures.items():
+            try:
+                _, groups = _groups_from_pattern(pattern)
+            except (ValueError, IndexError):
+                continue
+            classes = [cls for cls, n in groups for _ in range(n)]
+            if classes and len(classes) <= max_length and all(cls in self.tiers for cls in classes):
+                self.structures.append((p, classes))
+
+    def _cost(self, p, classes, tiers):
+        """-log(probability per candidate) of a mask; lower is tried first."""
+        cost = -math.log(p)
+        for cls, t in zip(classes, tiers):
+            chars, mass = self.tiers[cls][t]
+            cost -= math.log(mass / len(chars))
+        return cost
+
+    def masks(self):
+        """Yield (structure index, per-position tier tuple) in priority order.
+
+        Uses the pivot ("deadbeat dad") traversal: a child only bumps positions
+        at or after its parent's pivot, so every mask is pushed exactly once.
+        """
+        heap = []
+        for i, (p, classes) in enumerate(self.structures):
+            tiers = (0,) * len(classes)
+            heapq.heappush(heap, (self._cost(p, classes, tiers), i, tiers, 0))
+        while heap:
+            _, i, tiers, pivot = heapq.heappop(heap)
+            yield i, tiers
+            p, classes = self.structures[i]
+            for pos in range(pivot, len(tiers)):
+                if tiers[pos] + 1 < len(self.tiers[classes[pos]]):
+                    child = tiers[:pos] + (tiers[pos] + 1,) + tiers[pos + 1:]
+                    heapq.heappush(heap, (self._cost(p, classes, child), i, child, pos))
+
+    def mask_size(self, i, tiers):
+        size = 1
+        for cls, t in zip(self.structures[i][1], tiers):
+            size *= len(self.tiers[cls][t][0])
+        return size
+
+    def __iter__(self):
+        """Every candidate (bytes), never repeated, likeliest masks first."""
+        for i, tiers in self.masks():
+            classes = self.structures[i][1]
+            pools = [self.tiers[cls][t][0].encode('latin-1') for cls, t in zip(classes, tiers)]
+            for combo in itertools.product(*pools):
+                yield bytes(combo)
+
+def build_generator(pattern_counts=None, model=None, max_length=MAX_LENGTH):
+    """MaskGenerator from pcfg_analysis pattern counts and the optional PCFG model."""
+    return MaskGenerator(structure_priors(pattern_counts or {}, model), char_priors(model), max_length)
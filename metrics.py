@@ -0,0 +1,147 @@
+# metrics.py
+# In-process counters, gauges and histograms rendered in the Prometheus text
+# format for GET /metrics. Updates are a dict lookup and an add under one lock,
+# cheap enough to leave on in production; set `PCDT_METRICS=0` to turn every
+# update into a no-op.
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+ENABLED = os.environ.get("PCDT_METRICS", "1") != "0"
+# Histogram upper bounds in seconds (+Inf is implicit)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_lock = threading.Lock()
+_meta = {}        # name -> (type, help)
+_counters = {}    # (name, labels) -> float
+_gauges = {}      # (name, labels) -> float
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+
+def describe(name, kind, help_text):
+    """Register HELP/TYPE for a metric (kind: counter, gauge or histogram)."""
+    _meta[name] = (kind, help_text)
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items())) if labels else ()
+
+def inc(name, value=1, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+def set_gauge(name, value, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _gauges[key] = value
+
+def observe(name, seconds, **labels):
+    if not ENABLED:
+        return
+    key = _key(name, labels)
+    i = bisect_left(BUCKETS, seconds)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = [0] * (len(BUCKETS) + 3)
+        h[i] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+@contextmanager
+def timer(name, **labels):
+    """Observe the duration of the with-block into histogram `name`."""
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - t0, **labels)
+
+def timed(name, **labels):
+    """Decorator form of timer()."""
+    def wrap(fn):
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            if not ENABLED:
+                return fn(*args, **kwargs)
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe(name, time.perf_counter() - t0, **labels)
+        return inner
+    return wrap
+
+def _fmt_labels(labels, extra=None):
+    items = list(labels) + (extra or [])
+    if not items:
+        return ""
+    body = ",".join('{}="{}"'.format(k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for k, v in items)
+    return "{" + body + "}"
+
+def _fmt_value(v):
+    if v == float("inf"):
+        return "+Inf"
+    if isinstance(v, float) and v.is_integer():
+        return str(int(v))
+    return repr(v) if isinstance(v, float) else str(v)
+
+def render():
+    """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+    with _lock:
+        counters = dict(_counters)
+        gauges = dict(_gauges)
+        histograms = {k: list(v) for k, v in _histograms.items()}
+    by_name = {}
+    for kind, series in (("counter", counters), ("gauge", gauges), ("histogram", histograms)):
+        for (name, labels), value in series.items():
+            by_name.setdefault(name, (kind, []))[1].append((labels, value))
+
+    lines = []
+    for name in sorted(by_name):
+        kind, series = by_name[name]
+        help_text = _meta.get(name, (kind, ""))[1]
+        if help_text:
+            lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in sorted(series):
+            if kind != "histogram":
+                lines.append(f"{name}{_fmt_labels(labels)} {_fmt_value(value)}")
+                continue
+            cumulative = 0
+            for bound, n in zip(BUCKETS + (float("inf"),), value[:-2]):
+                cumulative += n
+                lines.append(f"{name}_bucket{_fmt_labels(labels, [('le', _fmt_value(float(bound)))])} {cumulative}")
+            lines.append(f"{name}_sum{_fmt_labels(labels)} {_fmt_value(value[-2])}")
+            lines.append(f"{name}_count{_fmt_labels(labels)} {value[-1]}")
+    return "\n".join(lines) + "\n"
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _histograms.clear()
+
+describe("pcdt_db_call_seconds", "histogram", "Time spent in database.py helpers.")
+describe("pcdt_sqlite_connections_opened_total", "counter", "SQLite connections opened (one per thread when pooling works).")
+describe("pcdt_detection_pass_seconds", "histogram", "Duration of run_detection_once.")
+describe("pcdt_jtr_hash_seconds", "histogram", "Duration of run_jtr_on_hash.")
+describe("pcdt_audit_candidates_total", "counter", "Candidates hashed by audits.")
+describe("pcdt_audit_budget_remaining_seconds", "gauge", "Time budget left in the running audit scan.")
+describe("pcdt_http_request_seconds", "histogram", "Flask request latency by endpoint.")
+describe("pcdt_http_requests_total", "counter", "Flask requests by endpoint, method and status.")
+describe("pcdt_profiler_running", "gauge", "1 while the sampling profiler is collecting.")
+describe("pcdt_api_cache_total", "counter", "Dashboard API page lookups by table and result (hit, miss, not_modified).")
+describe("pcdt_retention_rows_archived_total", "counter", "login_logs rows moved to the Parquet archive.")
+describe("pcdt_leader", "gauge", "1 while this process holds the named lease.")
+describe("pcdt_user_cache_total", "counter", "Login user lookups by result (hit, negative_hit, miss).")
+describe("pcdt_user_cache_entries", "gauge", "Entries in the login user cache by kind (users, missing).")
+describe("pcdt_login_throttled_total", "counter", "Login attempts rejected before any work, by reason (blocked, ip, username).")
+describe("pcdt_blocked_ips", "gauge", "IPs currently blocked because of brute-force or credential-stuffing alerts.")
@@ -1,5 +1,35 @@
-from database import insert_pcfg
+from database import insert_pcfg, get_config
 from datetime import datetime
+from bisect import bisect_left
+from collections import Counter
+import gzip
+import json
+import math
+import os
+import random
+import string
+import threading
+
+# Trained model file (set `PCFG_MODEL`; DB config `PCFG_MODEL` overrides)
+MODEL_PATH = os.environ.get("PCFG_MODEL", os.path.join(os.path.dirname(os.path.abspath(__file__)), "wordlists", "pcfg_model.json.gz"))
+# Terminals kept per group (e.g. D4, L6); the rest share the leftover probability mass
+TOP_TERMINALS = int(os.environ.get("PCFG_TOP_TERMINALS", "5000"))
+# Monte Carlo samples used to build the guess-number table
+MC_SAMPLES = int(os.environ.get("PCFG_MC_SAMPLES", "100000"))
+# Largest guess number reported (fits an SQLite INTEGER)
+MAX_ESTIMATE = 2 ** 63 - 1
+# Fewest guesses reported for a password the grammar cannot produce, the same floor as the composition heuristic
+MIN_ESTIMATE = 100
+# Counters are pruned to their most frequent entries past this size while training
+_TRAIN_PRUNE_AT = 200000
+
+CHARSETS = {
+    'L': string.ascii_lowercase,
+    'U': string.ascii_uppercase,
+    'D': string.digits,
+    'S': string.punctuation + ' ',
+}
+_ALPHABET_SIZE = sum(len(chars) for chars in CHARSETS.values())
 
 def identify_pattern_and_groups(password):
     groups = []
@@ -19,11 +49,272 @@ def identify_pattern_and_groups(password):
     pattern = ''.join([f"{g[0]}{g[1]}" for g in groups])
     return pattern, groups
 
+def _split_terminals(password, groups):
+    """Yield (group key like 'D4', terminal string) for each character-class run."""
+    pos = 0
+    for cls, n in groups:
+        yield f"{cls}{n}", password[pos:pos + n]
+        pos += n
+
+def _prune(counter, keep):
+    if len(counter) > keep:
+        for key, _ in counter.most_common()[keep:]:
+            del counter[key]
+
+class PCFGModel:
+    """Probabilistic context-free grammar learned from a wordlist.
+
+    P(password) = P(base structure) * product of P(terminal | group). Each
+    group keeps its TOP_TERMINALS most frequent terminals; any other terminal
+    gets an equal share of the group's leftover mass. Guess numbers come from
+    a Monte Carlo table (Dell'Amico & Filippone): for n sampled passwords
+    sorted by probability, the rank of probability p is the sum of 1/(n*p_i)
+    over the samples more likely than p.
+    """
+
+    def __init__(self, structures, terminals, mc_neg_logp=None, mc_ranks=None):
+        self.structures = structures  # pattern -> probability
+        self.terminals = terminals    # group -> {"probs": {terminal: p}, "other": leftover mass}
+        self.mc_neg_logp = mc_neg_logp or []  # ascending -log(p) of the samples
+        self.mc_ranks = mc_ranks or []        # cumulative guess number at each sample
+
+    @staticmethod
+    def _keyspace(group):
+        return len(CHARSETS[group[0]]) ** int(group[1:])
+
+    def _terminal_prob(self, group, terminal):
+        g = self.terminals.get(group)
+        if not g:
+            return 0.0
+        p = g["probs"].get(terminal)
+        if p is not None:
+            return p
+        unseen = self._keyspace(group) - len(g["probs"])
+        try:
+            return g["other"] / unseen if unseen > 0 else 0.0
+        except OverflowError:
+            return 0.0
+
+    def probability(self, password):
+        pattern, groups = identify_pattern_and_groups(password)
+        p = self.structures.get(pattern, 0.0)
+        for group, terminal in _split_terminals(password, groups):
+            if not p:
+                break
+            p *= self._terminal_prob(group, terminal)
+        return p
+
+    def estimate_guesses(self, password):
+        """Estimated guess number for `password` (None only for an empty model).
+
+        Passwords the grammar cannot produce are placed after every grammar
+        guess plus a brute-force search of their own pattern's keyspace, but
+        never past a plain brute force of every string up to their length, and
+        never below MIN_ESTIMATE (so empty or one-character input is not rated 0).
+        """
+        if not self.mc_ranks:
+            return None
+        p = self.probability(password)
+        if p <= 0:
+            _, groups = identify_pattern_and_groups(password)
+            keyspace = 1
+            for cls, n in groups:
+                keyspace *= self._keyspace(f"{cls}{n}")
+            brute_force = sum(_ALPHABET_SIZE ** n for n in range(1, len(password) + 1))
+            return max(MIN_ESTIMATE, min(int(self.mc_ranks[-1]) + keyspace, brute_force, MAX_ESTIMATE))
+        k = bisect_left(self.mc_neg_logp, -math.log(p))
+        if k == 0:
+            return 1
+        return min(max(1, int(self.mc_ranks[k - 1])), MAX_ESTIMATE)
+
+    def sample(self, rng):
+        """Draw one password from the model; returns (password, probability)."""
+        patterns, weights = self._structure_choices
+        pattern = rng.choices(patterns, cum_weights=weights)[0]
+        _, groups = _groups_from_pattern(pattern)
+        out = []
+        p = self.structures[pattern]
+        for cls, n in groups:
+            group = f"{cls}{n}"
+            g = self.terminals[group]
+            if rng.random() < g["other"] or not g["probs"]:
+                chars = CHARSETS[cls]
+                terminal = ''.join(rng.choice(chars) for _ in range(n))
+            else:
+                terms, cum = self._terminal_choices[group]
+                terminal = rng.choices(terms, cum_weights=cum)[0]
+            out.append(terminal)
+            p *= self._terminal_prob(group, terminal)
+        return ''.join(out), p
+
+    def build_rank_table(self, samples=MC_SAMPLES, seed=1):
+        """(Re)compute the Monte Carlo guess-number table."""
+        self._prepare_sampling()
+        rng = random.Random(seed)
+        probs = []
+        for _ in range(samples):
+            _, p = self.sample(rng)
+            if p > 0:
+                probs.append(p)
+        probs.sort(reverse=True)
+        n = len(probs)
+        total = 0.0
+        self.mc_neg_logp = []
+        self.mc_ranks = []
+        for p in probs:
+            total += 1.0 / (n * p)
+            self.mc_neg_logp.append(-math.log(p))
+            self.mc_ranks.append(total)
+
+    def _prepare_sampling(self):
+        patterns = list(self.structures)
+        self._structure_choices = (patterns, _cumulative(self.structures[s] for s in patterns))
+        self._terminal_choices = {}
+        for group, g in self.terminals.items():
+            terms = list(g["probs"])
+            self._terminal_choices[group] = (terms, _cumulative(g["probs"][t] for t in terms))
+
+    def to_dict(self):
+        return {
+            "version": 1,
+            "structures": self.structures,
+            "terminals": self.terminals,
+            "mc_neg_logp": [round(x, 6) for x in self.mc_neg_logp],
+            "mc_ranks": [float(f"{x:.6g}") for x in self.mc_ranks],
+        }
+
+    def save(self, path):
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            d = json.load(f)
+        return cls(d["structures"], d["terminals"], d["mc_neg_logp"], d["mc_ranks"])
+
+def _cumulative(values):
+    out = []
+    total = 0.0
+    for v in values:
+        total += v
+        out.append(total)
+    return out
+
+def _groups_from_pattern(pattern):
+    """Inverse of the pattern string built by identify_pattern_and_groups: 'U1L5D2' -> groups."""
+    groups = []
+    i = 0
+    while i < len(pattern):
+        cls = pattern[i]
+        j = i + 1
+        while j < len(pattern) and pattern[j].isdigit():
+            j += 1
+        groups.append((cls, int(pattern[i + 1:j])))
+        i = j
+    return pattern, groups
+
+def train_pcfg_model(wordlist, model_path=None, max_lines=None, top_terminals=TOP_TERMINALS, samples=MC_SAMPLES):
+    """Learn a PCFGModel from `wordlist` (one password per line), save it and return it."""
+    structures = Counter()
+    terminals = {}
+    total = 0
+    with open(wordlist, "r", encoding="utf-8", errors="ignore") as f:
+        for line in f:
+            pw = line.rstrip("\n").rstrip("\r")
+            if not pw:
+                continue
+            pattern, groups = identify_pattern_and_groups(pw)
+            structures[pattern] += 1
+            for group, terminal in _split_terminals(pw, groups):
+                counter = terminals.setdefault(group, Counter())
+                counter[terminal] += 1
+                if len(counter) > _TRAIN_PRUNE_AT:
+                    _prune(counter, _TRAIN_PRUNE_AT // 2)
+            if len(structures) > _TRAIN_PRUNE_AT:
+                _prune(structures, _TRAIN_PRUNE_AT // 2)
+            total += 1
+            if max_lines and total >= max_lines:
+                break
+
+    struct_total = sum(structures.values())
+    model_structures = {k: v / struct_total for k, v in structures.items()} if struct_total else {}
+    model_terminals = {}
+    for group, counter in terminals.items():
+        group_total = sum(counter.values())
+        kept = dict(counter.most_common(top_terminals))
+        probs = {t: c / group_total for t, c in kept.items()}
+        other = 1.0 - sum(probs.values())
+        if other <= 0 and len(probs) < PCFGModel._keyspace(group):
+            # reserve a little mass for never-seen terminals
+            other = 1.0 / (group_total + 1)
+            probs = {t: p * (1 - other) for t, p in probs.items()}
+        model_terminals[group] = {"probs": probs, "other": max(other, 0.0)}
+
+    model = PCFGModel(model_structures, model_terminals)
+    model.build_rank_table(samples)
+    model.save(model_path or MODEL_PATH)
+    return model
+
+_model = None
+_model_loaded = False
+
+def load_pcfg_model(path=None):
+    """Load the trained model once (DB config `PCFG_MODEL` > env > default path); None if absent."""
+    global _model, _model_loaded
+    path = path or get_config("PCFG_MODEL", MODEL_PATH)
+    try:
+        _model = PCFGModel.load(path) if path and os.path.exists(path) else None
+    except Exception as e:
+        print("pcfg model load error:", e)
+        _model = None
+    _model_loaded = True
+    return _model
+
+def get_pcfg_model():
+    """The loaded model, loading it on first use; None if there is none."""
+    return _model if _model_loaded else load_pcfg_model()
+
+_rank_filter = None
+
+def load_rank_filter(wordlist=None, background=True):
+    """Attach the rank filter for the configured wordlist (see rank_filter.py).
+
+    A missing or stale filter is built, in a background thread by default so
+    startup is not blocked; estimate_guesses skips it until it is ready.
+    """
+    global _rank_filter
+    from jtr_utils import resolve_wordlist
+    from rank_filter import get_rank_filter
+    wordlist = wordlist or resolve_wordlist()
+    if not wordlist:
+        return None
+
+    def build():
+        global _rank_filter
+        try:
+            _rank_filter = get_rank_filter(wordlist)
+        except Exception as e:
+            print("rank filter build error:", e)
+
+    try:
+        _rank_filter = get_rank_filter(wordlist, build=False)
+    except Exception as e:
+        print("rank filter load error:", e)
+    if _rank_filter is None:
+        if background:
+            threading.Thread(target=build, daemon=True).start()
+        else:
+            build()
+    return _rank_filter
+
 def estimate_guesses(password):
     """Estimate guesses needed to crack password using common wordlist ranking.
     
     This uses a realistic approach: if password is in common wordlist, rank it low.
-    Otherwise, estimate based on character composition complexity.
+    A password found in the configured wordlist gets its rank bucket from the
+    rank filter. Otherwise, use the trained PCFG model's Monte Carlo guess number if a model
+    is available, else estimate based on character composition complexity.
     """
     pattern, groups = identify_pattern_and_groups(password)
     
@@ -44,6 +335,19 @@ def estimate_guesses(password):
     pwd_lower = password.lower()
     if pwd_lower in COMMON_PASSWORDS:
         return COMMON_PASSWORDS[pwd_lower], pattern
+
+    # Position in the configured wordlist, if it is in there at all
+    if _rank_filter is not None:
+        bucket = _rank_filter.rank_bucket(password)
+        if bucket is not None:
+            return bucket, pattern
+
+    # Trained PCFG model, when one has been built (see train_pcfg_model)
+    model = get_pcfg_model()
+    if model is not None:
+        guesses = model.estimate_guesses(password)
+        if guesses is not None:
+            return guesses, pattern
     
     # For uncommon passwords, estimate based on pattern complexity
     # Length multiplier
@@ -65,3 +369,14 @@ def analyze_and_store(user_id, password):
     guesses, pattern = estimate_guesses(password)
     insert_pcfg(user_id, guesses, pattern)
     return guesses, pattern
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Train the PCFG model used by estimate_guesses")
+    parser.add_argument("wordlist")
+    parser.add_argument("--model", default=None, help=f"output path (default {MODEL_PATH})")
+    parser.add_argument("--max-lines", type=int, default=None)
+    parser.add_argument("--samples", type=int, default=MC_SAMPLES)
+    args = parser.parse_args()
+    m = train_pcfg_model(args.wordlist, args.model, args.max_lines, samples=args.samples)
+    print(f"trained {len(m.structures)} structures, {len(m.terminals)} groups -> {args.model or MODEL_PATH}")
@@ -0,0 +1,86 @@
+# profiler.py
+# Sampling profiler that can be switched on and off at runtime through the
+# config table (`PROFILER` = 1/0). While on, a background thread snapshots
+# every thread's stack each PROFILER_INTERVAL seconds and counts collapsed
+# stacks ("file:function;file:function ..."), the input format of flamegraph.pl
+# and speedscope. While off it only re-reads the config every few seconds.
+import os
+import sys
+import threading
+import time
+from database import get_config
+
+# Seconds between samples while profiling (set `PROFILER_INTERVAL`)
+INTERVAL = float(os.environ.get("PROFILER_INTERVAL", "0.01"))
+# Seconds between checks of the `PROFILER` config flag
+CHECK_EVERY = 5.0
+# Frames kept per stack, innermost last
+MAX_DEPTH = 64
+
+_lock = threading.Lock()
+_stacks = {}  # collapsed stack -> samples
+_samples = 0
+_running = False
+_watcher = None
+
+def _collapse(frame):
+    parts = []
+    while frame is not None and len(parts) < MAX_DEPTH:
+        code = frame.f_code
+        parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(parts))
+
+def sample_once(skip_thread=None):
+    """Record one stack sample of every thread except `skip_thread`."""
+    global _samples
+    frames = sys._current_frames()
+    with _lock:
+        for ident, frame in frames.items():
+            if ident == skip_thread:
+                continue
+            stack = _collapse(frame)
+            _stacks[stack] = _stacks.get(stack, 0) + 1
+        _samples += 1
+
+def _loop():
+    global _running
+    me = threading.get_ident()
+    next_check = 0.0
+    while True:
+        now = time.time()
+        if now >= next_check:
+            try:
+                _running = str(get_config("PROFILER", os.environ.get("PROFILER", "0"))) == "1"
+            except Exception:
+                _running = False
+            next_check = now + CHECK_EVERY
+        if _running:
+            sample_once(me)
+            time.sleep(INTERVAL)
+        else:
+            time.sleep(min(CHECK_EVERY, max(0.0, next_check - time.time())))
+
+def start_profiler_watcher():
+    """Start the thread that follows the `PROFILER` flag (idempotent)."""
+    global _watcher
+    if _watcher is None:
+        _watcher = threading.Thread(target=_loop, name="profiler", daemon=True)
+        _watcher.start()
+    return _watcher
+
+def is_running():
+    return _running
+
+def collapsed(reset=False):
+    """Collapsed stacks, most sampled first, one "stack count" per line."""
+    global _samples
+    with _lock:
+        items = sorted(_stacks.items(), key=lambda kv: -kv[1])
+        if reset:
+            _stacks.clear()
+            _samples = 0
+    return "".join(f"{stack} {n}\n" for stack, n in items)
+
+def sample_count():
+    return _samples
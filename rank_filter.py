@@ -0,0 +1,163 @@
+# rank_filter.py
+# Compact "is this password in the wordlist, and roughly how high?" lookup.
+#
+# A cascade of Bloom filters, one per rank bucket (top 10, top 100, ... of the
+# wordlist). A query probes the buckets from the most popular down and returns
+# the first bucket's upper rank bound, so a lookup is a fixed number of bit
+# probes no matter how large the wordlist is. Every bucket is sized for
+# FALSE_POSITIVE_RATE, so a password outside the wordlist is reported as
+# present with probability at most len(BUCKETS) * FALSE_POSITIVE_RATE.
+# The file is memory-mapped read-only, so worker processes share one copy
+# through the page cache.
+import hashlib
+import math
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+try:
+    import xxhash
+
+    def _hash128(word):
+        return xxhash.xxh3_128_intdigest(word)
+except ImportError:  # pragma: no cover - xxhash is in requirements.txt
+    def _hash128(word):
+        return int.from_bytes(hashlib.blake2b(word, digest_size=16).digest(), "little")
+
+MAGIC = b"PCDTRNK1"
+HEADER = struct.Struct("<8sQQII")       # magic, wordlist size, mtime ns, bucket count, hash count
+BUCKET = struct.Struct("<QQQ")          # rank upper bound, bit count, byte offset of the bit array
+# Upper rank bound of each bucket; the last bucket holds the rest of the wordlist
+BUCKETS = [10, 100, 1000, 10000, 100000, 1000000, 10000000]
+FALSE_POSITIVE_RATE = float(os.environ.get("RANK_FILTER_FPR", "0.001"))
+INDEX_DIR = os.environ.get("RANK_FILTER_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "wordlists"))
+
+_M64 = (1 << 64) - 1
+
+def filter_path_for(wordlist):
+    full = os.path.abspath(wordlist)
+    tag = hashlib.sha1(full.encode()).hexdigest()[:12]
+    return os.path.join(INDEX_DIR, f"{os.path.basename(full)}.{tag}.rank")
+
+def _iter_words(wordlist):
+    with open(wordlist, "rb") as wf:
+        for line in wf:
+            word = line.rstrip(b"\n").rstrip(b"\r")
+            if word:
+                yield word
+
+def _positions(word, k, m):
+    h = _hash128(word)
+    h1, h2 = h & _M64, (h >> 64) | 1
+    return [(h1 + i * h2) % m for i in range(k)]
+
+def build_rank_filter(wordlist, path=None, fpr=FALSE_POSITIVE_RATE):
+    """Build the bucketed Bloom cascade for `wordlist` and move it into place."""
+    path = path or filter_path_for(wordlist)
+    st = os.stat(wordlist)
+    total = sum(1 for _ in _iter_words(wordlist))
+
+    bounds = [b for b in BUCKETS if b < total] + [max(total, 1)]
+    k = max(1, round(-math.log2(fpr)))
+    layout = []
+    offset = HEADER.size + BUCKET.size * len(bounds)
+    prev = 0
+    for bound in bounds:
+        n = max(bound - prev, 1)
+        # small buckets get a floor so double hashing has room to spread
+        m = max(8192, int(math.ceil(-n * math.log(fpr) / (math.log(2) ** 2))))
+        m = (m + 7) // 8 * 8
+        layout.append((bound, m, offset))
+        offset += m // 8
+        prev = bound
+
+    bits = [bytearray(m // 8) for _, m, _ in layout]
+    bucket = 0
+    for rank, word in enumerate(_iter_words(wordlist), start=1):
+        while rank > layout[bucket][0]:
+            bucket += 1
+        m = layout[bucket][1]
+        arr = bits[bucket]
+        for pos in _positions(word, k, m):
+            arr[pos >> 3] |= 1 << (pos & 7)
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix="rankbuild_", dir=os.path.dirname(path))
+    with os.fdopen(fd, "wb") as out:
+        out.write(HEADER.pack(MAGIC, st.st_size, st.st_mtime_ns, len(layout), k))
+        for entry in layout:
+            out.write(BUCKET.pack(*entry))
+        for arr in bits:
+            out.write(arr)
+    os.replace(tmp_path, path)
+    return path
+
+class RankFilter:
+    """Read-only, memory-mapped view of a built rank filter."""
+
+    def __init__(self, wordlist, path):
+        self.wordlist = wordlist
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size, self.mtime_ns, n, self.k = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError("corrupt rank filter")
+        self.buckets = [BUCKET.unpack_from(self._mm, HEADER.size + i * BUCKET.size) for i in range(n)]
+
+    def is_current(self):
+        try:
+            st = os.stat(self.wordlist)
+        except OSError:
+            return False
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime_ns
+
+    def rank_bucket(self, password):
+        """Upper bound of the rank bucket holding `password`, or None if it is not in the wordlist."""
+        word = password.encode("utf-8", "ignore") if isinstance(password, str) else password
+        h = _hash128(word)
+        h1, h2 = h & _M64, (h >> 64) | 1
+        mm = self._mm
+        k = self.k
+        for bound, m, offset in self.buckets:
+            for i in range(k):
+                pos = (h1 + i * h2) % m
+                if not mm[offset + (pos >> 3)] & (1 << (pos & 7)):
+                    break
+            else:
+                return bound
+        return None
+
+    def close(self):
+        try:
+            self._mm.close()
+        except Exception:
+            pass
+
+_lock = threading.Lock()
+
+def get_rank_filter(wordlist, build=True):
+    """Return a current RankFilter for `wordlist`, (re)building it if allowed."""
+    with _lock:
+        path = filter_path_for(wordlist)
+        if os.path.exists(path):
+            try:
+                rf = RankFilter(wordlist, path)
+                if rf.is_current():
+                    return rf
+                rf.close()
+            except Exception:
+                pass
+        if not build:
+            return None
+        print(f"building rank filter for {wordlist} ...")
+        build_rank_filter(wordlist, path)
+        return RankFilter(wordlist, path)
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) != 2:
+        sys.exit("usage: python3 rank_filter.py <wordlist>")
+    print(build_rank_filter(sys.argv[1]))
@@ -0,0 +1,145 @@
+# rate_limit.py
+# Load shedding in front of /login. Every POST takes a token from a bucket
+# keyed by source IP and one keyed by username; an empty bucket gets a 429
+# before any hashing, database query or template render. Optionally
+# (RATE_LIMIT_BLOCK_SECONDS > 0) an IP that recently raised a BRUTE_FORCE or
+# CREDENTIAL_STUFFING alert is rejected outright as well. Buckets live in
+# bounded LRU tables, so a flood of distinct keys evicts idle buckets instead
+# of growing memory. Limits come from the config table and are re-read every
+# REFRESH_EVERY seconds, together with the blocked IPs (from alert_cooldowns,
+# so alerts raised by any worker process count).
+import os
+import threading
+import time
+from collections import OrderedDict
+import metrics
+from database import get_config, fetch_alert_cooldowns_since
+
+# Seconds between re-reading the limits and the blocked IPs
+REFRESH_EVERY = 5.0
+# Buckets kept per table (set `PCDT_RATE_LIMIT_MAX_KEYS`)
+MAX_KEYS = int(os.environ.get("PCDT_RATE_LIMIT_MAX_KEYS", "100000"))
+# Alerts whose IP gets blocked
+BLOCK_ALERTS = ("BRUTE_FORCE", "CREDENTIAL_STUFFING")
+
+# config key -> default
+DEFAULTS = {
+    "RATE_LIMIT": os.environ.get("PCDT_RATE_LIMIT", "1"),  # 0 turns the limiter off
+    "RATE_LIMIT_IP_RATE": "1",        # tokens per second per IP
+    "RATE_LIMIT_IP_BURST": "10",
+    "RATE_LIMIT_USER_RATE": "0.2",    # tokens per second per username
+    "RATE_LIMIT_USER_BURST": "5",
+    "RATE_LIMIT_ACTION": "reject",    # or "tarpit": sleep before rejecting
+    "RATE_LIMIT_TARPIT_SECONDS": "2",  # longest tarpit sleep
+    # how long an alerted IP stays blocked, 0 = never block. Off by default:
+    # two mistyped usernames from one IP already make a CREDENTIAL_STUFFING alert
+    "RATE_LIMIT_BLOCK_SECONDS": "0",
+}
+
+class BucketTable:
+    """Token buckets keyed by string, at most `max_keys` of them (least recently used evicted)."""
+
+    def __init__(self, rate, burst, max_keys=None):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.max_keys = max_keys or MAX_KEYS
+        self._buckets = OrderedDict()  # key -> (tokens, last time)
+        self._lock = threading.Lock()
+
+    def configure(self, rate, burst):
+        with self._lock:
+            self.rate = float(rate)
+            self.burst = float(burst)
+
+    def take(self, key, now=None):
+        """Take one token for `key`. Returns 0 if allowed, else seconds until a token is available."""
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens >= 1:
+                tokens -= 1
+                wait = 0
+            else:
+                wait = (1 - tokens) / self.rate if self.rate > 0 else float("inf")
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return wait
+
+    def __len__(self):
+        return len(self._buckets)
+
+_settings = {k: v for k, v in DEFAULTS.items()}
+_ip_buckets = BucketTable(DEFAULTS["RATE_LIMIT_IP_RATE"], DEFAULTS["RATE_LIMIT_IP_BURST"])
+_user_buckets = BucketTable(DEFAULTS["RATE_LIMIT_USER_RATE"], DEFAULTS["RATE_LIMIT_USER_BURST"])
+_blocked = {}  # ip -> blocked until (epoch seconds)
+_next_refresh = 0.0
+_refresh_lock = threading.Lock()
+
+def refresh():
+    """Re-read the limits from the config table and the blocked IPs from recent alerts."""
+    global _blocked
+    settings = {}
+    for key, default in DEFAULTS.items():
+        settings[key] = str(get_config(key, default))
+    _settings.update(settings)
+    _ip_buckets.configure(settings["RATE_LIMIT_IP_RATE"], settings["RATE_LIMIT_IP_BURST"])
+    _user_buckets.configure(settings["RATE_LIMIT_USER_RATE"], settings["RATE_LIMIT_USER_BURST"])
+    block_ms = float(settings["RATE_LIMIT_BLOCK_SECONDS"]) * 1000
+    blocked = {}
+    if block_ms > 0:
+        since = int(time.time() * 1000 - block_ms)
+        for _, ip, last_ts in fetch_alert_cooldowns_since(BLOCK_ALERTS, since):
+            blocked[ip] = max(blocked.get(ip, 0), (last_ts + block_ms) / 1000.0)
+    _blocked = blocked
+    metrics.set_gauge("pcdt_blocked_ips", len(blocked))
+
+def _maybe_refresh():
+    global _next_refresh
+    if time.monotonic() < _next_refresh or not _refresh_lock.acquire(blocking=False):
+        return
+    try:
+        _next_refresh = time.monotonic() + REFRESH_EVERY
+        refresh()
+    except Exception as e:
+        print("rate limit refresh error:", e)
+    finally:
+        _refresh_lock.release()
+
+def check_login(ip, username):
+    """Decide whether a login attempt may proceed.
+
+    Returns None to allow it, else (reason, retry after seconds) where reason is
+    "blocked", "ip" or "username". With RATE_LIMIT_ACTION=tarpit the call
+    sleeps (up to RATE_LIMIT_TARPIT_SECONDS) before returning a rejection.
+    """
+    _maybe_refresh()
+    if _settings["RATE_LIMIT"] != "1":
+        return None
+    verdict = None
+    until = _blocked.get(ip)
+    if until and until > time.time():
+        verdict = ("blocked", until - time.time())
+    else:
+        wait = _ip_buckets.take(ip or "")
+        if wait:
+            verdict = ("ip", wait)
+        else:
+            wait = _user_buckets.take((username or "").lower())
+            if wait:
+                verdict = ("username", wait)
+    if verdict is None:
+        return None
+    metrics.inc("pcdt_login_throttled_total", reason=verdict[0])
+    if _settings["RATE_LIMIT_ACTION"] == "tarpit":
+        time.sleep(min(verdict[1], float(_settings["RATE_LIMIT_TARPIT_SECONDS"])))
+    return verdict
+
+def reset():
+    """Drop all buckets and force a refresh on the next check."""
+    global _next_refresh
+    _next_refresh = 0.0
+    for table in (_ip_buckets, _user_buckets):
+        with table._lock:
+            table._buckets.clear()
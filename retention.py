@@ -0,0 +1,212 @@
+# retention.py
+# Retention for login_logs. Attempts older than LOG_RETENTION_DAYS are written
+# to zstd-compressed Parquet files (one directory per UTC day), counted into
+# per-minute login_rollups rows by (ip, username, status), and then deleted,
+# BATCH_SIZE rows per transaction so the login path is never blocked for long.
+# query_logs() reads history back across the archive and the live table;
+# count_logs() answers per-minute counts from the rollups and the live table
+# without opening the archive.
+#
+#   python3 retention.py run --days 30
+#   python3 retention.py query --since 2024-01-01 --until 2024-02-01 --ip 1.2.3.4
+#   python3 retention.py counts --since 2024-01-01 --status fail_wrong_password
+import os
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import metrics
+from database import init_db, get_config, fetch_logs_older_than, compact_login_logs, fetch_logs_between, fetch_login_rollups, prune_alert_cooldowns, to_ms
+
+# Age in days after which raw attempts are archived, 0 = keep forever (set `PCDT_LOG_RETENTION_DAYS`; DB config `LOG_RETENTION_DAYS` overrides)
+RETENTION_DAYS = float(os.environ.get("PCDT_LOG_RETENTION_DAYS", "30"))
+# Root of the Parquet archive (set `PCDT_LOG_ARCHIVE_DIR`; DB config `LOG_ARCHIVE_DIR` overrides)
+ARCHIVE_DIR = os.environ.get("PCDT_LOG_ARCHIVE_DIR", os.path.join("archive", "login_logs"))
+# Rows archived and deleted per transaction
+BATCH_SIZE = int(os.environ.get("PCDT_RETENTION_BATCH", "5000"))
+# Seconds between retention runs in the app
+INTERVAL = 3600
+
+SCHEMA = pa.schema([
+    ("id", pa.int64()),
+    ("username", pa.string()),
+    ("ip", pa.string()),
+    ("status", pa.string()),
+    ("fingerprint", pa.string()),
+    ("timestamp", pa.string()),
+    ("ts", pa.int64()),
+])
+
+_thread = None
+
+def _get_days():
+    try:
+        return float(get_config("LOG_RETENTION_DAYS", RETENTION_DAYS))
+    except Exception:
+        return RETENTION_DAYS
+
+def _get_archive_dir():
+    return get_config("LOG_ARCHIVE_DIR", ARCHIVE_DIR) or ARCHIVE_DIR
+
+def _day(ts_ms):
+    return datetime.utcfromtimestamp(ts_ms / 1000).strftime("%Y-%m-%d")
+
+def _write_archive(rows, archive_dir):
+    """Write rows (as from fetch_logs_older_than) to one Parquet file per UTC day."""
+    by_day = {}
+    for r in rows:
+        by_day.setdefault(_day(r[6]), []).append(r)
+    for day, day_rows in by_day.items():
+        path = os.path.join(archive_dir, f"day={day}")
+        os.makedirs(path, exist_ok=True)
+        # named after the first row, so a batch repeated after a crash
+        # (archived but not yet deleted) overwrites its own file
+        first = day_rows[0]
+        path = os.path.join(path, f"part-{first[6]}-{first[0]}.parquet")
+        table = pa.Table.from_pydict({name: [r[i] for r in day_rows] for i, name in enumerate(SCHEMA.names)},
+                                     schema=SCHEMA)
+        pq.write_table(table, path + ".tmp", compression="zstd")
+        os.replace(path + ".tmp", path)
+
+def _rollups(rows):
+    counts = Counter((r[6] // 60000 * 60000, r[2] or "", r[1] or "", r[3] or "") for r in rows)
+    return [key + (n,) for key, n in counts.items()]
+
+def run_retention(days=None, archive_dir=None, batch_size=None):
+    """Archive, roll up and delete login_logs rows older than `days`. Returns the number moved."""
+    prune_alert_cooldowns(to_ms(datetime.utcnow() - timedelta(days=1)))
+    days = _get_days() if days is None else float(days)
+    if days <= 0:
+        return 0
+    archive_dir = archive_dir or _get_archive_dir()
+    batch_size = batch_size or BATCH_SIZE
+    cutoff = to_ms(datetime.utcnow() - timedelta(days=days))
+    moved = 0
+    while True:
+        rows = fetch_logs_older_than(cutoff, batch_size)
+        if not rows:
+            break
+        # archive first: if we die before the delete, the next run redoes this batch
+        _write_archive(rows, archive_dir)
+        compact_login_logs([r[0] for r in rows], _rollups(rows))
+        moved += len(rows)
+        metrics.inc("pcdt_retention_rows_archived_total", len(rows))
+        if len(rows) < batch_size:
+            break
+    return moved
+
+def _archive_files(archive_dir, since_ms, until_ms):
+    """Parquet files in the day partitions that can hold rows in [since_ms, until_ms)."""
+    if not os.path.isdir(archive_dir):
+        return []
+    first, last = "day=" + _day(since_ms), "day=" + _day(max(since_ms, until_ms - 1))
+    files = []
+    for name in sorted(os.listdir(archive_dir)):
+        if name.startswith("day=") and first <= name <= last:
+            path = os.path.join(archive_dir, name)
+            files.extend(os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith(".parquet"))
+    return files
+
+def query_logs(since_ms, until_ms, ip=None, username=None, status=None, archive_dir=None):
+    """Login attempts with since_ms <= ts < until_ms from the archive and the live table.
+
+    Returns (username, ip, status, fingerprint, ts) tuples, oldest first, like fetch_failed_logins_since.
+    """
+    live = fetch_logs_between(since_ms, until_ms, ip, username, status)
+    live_ids = {r[0] for r in live}
+    rows = [r[1:] for r in live]
+    files = _archive_files(archive_dir or _get_archive_dir(), since_ms, until_ms)
+    if files:
+        expr = (ds.field("ts") >= since_ms) & (ds.field("ts") < until_ms)
+        for col, value in (("ip", ip), ("username", username), ("status", status)):
+            if value is not None:
+                expr = expr & (ds.field(col) == value)
+        table = ds.dataset(files, schema=SCHEMA, format="parquet").to_table(
+            columns=["id", "username", "ip", "status", "fingerprint", "ts"], filter=expr)
+        cols = [table.column(i).to_pylist() for i in range(table.num_columns)]
+        # a batch archived just before a crash is still live as well
+        rows.extend(r[1:] for r in zip(*cols) if r[0] not in live_ids)
+    rows.sort(key=lambda r: r[4])
+    return rows
+
+def count_logs(since_ms, until_ms, ip=None, username=None, status=None):
+    """Attempts per minute with since_ms <= ts < until_ms, as (minute, ip, username, status, attempts).
+
+    Archived minutes come from login_rollups and the rest from the live table.
+    A row is rolled up in the same transaction that deletes it, so the two never
+    overlap. since_ms is rounded down to its minute for the rolled-up part.
+    """
+    counts = Counter()
+    for minute, r_ip, r_username, r_status, attempts in fetch_login_rollups(since_ms // 60000 * 60000, until_ms,
+                                                                            ip, username, status):
+        counts[(minute, r_ip, r_username, r_status)] += attempts
+    for _, r_username, r_ip, r_status, _, ts in fetch_logs_between(since_ms, until_ms, ip, username, status):
+        counts[(ts // 60000 * 60000, r_ip or "", r_username or "", r_status or "")] += 1
+    return sorted(key + (n,) for key, n in counts.items())
+
+def _loop(gate):
+    while True:
+        time.sleep(INTERVAL)
+        if gate is not None and not gate():
+            continue
+        try:
+            moved = run_retention()
+            if moved:
+                print(f"retention: archived {moved} login_logs rows")
+        except Exception as e:
+            print("retention error:", e)
+
+def start_retention_thread(gate=None):
+    """Run run_retention every INTERVAL seconds in a daemon thread (idempotent).
+
+    With `gate`, a run is skipped unless gate() is true (e.g. Lease.is_held).
+    """
+    global _thread
+    if _thread is None:
+        _thread = threading.Thread(target=_loop, args=(gate,), name="retention", daemon=True)
+        _thread.start()
+    return _thread
+
+def _parse_time(text):
+    return to_ms(datetime.fromisoformat(text))
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="Archive old login_logs rows, or query across the archive.")
+    sub = ap.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="archive, roll up and delete old rows once")
+    run.add_argument("--days", type=float, default=None, help="retention age (default: LOG_RETENTION_DAYS)")
+    run.add_argument("--archive-dir", default=None)
+    run.add_argument("--batch-size", type=int, default=None)
+    query = sub.add_parser("query", help="print attempts from the archive and the live table")
+    query.add_argument("--since", required=True, help="ISO date/time, UTC")
+    query.add_argument("--until", default=None, help="ISO date/time, UTC (default: now)")
+    query.add_argument("--ip")
+    query.add_argument("--username")
+    query.add_argument("--status")
+    query.add_argument("--archive-dir", default=None)
+    counts = sub.add_parser("counts", help="print attempts per minute from the rollups and the live table")
+    counts.add_argument("--since", required=True, help="ISO date/time, UTC")
+    counts.add_argument("--until", default=None, help="ISO date/time, UTC (default: now)")
+    counts.add_argument("--ip")
+    counts.add_argument("--username")
+    counts.add_argument("--status")
+    args = ap.parse_args()
+    init_db()
+    if args.command == "run":
+        t0 = time.time()
+        moved = run_retention(args.days, args.archive_dir, args.batch_size)
+        print(f"archived {moved} rows in {time.time() - t0:.1f}s")
+    elif args.command == "counts":
+        until = _parse_time(args.until) if args.until else to_ms(datetime.utcnow())
+        for minute, ip, username, status, attempts in count_logs(_parse_time(args.since), until, args.ip,
+                                                                 args.username, args.status):
+            print(datetime.utcfromtimestamp(minute / 1000).isoformat(), ip, username, status, attempts, sep="\t")
+    else:
+        until = _parse_time(args.until) if args.until else to_ms(datetime.utcnow())
+        for username, ip, status, fingerprint, ts in query_logs(_parse_time(args.since), until, args.ip,
+                                                                args.username, args.status, args.archive_dir):
+            print(datetime.utcfromtimestamp(ts / 1000).isoformat(), ip, username, status, fingerprint, sep="\t")
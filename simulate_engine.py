@@ -1,15 +1,51 @@
 # simulate_engine.py
+import itertools
+import math
+import queue
+import random
+import sys
+import threading
 import requests
 import time
 import os
+from io import BytesIO
+from urllib.parse import urlencode
 
-def _post_attempt(url, username, password, ip):
+# Login endpoint the simulator attacks (set `SIMULATE_URL`; DB config `SIMULATE_URL` overrides)
+LOGIN_URL = os.environ.get("SIMULATE_URL", "http://127.0.0.1:5000/login")
+# Worker threads for load mode, each with its own keep-alive session (set `SIMULATE_CONCURRENCY`)
+CONCURRENCY = int(os.environ.get("SIMULATE_CONCURRENCY", "16"))
+# Target requests per second for load mode, 0 = as fast as possible (set `SIMULATE_RPS`)
+TARGET_RPS = float(os.environ.get("SIMULATE_RPS", "0"))
+
+def _login_url():
+    try:
+        from database import get_config
+        return get_config("SIMULATE_URL", LOGIN_URL)
+    except Exception:
+        return LOGIN_URL
+
+def _post_attempt(url, username, password, ip, http=requests):
     headers = {"X-Forwarded-For": ip}
     try:
-        requests.post(url, data={"username": username, "password": password}, headers=headers, timeout=3)
+        http.post(url, data={"username": username, "password": password}, headers=headers, timeout=3)
     except Exception:
         pass
 
+def _iter_passwords(wordlist_path, passwords):
+    """Passwords from the wordlist file, streamed line by line, else `passwords`."""
+    if wordlist_path and os.path.exists(wordlist_path):
+        try:
+            with open(wordlist_path, "r", errors="ignore") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        yield line
+        except Exception:
+            pass
+        return
+    yield from passwords or []
+
 def simulate(attack_type, usernames, passwords, ip, count, wordlist_path=None):
     """
     attack_type: 'bruteforce' | 'stuffing' | 'spray'
@@ -19,36 +55,271 @@ def simulate(attack_type, usernames, passwords, ip, count, wordlist_path=None):
     count: attempts per password/user
     wordlist_path: optional path to file with passwords (one per line)
     """
-    url = "http://127.0.0.1:5000/login"
+    url = _login_url()
 
-    # if wordlist provided, read it and override passwords
-    if wordlist_path and os.path.exists(wordlist_path):
-        try:
-            with open(wordlist_path, "r", errors="ignore") as f:
-                passwords = [l.strip() for l in f if l.strip()]
-        except Exception:
-            passwords = passwords or []
+    # if wordlist provided, stream it instead of `passwords`
+    passwords = _iter_passwords(wordlist_path, passwords)
 
+    # one keep-alive session instead of a new connection per attempt
+    with requests.Session() as http:
+        if attack_type == "bruteforce":
+            if not usernames:
+                return
+            target = usernames[0]
+            for pwd in passwords:
+                for _ in range(count):
+                    _post_attempt(url, target, pwd, ip, http)
+
+        elif attack_type == "stuffing":
+            same_pwd = next(passwords, None)
+            if same_pwd is None:
+                return
+            for user in usernames:
+                for _ in range(count):
+                    _post_attempt(url, user, same_pwd, ip, http)
+
+        elif attack_type == "spray":
+            pwd = next(passwords, None)
+            if pwd is None:
+                return
+            for user in usernames:
+                _post_attempt(url, user, pwd, ip, http)
+                time.sleep(1)
+
+# ----- load generation -----
+def iter_attempts(attack_type, usernames, passwords, count, wordlist_path=None):
+    """Yield (username, password) pairs for an attack without building the full list.
+
+    A wordlist file is read line by line and replaces `passwords`.
+    """
+    passwords = _iter_passwords(wordlist_path, passwords)
     if attack_type == "bruteforce":
         if not usernames:
             return
-        target = usernames[0]
         for pwd in passwords:
             for _ in range(count):
-                _post_attempt(url, target, pwd, ip)
-
+                yield usernames[0], pwd
     elif attack_type == "stuffing":
-        if not passwords:
+        pwd = next(passwords, None)
+        if pwd is None:
             return
-        same_pwd = passwords[0]
         for user in usernames:
             for _ in range(count):
-                _post_attempt(url, user, same_pwd, ip)
-
+                yield user, pwd
     elif attack_type == "spray":
-        if not passwords:
-            return
-        pwd = passwords[0]
-        for user in usernames:
-            _post_attempt(url, user, pwd, ip)
-            time.sleep(1)
+        # every password across every user, one attempt per pair
+        for pwd in passwords:
+            for user in usernames:
+                yield user, pwd
+
+def ip_source(mode, ip="1.2.3.4", pool_size=256, seed=None):
+    """Return a function giving the source IP of each attempt.
+
+    mode: 'fixed' (always `ip`), 'rotate' (round-robin over `pool_size`
+    addresses in ip's /16) or 'random' (a fresh address in 10.0.0.0/8 each
+    time, repeatable with `seed`).
+    """
+    if mode == "random":
+        rng = random.Random(seed)
+        return lambda: f"10.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}"
+    if mode == "rotate":
+        prefix = ".".join((ip or "1.2.3.4").split(".")[:2])
+        pool = itertools.cycle(f"{prefix}.{i // 254}.{i % 254 + 1}" for i in range(pool_size))
+        lock = threading.Lock()
+
+        def next_ip():
+            with lock:
+                return next(pool)
+        return next_ip
+    return lambda: ip
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` tokens per second, bursts of up to `burst`."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, rate / 10))
+        self.tokens = self.capacity
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.rate)
+                self.last = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def _percentile(sorted_values, pct):
+    """Nearest-rank percentile: the smallest value with at least pct% of values at or below it."""
+    if not sorted_values:
+        return None
+    k = min(len(sorted_values) - 1, max(0, math.ceil(pct / 100.0 * len(sorted_values)) - 1))
+    return sorted_values[k]
+
+def latency_report(latencies, statuses, errors, elapsed):
+    """Summary dict for a run: throughput, status counts and latency percentiles (ms)."""
+    lat = sorted(latencies)
+    total = len(lat) + errors
+    report = {
+        "attempts": total,
+        "errors": errors,
+        "statuses": statuses,
+        "seconds": round(elapsed, 3),
+        "rps": round(total / elapsed, 1) if elapsed > 0 else None,
+    }
+    for pct in (50, 90, 95, 99):
+        v = _percentile(lat, pct)
+        report[f"p{pct}_ms"] = round(v * 1000, 3) if v is not None else None
+    report["max_ms"] = round(lat[-1] * 1000, 3) if lat else None
+    report["mean_ms"] = round(sum(lat) / len(lat) * 1000, 3) if lat else None
+    return report
+
+def run_load(attempts, send, concurrency=None, rps=None, ips=None):
+    """Send `attempts` ((username, password) pairs) with `concurrency` threads.
+
+    `send(username, password, ip)` performs one attempt in the calling thread
+    and returns a status code (exceptions count as errors). With `rps`, starts
+    are paced by a shared token bucket. `ips` is a function from ip_source.
+    Returns latency_report(...).
+    """
+    concurrency = max(1, int(concurrency or CONCURRENCY))
+    rps = TARGET_RPS if rps is None else float(rps)
+    bucket = TokenBucket(rps) if rps > 0 else None
+    ips = ips or (lambda: "1.2.3.4")
+    work = queue.Queue(maxsize=concurrency * 64)
+    done = object()
+    results = []  # per-thread (latencies, statuses, errors)
+
+    def worker():
+        latencies = []
+        statuses = {}
+        errors = 0
+        while True:
+            item = work.get()
+            if item is done:
+                break
+            if bucket:
+                bucket.acquire()
+            t0 = time.perf_counter()
+            try:
+                status = send(item[0], item[1], ips())
+                latencies.append(time.perf_counter() - t0)
+                statuses[status] = statuses.get(status, 0) + 1
+            except Exception:
+                errors += 1
+        results.append((latencies, statuses, errors))
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for item in attempts:
+        work.put(item)
+    for _ in threads:
+        work.put(done)
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    latencies = []
+    statuses = {}
+    errors = 0
+    for lat, st, err in results:
+        latencies.extend(lat)
+        for k, v in st.items():
+            statuses[k] = statuses.get(k, 0) + v
+        errors += err
+    return latency_report(latencies, statuses, errors, elapsed)
+
+def http_sender(url=None):
+    """send() for run_load that POSTs over one pooled keep-alive session per thread."""
+    url = url or _login_url()
+    local = threading.local()
+
+    def send(username, password, ip):
+        http = getattr(local, "session", None)
+        if http is None:
+            http = local.session = requests.Session()
+        r = http.post(url, data={"username": username, "password": password},
+                      headers={"X-Forwarded-For": ip}, timeout=10, allow_redirects=False)
+        return r.status_code
+    return send
+
+def wsgi_sender(wsgi_app, path="/login"):
+    """send() for run_load that calls the WSGI app in-process: no sockets, no server.
+
+    Only our own request handling is measured, and it works without a running app.
+    """
+    base = {
+        "REQUEST_METHOD": "POST", "SCRIPT_NAME": "", "PATH_INFO": path, "QUERY_STRING": "",
+        "SERVER_NAME": "localhost", "SERVER_PORT": "80", "SERVER_PROTOCOL": "HTTP/1.1",
+        "REMOTE_ADDR": "127.0.0.1", "CONTENT_TYPE": "application/x-www-form-urlencoded",
+        "wsgi.version": (1, 0), "wsgi.url_scheme": "http", "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True, "wsgi.multiprocess": False, "wsgi.run_once": False,
+    }
+
+    def send(username, password, ip):
+        body = urlencode({"username": username, "password": password}).encode()
+        environ = dict(base)
+        environ["wsgi.input"] = BytesIO(body)
+        environ["CONTENT_LENGTH"] = str(len(body))
+        environ["HTTP_X_FORWARDED_FOR"] = ip
+        status = []
+
+        def start_response(s, headers, exc_info=None):
+            status.append(s)
+        result = wsgi_app(environ, start_response)
+        try:
+            for _ in result:
+                pass
+        finally:
+            if hasattr(result, "close"):
+                result.close()
+        return int(status[0].split(" ", 1)[0])
+    return send
+
+def simulate_load(attack_type, usernames, passwords, ip, count, wordlist_path=None,
+                  concurrency=None, rps=None, ip_mode="fixed", url=None, wsgi_app=None, seed=None):
+    """Load-test version of simulate(): concurrent, paced, and with a report.
+
+    Attempts go over HTTP to `url`, or straight into `wsgi_app` (e.g. the Flask
+    app) when one is given. Returns the latency_report dict (attempts, rps,
+    p50/p90/p95/p99/max latency). Turn the target's login rate limiter off
+    (RATE_LIMIT=0 in the config table, or PCDT_RATE_LIMIT=0 for the wsgi
+    backend) or most attempts are answered with 429 before detection sees them.
+    """
+    attempts = iter_attempts(attack_type, usernames, passwords, count, wordlist_path)
+    send = wsgi_sender(wsgi_app) if wsgi_app is not None else http_sender(url)
+    return run_load(attempts, send, concurrency, rps, ip_source(ip_mode, ip, seed=seed))
+
+if __name__ == "__main__":
+    import argparse
+    import json
+    ap = argparse.ArgumentParser(description="Generate login load against the app and report latency.")
+    ap.add_argument("attack_type", choices=["bruteforce", "stuffing", "spray"])
+    ap.add_argument("--users", default="admin", help="comma-separated usernames")
+    ap.add_argument("--passwords", default="", help="comma-separated passwords")
+    ap.add_argument("--wordlist", help="password file, streamed line by line")
+    ap.add_argument("--count", type=int, default=1, help="attempts per password/user")
+    ap.add_argument("--ip", default="1.2.3.4")
+    ap.add_argument("--ip-mode", choices=["fixed", "rotate", "random"], default="fixed")
+    ap.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    ap.add_argument("--rps", type=float, default=TARGET_RPS)
+    ap.add_argument("--url", default=None)
+    ap.add_argument("--backend", choices=["http", "wsgi"], default="http",
+                    help="wsgi drives app.py in-process instead of over HTTP")
+    ap.add_argument("--seed", type=int, default=None, help="seed for --ip-mode random")
+    args = ap.parse_args()
+    wsgi_app = None
+    if args.backend == "wsgi":
+        from app import app as wsgi_app
+    report = simulate_load(args.attack_type, [u for u in args.users.split(",") if u],
+                           [p for p in args.passwords.split(",") if p], args.ip, args.count, args.wordlist,
+                           args.concurrency, args.rps, args.ip_mode, args.url, wsgi_app, args.seed)
+    print(json.dumps(report, indent=2))
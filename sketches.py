@@ -0,0 +1,83 @@
+# sketches.py
+# Fixed-size probabilistic counters used by detection.py: HyperLogLog for
+# "how many distinct X" and count-min for "how often did X occur". Both use
+# the same memory however many distinct items they see.
+import hashlib
+import math
+from array import array
+
+def _hash64(item):
+    return int.from_bytes(hashlib.blake2b(item.encode(), digest_size=8).digest(), "little")
+
+class HyperLogLog:
+    """Distinct-count estimate in 2**p one-byte registers (~1.04/sqrt(2**p) relative error)."""
+
+    def __init__(self, p=10):
+        self.p = p
+        self.m = 1 << p
+        self.registers = bytearray(self.m)
+
+    def add(self, item):
+        """Add a string; returns True if a register changed (the estimate may have moved)."""
+        h = _hash64(item)
+        index = h >> (64 - self.p)
+        rest = h & ((1 << (64 - self.p)) - 1)
+        rank = (64 - self.p) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+            return True
+        return False
+
+    def update(self, other):
+        """Merge `other` (same p) into this sketch."""
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        return _estimate(self.registers, self.m)
+
+    @staticmethod
+    def union_count(sketches):
+        """Distinct count of the union of several sketches with the same p."""
+        sketches = list(sketches)
+        if not sketches:
+            return 0
+        if len(sketches) == 1:
+            return sketches[0].count()
+        return _estimate(bytes(map(max, *(s.registers for s in sketches))), sketches[0].m)
+
+def _estimate(registers, m):
+    alpha = 0.7213 / (1 + 1.079 / m)
+    # registers hold few distinct values, so count each one in C instead of summing m floats
+    estimate = alpha * m * m / sum(registers.count(r) * 2.0 ** -r for r in set(registers))
+    zeros = registers.count(0)
+    if estimate <= 2.5 * m and zeros:
+        # small-range correction (linear counting)
+        estimate = m * math.log(m / zeros)
+    return int(round(estimate))
+
+class CountMinSketch:
+    """Frequency estimates that never undercount, in depth x width counters."""
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self.rows = [array("I", bytes(4 * width)) for _ in range(depth)]
+
+    def columns(self, item):
+        """Counter index per row for `item`; the same for every sketch with this width and depth."""
+        # double hashing: depth column indexes from one 64-bit hash
+        h = _hash64(item)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + i * h2) % self.width for i in range(self.depth)]
+
+    def add(self, item, n=1, columns=None):
+        """Count `item` n more times; returns its new estimate. Pass `columns` to skip hashing."""
+        estimate = None
+        for row, col in zip(self.rows, columns or self.columns(item)):
+            row[col] += n
+            if estimate is None or row[col] < estimate:
+                estimate = row[col]
+        return estimate
+
+    def estimate(self, item, columns=None):
+        return min(row[col] for row, col in zip(self.rows, columns or self.columns(item)))
@@ -0,0 +1,175 @@
+# user_cache.py
+# In-process cache in front of get_user_by_username for the login path.
+# Known users are kept in an LRU of username -> (id, username, password_hash);
+# usernames that do not exist are remembered as 64-bit hashes in two fixed
+# arrays (see NegativeCache), so a credential-stuffing flood of made-up names
+# is answered from memory at 8 bytes per name. Both are bounded and expire
+# after a TTL. insert_user and bulk_insert_users drop the affected entries
+# through a database listener. Users added by other processes (other workers,
+# import_hashes.py) are noticed by polling MAX(users.id) every NEW_USER_POLL
+# seconds, which drops the negative entries; changed hashes of existing users
+# are picked up when their entries expire.
+import hashlib
+import os
+import threading
+import time
+from array import array
+from collections import OrderedDict
+import metrics
+from database import get_user_by_username, get_max_user_id, add_user_listener
+
+# Known users kept, and seconds before they are re-read (set `PCDT_USER_CACHE_SIZE` / `PCDT_USER_CACHE_TTL`)
+SIZE = int(os.environ.get("PCDT_USER_CACHE_SIZE", "10000"))
+TTL = float(os.environ.get("PCDT_USER_CACHE_TTL", "60"))
+# Missing usernames kept, and for how long (set `PCDT_USER_NEGATIVE_SIZE` / `PCDT_USER_NEGATIVE_TTL`)
+NEGATIVE_SIZE = int(os.environ.get("PCDT_USER_NEGATIVE_SIZE", "100000"))
+NEGATIVE_TTL = float(os.environ.get("PCDT_USER_NEGATIVE_TTL", "30"))
+# Seconds between checks for users added by other processes (set `PCDT_USER_POLL`)
+NEW_USER_POLL = float(os.environ.get("PCDT_USER_POLL", "1"))
+
+def _key(username):
+    # 8 bytes instead of the whole (attacker-chosen) string; a collision would
+    # need 2**32 cached names to become likely. 0 marks an empty slot.
+    return int.from_bytes(hashlib.blake2b(username.encode(), digest_size=8).digest(), "little") or 1
+
+class NegativeCache:
+    """Time-sliced set of 64-bit keys in two direct-mapped arrays.
+
+    A key goes into slot key % slots of the current array, overwriting
+    whatever was there. Every ttl/2 seconds the current array becomes the
+    previous one and a fresh one starts, so a key is remembered for between
+    ttl/2 and ttl seconds. Unlike a Bloom filter there are no false positives
+    beyond a full 64-bit collision, so an existing user is never reported
+    missing. Not thread-safe; UserCache holds its lock.
+    """
+
+    def __init__(self, size, ttl):
+        self.slots = max(1, size // 2)
+        self.ttl = ttl
+        self._current = array("Q", bytes(8 * self.slots))
+        self._previous = array("Q", bytes(8 * self.slots))
+        self._rotate_at = time.monotonic() + ttl / 2
+
+    def _rotate(self, now):
+        if now < self._rotate_at:
+            return
+        step = self.ttl / 2
+        late = now - self._rotate_at
+        # idle for a whole slice or more: the current keys are too old as well
+        self._previous = self._current if late < step else array("Q", bytes(8 * self.slots))
+        self._current = array("Q", bytes(8 * self.slots))
+        # stay on the slice grid, so a late rotation never stretches a key's lifetime
+        self._rotate_at += step * (1 + int(late // step))
+
+    def __contains__(self, key):
+        self._rotate(time.monotonic())
+        slot = key % self.slots
+        return self._current[slot] == key or self._previous[slot] == key
+
+    def add(self, key):
+        self._rotate(time.monotonic())
+        self._current[key % self.slots] = key
+
+    def discard(self, key):
+        slot = key % self.slots
+        for table in (self._current, self._previous):
+            if table[slot] == key:
+                table[slot] = 0
+
+    def clear(self):
+        self._current = array("Q", bytes(8 * self.slots))
+        self._previous = array("Q", bytes(8 * self.slots))
+
+    def __len__(self):
+        return 2 * self.slots - self._current.count(0) - self._previous.count(0)
+
+class UserCache:
+    """Bounded LRU with TTL for user rows, plus a NegativeCache of missing usernames."""
+
+    def __init__(self, size=None, ttl=None, negative_size=None, negative_ttl=None):
+        self.size = SIZE if size is None else size
+        self.ttl = TTL if ttl is None else ttl
+        self.negative_size = NEGATIVE_SIZE if negative_size is None else negative_size
+        self.negative_ttl = NEGATIVE_TTL if negative_ttl is None else negative_ttl
+        self._users = OrderedDict()  # username -> (expires, row)
+        self._missing = None
+        if self.negative_size > 0 and self.negative_ttl > 0:
+            self._missing = NegativeCache(self.negative_size, self.negative_ttl)
+        self._generation = 0  # bumped by invalidate() and when other processes add users
+        self._max_user_id = None  # MAX(users.id) at the last poll
+        self._next_poll = 0.0
+        self._lock = threading.Lock()
+
+    def _poll_new_users(self, now):
+        """Forget missing usernames once MAX(users.id) grows, i.e. any process added users."""
+        if now < self._next_poll or self._missing is None:
+            return
+        self._next_poll = now + NEW_USER_POLL
+        try:
+            max_id = get_max_user_id()
+        except Exception as e:
+            print("user cache poll error:", e)
+            return
+        with self._lock:
+            if self._max_user_id is not None and max_id != self._max_user_id:
+                self._generation += 1
+                self._missing.clear()
+            self._max_user_id = max_id
+
+    def get(self, username):
+        """Same result as get_user_by_username(username), from memory when possible."""
+        now = time.monotonic()
+        key = _key(username)
+        self._poll_new_users(now)
+        with self._lock:
+            entry = self._users.get(username)
+            if entry is not None:
+                if entry[0] > now:
+                    self._users.move_to_end(username)
+                    metrics.inc("pcdt_user_cache_total", result="hit")
+                    return entry[1]
+                del self._users[username]
+            if self._missing is not None and key in self._missing:
+                metrics.inc("pcdt_user_cache_total", result="negative_hit")
+                return None
+            generation = self._generation
+        metrics.inc("pcdt_user_cache_total", result="miss")
+        row = get_user_by_username(username)
+        with self._lock:
+            if generation != self._generation:
+                # invalidated while we were reading; the row may already be stale
+                return row
+            if row is not None and self.size > 0:
+                self._users[username] = (now + self.ttl, row)
+                if len(self._users) > self.size:
+                    self._users.popitem(last=False)
+            elif row is None and self._missing is not None:
+                self._missing.add(key)
+        return row
+
+    def invalidate(self, username=None):
+        """Forget `username` (positive and negative), or everything if None."""
+        with self._lock:
+            self._generation += 1
+            if username is None:
+                self._users.clear()
+                if self._missing is not None:
+                    self._missing.clear()
+            else:
+                self._users.pop(username, None)
+                if self._missing is not None:
+                    self._missing.discard(_key(username))
+
+    def stats(self):
+        with self._lock:
+            return {"users": len(self._users), "missing": len(self._missing) if self._missing is not None else 0}
+
+_cache = UserCache()
+add_user_listener(_cache.invalidate)
+
+def get_user(username):
+    """Cached get_user_by_username: (id, username, password_hash) or None."""
+    return _cache.get(username)
+
+def cache_stats():
+    return _cache.stats()
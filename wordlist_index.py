@@ -0,0 +1,201 @@
+# wordlist_index.py
+# On-disk SHA-512 index of a wordlist so a dictionary audit becomes a lookup.
+#
+# Layout: a fixed header followed by fixed-size records sorted by digest prefix.
+#   header: magic, wordlist size, wordlist mtime (ns), record count
+#   record: first 8 bytes of sha512(word), byte offset of the line, guess number
+# Only a digest prefix is stored to keep the file small; a prefix hit is
+# confirmed by re-hashing the line at the recorded offset.
+import hashlib
+import heapq
+import mmap
+import os
+import struct
+import tempfile
+import threading
+
+MAGIC = b"PCDTIDX1"
+HEADER = struct.Struct("<8sQQQ")
+RECORD = struct.Struct("<8sQI")
+PREFIX_LEN = 8
+# Records sorted in memory before spilling a run to disk during a build
+RUN_SIZE = int(os.environ.get("JTR_INDEX_RUN_SIZE", "2000000"))
+# Where index files are kept (the wordlist directory may be read-only)
+INDEX_DIR = os.environ.get("JTR_INDEX_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "wordlists"))
+
+_cache = {}  # wordlist path -> WordlistIndex
+_lock = threading.Lock()
+
+
+def index_path_for(wordlist):
+    """Return the index file path used for `wordlist`."""
+    full = os.path.abspath(wordlist)
+    tag = hashlib.sha1(full.encode()).hexdigest()[:12]
+    return os.path.join(INDEX_DIR, f"{os.path.basename(full)}.{tag}.sha512idx")
+
+
+def _iter_lines(wordlist):
+    """Yield (offset, line) for every non-empty line, stripped like the scanner does."""
+    offset = 0
+    with open(wordlist, "rb") as wf:
+        for line in wf:
+            guess = line.rstrip(b"\n").rstrip(b"\r")
+            if guess:
+                yield offset, guess
+            offset += len(line)
+
+
+def _iter_run(path):
+    with open(path, "rb") as f:
+        while True:
+            rec = f.read(RECORD.size)
+            if len(rec) < RECORD.size:
+                return
+            yield rec
+
+
+def build_index(wordlist, index_path=None):
+    """Build the index for `wordlist` and atomically move it into place."""
+    index_path = index_path or index_path_for(wordlist)
+    st = os.stat(wordlist)
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+
+    sha512 = hashlib.sha512
+    pack = RECORD.pack
+    runs = []
+    chunk = []
+    count = 0
+    try:
+        for offset, guess in _iter_lines(wordlist):
+            count += 1
+            chunk.append(pack(sha512(guess).digest()[:PREFIX_LEN], offset, count))
+            if len(chunk) >= RUN_SIZE:
+                chunk.sort()
+                fd, run_path = tempfile.mkstemp(prefix="idxrun_", dir=os.path.dirname(index_path))
+                with os.fdopen(fd, "wb") as rf:
+                    rf.write(b"".join(chunk))
+                runs.append(run_path)
+                chunk = []
+        chunk.sort()
+
+        fd, tmp_path = tempfile.mkstemp(prefix="idxbuild_", dir=os.path.dirname(index_path))
+        with os.fdopen(fd, "wb") as out:
+            out.write(HEADER.pack(MAGIC, st.st_size, st.st_mtime_ns, count))
+            if runs:
+                merged = heapq.merge(chunk, *[_iter_run(p) for p in runs])
+                buf = []
+                for rec in merged:
+                    buf.append(rec)
+                    if len(buf) >= 65536:
+                        out.write(b"".join(buf))
+                        buf = []
+                out.write(b"".join(buf))
+            else:
+                out.write(b"".join(chunk))
+        os.replace(tmp_path, index_path)
+    finally:
+        for p in runs:
+            try:
+                os.remove(p)
+            except Exception:
+                pass
+    return index_path
+
+
+class WordlistIndex:
+    """Memory-mapped, read-only view of a built index."""
+
+    def __init__(self, wordlist, index_path):
+        self.wordlist = wordlist
+        self.index_path = index_path
+        with open(index_path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.size, self.mtime_ns, self.count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or len(self._mm) != HEADER.size + self.count * RECORD.size:
+            self._mm.close()
+            raise ValueError("corrupt wordlist index")
+        self._wl_fd = os.open(wordlist, os.O_RDONLY)
+
+    def is_current(self):
+        """True if the wordlist still has the size/mtime the index was built from."""
+        try:
+            st = os.stat(self.wordlist)
+        except OSError:
+            return False
+        return st.st_size == self.size and st.st_mtime_ns == self.mtime_ns
+
+    def _prefix(self, i):
+        pos = HEADER.size + i * RECORD.size
+        return self._mm[pos:pos + PREFIX_LEN]
+
+    def _read_line(self, offset):
+        data = b""
+        while True:
+            block = os.pread(self._wl_fd, 256, offset + len(data))
+            if not block:
+                break
+            data += block
+            if b"\n" in block:
+                break
+        return data.split(b"\n", 1)[0].rstrip(b"\r")
+
+    def lookup(self, digest):
+        """Return (password bytes, guess number) for a binary SHA-512 digest, or None."""
+        prefix = digest[:PREFIX_LEN]
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._prefix(mid) < prefix:
+                lo = mid + 1
+            else:
+                hi = mid
+        best = None
+        i = lo
+        while i < self.count and self._prefix(i) == prefix:
+            _, offset, guess_no = RECORD.unpack_from(self._mm, HEADER.size + i * RECORD.size)
+            if best is None or guess_no < best[1]:
+                line = self._read_line(offset)
+                if hashlib.sha512(line).digest() == digest:
+                    best = (line, guess_no)
+            i += 1
+        return best
+
+    def close(self):
+        try:
+            self._mm.close()
+            os.close(self._wl_fd)
+        except Exception:
+            pass
+
+
+def get_index(wordlist, build=True):
+    """Return a current WordlistIndex for `wordlist`, building it if needed.
+
+    The index is rebuilt only when the wordlist's size or mtime changed.
+    Returns None if no index exists and `build` is False.
+    """
+    with _lock:
+        idx = _cache.get(wordlist)
+        if idx is not None and idx.is_current():
+            return idx
+        if idx is not None:
+            idx.close()
+            _cache.pop(wordlist, None)
+
+        index_path = index_path_for(wordlist)
+        if os.path.exists(index_path):
+            try:
+                idx = WordlistIndex(wordlist, index_path)
+                if idx.is_current():
+                    _cache[wordlist] = idx
+                    return idx
+                idx.close()
+            except Exception:
+                pass
+        if not build:
+            return None
+        print(f"building wordlist index for {wordlist} ...")
+        build_index(wordlist, index_path)
+        idx = WordlistIndex(wordlist, index_path)
+        _cache[wordlist] = idx
+        return idx